@@ -29,6 +29,7 @@ import os
 import re
 import shutil
 import sys
+import time
 
 import roundup.instance
 from roundup import __version__ as roundup_version
@@ -1357,6 +1358,64 @@ Command help:
         """
         return self.do_import(args, import_files=False)
 
+    def do_indexqueue(self, args):
+        ''"""Usage: indexqueue [status | run [batch=<integer>] [interval=<seconds>]]
+        Show or process the deferred full-text indexing queue.
+
+        If indexer_deferred is set in the tracker's config.ini,
+        changed items are queued and not indexed directly. If
+        indexer_extract_max_size is set, html content is queued so
+        its text is extracted here.
+
+        'status' (the default) prints the number of queued entries
+        and the age of the oldest entry in seconds.
+
+        'run' indexes the queued items in batches of 'batch' entries
+        (default 100) until the queue is empty. If 'interval' is
+        given, it does not exit but checks the queue every
+        'interval' seconds.
+        """
+        from roundup.backends.indexer_queue import Indexer as QueueIndexer
+
+        if not isinstance(self.db.indexer, QueueIndexer):
+            raise UsageError(_('Deferred indexing is not enabled '
+                               '(indexer_deferred or indexer_extract_max_size '
+                               'in config.ini).'))
+        queue = self.db.indexer
+
+        mode = 'status'
+        if args and '=' not in args[0]:
+            mode = args.pop(0)
+        props = self.props_from_args(args)
+
+        if mode == 'status':
+            if props:
+                raise UsageError(_('status takes no arguments'))
+            count, age = queue.status()
+            print(_('%(count)d queued, oldest %(age)d seconds') % {
+                'count': count, 'age': age})
+            return 0
+
+        if mode != 'run':
+            raise UsageError(_('Unknown mode "%(mode)s"') % {'mode': mode})
+
+        try:
+            batch = int(props.pop('batch', None) or 100)
+            interval = float(props.pop('interval', None) or 0)
+        except ValueError:
+            raise UsageError(_('batch and interval must be numbers'))
+        if props:
+            raise UsageError(_('Unknown argument "%(arg)s"') % {
+                'arg': ', '.join(props)})
+
+        while True:
+            while queue.process(batch):
+                pass
+            if not interval:
+                break
+            time.sleep(interval)
+        return 0
+
     def do_initialise(self, tracker_home, args):
         ''"""Usage: initialise [adminpw]
         Initialise a new Roundup tracker.
@@ -1618,6 +1677,23 @@ Erase it? Y/N: """) % locals())
                   self.db.database_schema['version'])
         return 0
 
+    def do_optimizeindex(self, args):  # noqa: ARG002 - args unused
+        ''"""Usage: optimizeindex
+        Merge the full-text index into a single segment.
+
+        The whoosh and xapian indexers add to the index in segments.
+        Many small segments, e.g. after an import, slow down searches.
+        This merges them (whoosh) or writes a compacted copy of the
+        index (xapian). Documents pending in a batch (see
+        indexer_batch_size in config.ini) are written first.
+        Stop the tracker while optimizing a xapian index, searches
+        running while the copy replaces the index can fail.
+        """
+        if not self.db.indexer.optimize():
+            print(_('The %(indexer)s indexer does not need optimizing.') % {
+                'indexer': self.db.config.INDEXER or 'default'})
+        return 0
+
     def do_pack(self, args):
         ''"""Usage: pack period | date
         Remove journal entries older than the date/period.
@@ -1832,6 +1908,22 @@ Erase it? Y/N: """) % locals())
             self.readline.set_history_length(
                 self.settings['history_length'])
 
+    def do_precompile(self, args):  # noqa: ARG002 - args unused
+        ''"""Usage: precompile
+        Compile the tracker's html templates into the template cache.
+
+        If template_cache is set in the tracker's config.ini,
+        compiled templates are stored in that directory and shared
+        by all processes. Run this after installing or changing
+        templates, so web server processes don't compile them on
+        their first request.
+        """
+        if not self.tracker.config['TEMPLATE_CACHE']:
+            raise UsageError(_('The template cache is not enabled '
+                               '(template_cache in config.ini).'))
+        self.tracker.templates.precompile()
+        return 0
+
     def do_readline(self, args):
         ''"""Usage: readline initrc_line | 'emacs' | 'history' | 'reload' | 'vi'
 
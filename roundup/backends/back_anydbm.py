@@ -453,6 +453,7 @@ class Database(FileStorage, hyperdb.Database, roundupdb.Database):
 
         # add to the destroyednodes map
         self.destroyednodes.setdefault(classname, {})[nodeid] = 1
+        self.note_change(classname)
 
         # add the destroy commit action
         self.transactions.append((self.doDestroyNode, (classname, nodeid)))
@@ -716,6 +717,7 @@ class Database(FileStorage, hyperdb.Database, roundupdb.Database):
 
         # save the indexer state
         self.indexer.save_index()
+        self.save_write_generations()
 
         self.clearCache()
 
@@ -825,6 +827,7 @@ class Database(FileStorage, hyperdb.Database, roundupdb.Database):
         self.newnodes = {}
         self.destroyednodes = {}
         self.transactions = []
+        self.changed_classes = set()
 
     def close(self):
         """ Nothing to do
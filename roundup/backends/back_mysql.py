@@ -207,6 +207,7 @@ class Database(rdbms_common.Database):
                 num INTEGER) ENGINE=%s''' % self.mysql_backend)
             self.sql('create index ids_name_idx on ids(name)')
             self.create_version_2_tables()
+            self._add_word_positions()
 
     def load_dbschema(self):
         ''' Load the schema definition that the database currently implements
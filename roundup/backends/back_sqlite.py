@@ -177,6 +177,7 @@ class Database(rdbms_common.Database):
             self.sql('create index ids_name_idx on ids(name)')
             self.create_version_2_tables()
             self._add_fts5_table()
+            self._add_word_positions()
             # Set journal mode to WAL.
             self.sql_commit()  # close out rollback journal/transaction
             self.sql('pragma journal_mode=wal')  # set wal
@@ -519,6 +520,9 @@ class Database(rdbms_common.Database):
 
 
 class sqliteClass:
+    # dates are stored as YYYYMMDDHHMMSS.sss strings
+    sql_date_day = 'substr(%s, 1, 8)'
+
     def filter(self, *args, **kw):
         """ If there's NO matches to a fetch, sqlite returns NULL
             instead of nothing
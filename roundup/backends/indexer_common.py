@@ -1,3 +1,11 @@
+import hashlib
+import itertools
+import marshal
+import os
+import re
+import tempfile
+import time
+
 from roundup import hyperdb
 
 STOPWORDS = [
@@ -9,10 +17,61 @@ STOPWORDS = [
 ]
 
 
+# query syntax understood by the native indexers: "quoted phrase",
+# prefix* and plain words.
+_query_re = re.compile(r'"([^"]*)"|(\w+)\*|(\w+)', re.UNICODE)
+
+_generation_counter = itertools.count()
+
+
 def _isLink(propclass):
     return (isinstance(propclass, (hyperdb.Link, hyperdb.Multilink)))
 
 
+def encode_positions(positions):
+    """Encode an ascending list of word positions as a compact string.
+
+    Positions are stored as the hex encoded differences to the
+    previous position, e.g. [3, 10, 12] becomes '3,7,2'.
+    """
+    last = 0
+    deltas = []
+    for pos in positions:
+        deltas.append('%x' % (pos - last))
+        last = pos
+    return ','.join(deltas)
+
+
+def decode_positions(encoded):
+    """Inverse of encode_positions, returns a list of positions."""
+    positions = []
+    if not encoded:
+        return positions
+    pos = 0
+    for delta in encoded.split(','):
+        pos += int(delta, 16)
+        positions.append(pos)
+    return positions
+
+
+def phrase_match(offsets, positions):
+    """Check if the words of a phrase occur in sequence.
+
+    offsets is the list of (offset, word) of the phrase words,
+    positions maps each word to the set of positions it has in the
+    indexed text.
+    """
+    first_offset, first_word = offsets[0]
+    for pos in positions[first_word]:
+        start = pos - first_offset
+        for offset, word in offsets[1:]:
+            if start + offset not in positions[word]:
+                break
+        else:
+            return True
+    return False
+
+
 class Indexer:
     def __init__(self, db):
         self.stopwords = set(STOPWORDS)
@@ -27,16 +86,168 @@ class Indexer:
         # Some indexers have a query language. If that is the case,
         # we don't parse the user supplied query into a wordlist.
         self.query_language = False
+        # Results of index lookups are cached in files shared by all
+        # processes. The cache is keyed on a generation that is
+        # replaced when changes to the index are saved.
+        self.cache_size = db.config[('main', 'indexer_cache_size')]
+        self.cache_dir = os.path.join(db.config.DATABASE, 'search-cache')
+        self.cache_dirty = False
 
     def is_stopword(self, word):
         return word in self.stopwords
 
+    def word_positions(self, text):
+        """Split text into upper case words and return a dict mapping
+        each indexable word to the ascending list of its positions.
+        Stopwords are not returned but still take up a position so
+        that phrases spanning them can be found.
+        """
+        positions = {}
+        words = re.findall(r'\b\w{%d,%d}\b' % (self.minlength,
+                                               self.maxlength),
+                           text.upper(), re.UNICODE)
+        for pos, word in enumerate(words):
+            if self.is_stopword(word):
+                continue
+            positions.setdefault(word, []).append(pos)
+        return positions
+
+    def parse_query(self, wordlist):
+        """Parse the search terms for the native indexers.
+
+        Returns a list of (kind, value) tuples that all have to match:
+
+          ('word', WORD)
+          ('prefix', PREFIX) for a search term like prefix*
+          ('phrase', [(offset, WORD), ...]) for a "quoted phrase"
+
+        Words are upper cased. Words that are too short, too long or
+        stopwords are dropped, phrase words keep their offset so they
+        line up with the positions returned by word_positions.
+        """
+        terms = []
+        for match in _query_re.finditer(' '.join(wordlist).upper()):
+            phrase, prefix, word = match.groups()
+            if phrase is not None:
+                offsets = [
+                    (offset, w) for offset, w in enumerate(
+                        w for w in re.findall(r'\w+', phrase, re.UNICODE)
+                        if self.minlength <= len(w) <= self.maxlength)
+                    if not self.is_stopword(w)]
+                if len(offsets) > 1:
+                    terms.append(('phrase', offsets))
+                elif offsets:
+                    terms.append(('word', offsets[0][1]))
+            elif prefix is not None:
+                if self.minlength <= len(prefix) <= self.maxlength:
+                    terms.append(('prefix', prefix))
+            elif (self.minlength <= len(word) <= self.maxlength and
+                  not self.is_stopword(word)):
+                terms.append(('word', word))
+        return terms
+
     def getHits(self, search_terms, klass):
-        return self.find(search_terms)
+        if not self.cache_size:
+            return self.find(search_terms)
+
+        # read the generation before the lookup, a concurrent change
+        # then only makes us store the result for a stale generation
+        generation = self.get_generation()
+        if self.query_language:
+            query = ' '.join(' '.join(search_terms).split())
+        else:
+            query = ' '.join(sorted({w.upper() for w in search_terms}))
+        key = "%s-%s" % (generation, hashlib.sha256(
+            query.encode("utf-8", "replace")).hexdigest())
+        filename = os.path.join(self.cache_dir, key)
+        try:
+            with open(filename, 'rb') as f:
+                return marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+        # store plain tuples, rdbms backends may return row objects
+        hits = [tuple(hit) for hit in self.find(search_terms)]
+        self.store_cache_entry(filename, hits)
+        return hits
+
+    def get_generation(self):
+        """Return the generation of the saved index."""
+        try:
+            with open(os.path.join(self.cache_dir, 'generation')) as f:
+                return f.read() or '0'
+        except OSError:
+            return '0'
+
+    def bump_generation(self):
+        """Invalidate cached search results after the index changed.
+
+        Indexers set cache_dirty when text is added or removed and
+        call this once the change is visible to other processes.
+        """
+        if not self.cache_dirty:
+            return
+        self.cache_dirty = False
+        if not self.cache_size:
+            return
+        # a unique value, a counter could be incremented to the same
+        # value by two processes saving the index at the same time
+        generation = '%.6f_%d_%d' % (time.time(), os.getpid(),
+                                     next(_generation_counter))
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp = os.path.join(self.cache_dir, 'generation.' + generation)
+        with open(tmp, 'w') as f:
+            f.write(generation)
+        os.replace(tmp, os.path.join(self.cache_dir, 'generation'))
+
+        # remove the entries of older generations
+        for name in os.listdir(self.cache_dir):
+            if name[0].isdigit() and not name.startswith(generation + '-'):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    # removed by another process
+                    pass
+
+    def store_cache_entry(self, filename, hits):
+        """Write a cache entry, evicting the oldest entries if the
+        cache is full.
+        """
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            entries = [os.path.join(self.cache_dir, name)
+                       for name in os.listdir(self.cache_dir)
+                       if name[0].isdigit()]
+            if len(entries) >= self.cache_size:
+                entries.sort(key=os.path.getmtime)
+                for entry in entries[:len(entries) - self.cache_size + 1]:
+                    os.remove(entry)
+            # write under a unique temporary name so readers never see
+            # a partial entry; the leading dot keeps it out of the
+            # entries counted above
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix='.')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(marshal.dumps(hits))
+                os.replace(tmp, filename)
+            except Exception:  # noqa: BLE001
+                os.remove(tmp)
+                raise
+        except (OSError, ValueError):
+            # the cache is an optimisation, never fail the search
+            pass
 
     def save_index(self):
         pass
 
+    def optimize(self):
+        """Merge the index files to speed up searches. Returns False
+        if the indexer has nothing to optimize.
+        """
+        return False
+
     def search(self, search_terms, klass, ignore=None):
         """Display search results looking for [search, terms] associated
         with the hyperdb Class "klass". Ignore hits on {class: property}.
@@ -117,7 +328,111 @@ class Indexer:
         return nodeids
 
 
+class BatchIndexer(Indexer):
+    """Base for indexers that create a new index segment on every
+    commit (whoosh and xapian).
+
+    If indexer_batch_size or indexer_batch_interval is set, added
+    documents are collected and written to the index with a single
+    writer by write_documents() once the number of documents or the
+    age of the oldest document reaches the limit. Only documents of
+    saved transactions are written, a rollback drops the others.
+    Remaining saved documents are written on close().
+    """
+    def __init__(self, db):
+        Indexer.__init__(self, db)
+        self.batch_size = db.config[('main', 'indexer_batch_size')]
+        self.batch_interval = db.config[('main', 'indexer_batch_interval')]
+        # documents of saved transactions, identifier -> text
+        self.batch = {}
+        # documents of the current transaction
+        self.uncommitted = {}
+        self.batch_start = None
+
+    def batching(self):
+        return bool(self.batch_size or self.batch_interval)
+
+    def batch_document(self, identifier, text):
+        """Add a document to the current batch. A document added
+        again replaces the earlier text.
+        """
+        if self.batch_start is None:
+            self.batch_start = time.time()
+        self.uncommitted[identifier] = text
+        if self.batch and self.batch_size and (
+                len(self.batch) + len(self.uncommitted) >= self.batch_size):
+            # don't hold back the saved documents in a long
+            # transaction (reindex), the uncommitted ones can still
+            # be rolled back
+            self.flush_batch()
+
+    def save_batch(self):
+        """Called from save_index, writes the batch if it is due."""
+        self.batch.update(self.uncommitted)
+        self.uncommitted = {}
+        if not self.batch:
+            return
+        if ((self.batch_size and len(self.batch) >= self.batch_size) or
+                (self.batch_interval and
+                 time.time() - self.batch_start >= self.batch_interval)):
+            self.flush_batch()
+
+    def rollback_batch(self):
+        self.uncommitted = {}
+        if not self.batch:
+            self.batch_start = None
+
+    def flush_batch(self):
+        """Write the documents of saved transactions to the index."""
+        self.batch_start = time.time() if self.uncommitted else None
+        if not self.batch:
+            return
+        documents, self.batch = self.batch, {}
+        self.write_documents(documents)
+        self.cache_dirty = True
+        self.bump_generation()
+
+    def write_documents(self, documents):
+        """Write the documents (a dict identifier -> text) to the
+        index with a single writer and commit them.
+
+        Subclasses must implement this. The identifiers and texts are
+        the ones the subclass passed to batch_document(), so they are
+        already in the form the index stores. It can't fall back to
+        add_text() which would put the documents back in the batch.
+        """
+        raise NotImplementedError(
+            '%s must implement write_documents' % type(self).__name__)
+
+
+def register_extractor(mime_type, extractor):
+    """Register a function to extract the text to index from content
+    of the given mime type. The function is called with the content
+    (truncated to indexer_extract_max_size) and returns plain text.
+    """
+    extractors[mime_type] = extractor
+
+
+def html_extractor(html):
+    """Extract the text of an html document for indexing."""
+    from roundup.dehtml import dehtml
+    return dehtml("dehtml").html2text(html)
+
+
+extractors = {}
+register_extractor('text/html', html_extractor)
+
+
 def get_indexer(config, db):
+    indexer = get_indexer_backend(config, db)
+    if (getattr(config, "INDEXER_DEFERRED", False) or
+            getattr(config, "INDEXER_EXTRACT_MAX_SIZE", 0)):
+        from roundup.backends.indexer_queue import Indexer as QueueIndexer
+        return QueueIndexer(db, indexer)
+    return indexer
+
+
+def get_indexer_backend(config, db):
     indexer_name = getattr(config, "INDEXER", "")
     if not indexer_name:
         # Try everything
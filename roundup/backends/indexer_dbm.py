@@ -20,6 +20,7 @@ messages, string properties and text files possible.
 '''
 __docformat__ = 'restructuredtext'
 
+import bisect
 import marshal
 import os
 import re
@@ -27,6 +28,9 @@ import shutil
 import zlib
 
 from roundup.backends.indexer_common import Indexer as IndexerBase
+from roundup.backends.indexer_common import (decode_positions,
+                                             encode_positions,
+                                             phrase_match)
 
 
 class Indexer(IndexerBase):
@@ -36,10 +40,12 @@ class Indexer(IndexerBase):
     Three structures are created by the indexer::
 
           files   {identifier: (fileid, wordcount)}
-          words   {word: {fileid: count}}
+          words   {word: {fileid: positions}}
           fileids {fileid: identifier}
 
-    where identifier is (classname, nodeid, propertyname)
+    where identifier is (classname, nodeid, propertyname) and
+    positions is the delta encoded list of word positions (see
+    indexer_common.encode_positions) used for phrase searches.
     '''
     def __init__(self, db):
         IndexerBase.__init__(self, db)
@@ -48,6 +54,8 @@ class Indexer(IndexerBase):
         self.reindex = 0
         self.quiet = 9
         self.changed = 0
+        self.query_language = True
+        self.sorted_words = None
 
         # see if we need to reindex because of a change in code
         version = os.path.join(self.indexdb_path, 'version')
@@ -59,7 +67,7 @@ class Indexer(IndexerBase):
             with open(version) as fd:
                 version = fd.read()
             # check the value and reindex if it's not the latest
-            if version.strip() != '1':
+            if version.strip() != '2':
                 self.force_reindex()
 
     def force_reindex(self):
@@ -70,7 +78,7 @@ class Indexer(IndexerBase):
         os.makedirs(self.indexdb_path)
         os.chmod(self.indexdb_path, 0o775)  # noqa: S103 allow group write
         with open(os.path.join(self.indexdb_path, 'version'), 'w') as fd:
-            fd.write('1\n')
+            fd.write('2\n')
         self.reindex = 1
         self.changed = 1
 
@@ -100,31 +108,33 @@ class Indexer(IndexerBase):
         self.files[identifier] = (file_index, len(words))
         self.fileids[file_index] = identifier
 
-        # find the unique words
+        # find the unique words and where they occur
         filedict = {}
-        for word in words:
+        for pos, word in enumerate(words):
             if self.is_stopword(word):
                 continue
             if word in filedict:
-                filedict[word] = filedict[word] + 1
+                filedict[word].append(pos)
             else:
-                filedict[word] = 1
+                filedict[word] = [pos]
 
         # now add to the totals
-        for word, word_dict in filedict.items():
-            # each word has a dict of {identifier: count}
+        for word, positions in filedict.items():
+            # each word has a dict of {identifier: positions}
             if word in self.words:
                 entry = self.words[word]
             else:
                 # new word
                 entry = {}
                 self.words[word] = entry
+                self.sorted_words = None
 
             # make a reference to the file for this word
-            entry[file_index] = word_dict
+            entry[file_index] = encode_positions(positions)
 
         # save needed
         self.changed = 1
+        self.cache_dirty = True
 
     def splitter(self, text, ftype):
         '''Split the contents of a text string into a list of 'words'
@@ -148,41 +158,67 @@ class Indexer(IndexerBase):
         return re.findall(r'\b\w{%d,%d}\b' % (self.minlength, self.maxlength),
                           text, re.UNICODE)
 
-    # we override this to ignore too short and too long words
-    # and also to fix a bug - the (fail) case.
     def find(self, wordlist):
-        '''Locate files that match ALL the words in wordlist
+        '''Locate files that match ALL the terms in wordlist
+
+        Terms are words, "quoted phrases" or prefix* (see parse_query).
         '''
         if not hasattr(self, 'words'):
             self.load_index()
-        self.load_index(wordlist=wordlist)
-        entries = {}
         hits = None
-        for word in wordlist:
-            if not self.minlength <= len(word) <= self.maxlength:
-                # word outside the bounds of what we index - ignore
-                continue
-            word = word.upper()  # noqa: PLW2901  # set loop var is ok
-            if self.is_stopword(word):
-                continue
-            entry = self.words.get(word)    # For each word, get index
-            entries[word] = entry           # of matching files
-            if not entry:                   # Nothing for this one word (fail)
-                return {}
-            if hits is None:
-                hits = {}
-                for k in entry:
-                    if k not in self.fileids:
-                        raise ValueError('Index is corrupted: re-generate it')
-                    hits[k] = self.fileids[k]
+        for kind, value in self.parse_query(wordlist):
+            if kind == 'word':
+                found = set(self.words.get(value, ()))
+            elif kind == 'prefix':
+                found = set()
+                for word in self.expand_prefix(value):
+                    found.update(self.words[word])
             else:
-                # Eliminate hits for every non-match
-                for fileid in list(hits):
-                    if fileid not in entry:
-                        del hits[fileid]
+                found = self.find_phrase(value)
+            if hits is not None:
+                found &= hits
+            if not found:                   # Nothing for this term (fail)
+                return []
+            hits = found
         if hits is None:
-            return {}
-        return list(hits.values())
+            return []
+        for fileid in hits:
+            if fileid not in self.fileids:
+                raise ValueError('Index is corrupted: re-generate it')
+        return [self.fileids[fileid] for fileid in hits]
+
+    def expand_prefix(self, prefix):
+        '''Return the indexed words starting with prefix.
+
+        The sorted word list is kept around so the expansion is a
+        binary search plus a scan over the matching range.
+        '''
+        if self.sorted_words is None:
+            self.sorted_words = sorted(self.words)
+        words = []
+        i = bisect.bisect_left(self.sorted_words, prefix)
+        while (i < len(self.sorted_words) and
+               self.sorted_words[i].startswith(prefix)):
+            words.append(self.sorted_words[i])
+            i += 1
+        return words
+
+    def find_phrase(self, offsets):
+        '''Return the file ids containing the (offset, word) list
+        offsets as a phrase.
+        '''
+        entries = [self.words.get(word, {}) for offset, word in offsets]
+        candidates = set(entries[0])
+        for entry in entries[1:]:
+            candidates &= set(entry)
+        found = set()
+        for fileid in candidates:
+            positions = {}
+            for (offset, word), entry in zip(offsets, entries):
+                positions[word] = set(decode_positions(entry[fileid]))
+            if phrase_match(offsets, positions):
+                found.add(fileid)
+        return found
 
     segments = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ#_-!"
 
@@ -230,6 +266,7 @@ class Indexer(IndexerBase):
         self.words = db['WORDS']
         self.files = db['FILES']
         self.fileids = db['FILEIDS']
+        self.sorted_words = None
         self.changed = 0
 
     def save_index(self):
@@ -273,6 +310,7 @@ class Indexer(IndexerBase):
 
         # save done
         self.changed = 0
+        self.bump_generation()
 
     def purge_entry(self, identifier):
         '''Remove a file from file index and word index
@@ -293,6 +331,7 @@ class Indexer(IndexerBase):
 
         # save needed
         self.changed = 1
+        self.cache_dirty = True
 
     def index_loaded(self):
         return (hasattr(self, 'fileids') and hasattr(self, 'files') and
@@ -34,8 +34,9 @@ class Indexer(IndexerBase):
 
     def save_index(self):
         """Save the changes to the index."""
-        # not necessary - the RDBMS connection will handle this for us
-        pass
+        # not necessary - the RDBMS connection will handle this for us.
+        # We are called after the commit, invalidate cached searches.
+        self.bump_generation()
 
     def force_reindex(self):
         """Force a reindexing of the database.  This essentially
@@ -51,6 +52,7 @@ class Indexer(IndexerBase):
         """ "identifier" is  (classname, itemid, property) """
         if mime_type != 'text/plain':
             return
+        self.cache_dirty = True
 
         # Ensure all elements of the identifier are strings 'cos the itemid
         # column is varchar even if item ids may be numbers elsewhere in the
@@ -0,0 +1,177 @@
+""" This implements deferred full-text indexing.
+
+If the indexer_deferred option is set in config.ini, the configured
+indexer is wrapped by the Indexer class below. Adding text to the
+index then only records the (classname, itemid, property) identifier.
+The identifiers are written to a spool directory when the transaction
+is saved and are indexed later by "roundup-admin indexqueue run".
+
+If indexer_extract_max_size is set, text of a mime type with a
+registered extractor (see indexer_common.register_extractor) is
+always queued, so the extraction is done by the queue worker and
+not while handling a web or email submission.
+
+Items that can not be indexed (e.g. an extractor fails on a file) are
+logged and appended to the index-queue-rejected file in the database
+directory, so they do not block the queue.
+"""
+import itertools
+import logging
+import os
+import time
+
+from roundup.backends.indexer_common import extractors
+
+_counter = itertools.count()
+
+logger = logging.getLogger('roundup.indexer')
+
+
+class Indexer:
+    def __init__(self, db, indexer):
+        self.db = db
+        # the indexer doing the real work, all searching is done by it
+        self.indexer = indexer
+        self.spool_dir = os.path.join(db.config.DATABASE, 'index-queue')
+        self.reject_file = os.path.join(db.config.DATABASE,
+                                        'index-queue-rejected')
+        self.deferred = db.config.INDEXER_DEFERRED
+        self.extract_max_size = db.config.INDEXER_EXTRACT_MAX_SIZE
+        self.pending = []
+        # set while process() indexes the queued items
+        self.processing = False
+
+    def __getattr__(self, name):
+        return getattr(self.indexer, name)
+
+    def add_text(self, identifier, text, mime_type='text/plain'):
+        """Queue the (classname, itemid, property) identifier. The text
+        is read from the item when the queue is processed.
+
+        When called from process() the text is passed on to the real
+        indexer, converted by the extractor for its mime type.
+        """
+        extract = self.extract_max_size and mime_type in extractors
+        if self.processing:
+            if extract:
+                text = extractors[mime_type](text[:self.extract_max_size])
+                mime_type = 'text/plain'
+            self.indexer.add_text(identifier, text, mime_type)
+        elif self.deferred or extract:
+            self.pending.append(tuple(map(str, identifier)))
+        else:
+            self.indexer.add_text(identifier, text, mime_type)
+
+    def save_index(self):
+        """Write the queued identifiers to the spool directory.
+
+        This is called after the database commit so the indexer will
+        see the committed values.
+        """
+        if self.pending:
+            if not os.path.exists(self.spool_dir):
+                os.makedirs(self.spool_dir)
+            # the name sorts by time of the commit
+            name = '%017.6f-%d-%d' % (time.time(), os.getpid(),
+                                      next(_counter))
+            tmp = os.path.join(self.spool_dir, '.' + name)
+            with open(tmp, 'w') as f:
+                for identifier in self.pending:
+                    f.write('\t'.join(identifier) + '\n')
+            os.replace(tmp, os.path.join(self.spool_dir, name))
+            self.pending = []
+        self.indexer.save_index()
+
+    def rollback(self):
+        self.pending = []
+        self.indexer.rollback()
+
+    def close(self):
+        self.indexer.close()
+        # nuke the circular reference
+        self.db = None
+
+    def queue_files(self):
+        """Return the names of the spool files in commit order."""
+        try:
+            return sorted(name for name in os.listdir(self.spool_dir)
+                          if not name.startswith('.'))
+        except FileNotFoundError:
+            return []
+
+    def read_queue_file(self, name):
+        try:
+            with open(os.path.join(self.spool_dir, name)) as f:
+                return [tuple(line.rstrip('\n').split('\t'))
+                        for line in f if line.strip()]
+        except FileNotFoundError:
+            # processed by another worker
+            return []
+
+    def status(self):
+        """Return the number of queued identifiers and the age in
+        seconds of the oldest entry (0 if the queue is empty).
+        """
+        files = self.queue_files()
+        count = sum(len(self.read_queue_file(name)) for name in files)
+        if not files:
+            return 0, 0
+        return count, max(0, time.time() - float(files[0].split('-')[0]))
+
+    def process(self, batch_size=100):
+        """Index the items queued in the oldest spool files.
+
+        Spool files are read until at least batch_size identifiers
+        are collected. Every item is indexed once even if it was
+        changed several times. An item that fails to index is logged
+        and written to the reject file. The index is committed and the
+        spool files are removed afterwards. Returns the number of
+        queued identifiers processed.
+        """
+        names = []
+        items = {}
+        count = 0
+        for name in self.queue_files():
+            if count >= batch_size:
+                break
+            names.append(name)
+            for identifier in self.read_queue_file(name):
+                count += 1
+                items[identifier[:2]] = 1
+        if not names:
+            return 0
+
+        rejected = []
+        self.processing = True
+        try:
+            for classname, itemid in items:
+                try:
+                    klass = self.db.getclass(classname)
+                except KeyError:
+                    # class was removed from the schema
+                    continue
+                if not klass.hasnode(itemid):
+                    # item was destroyed
+                    continue
+                try:
+                    klass.index(itemid)
+                except Exception:
+                    logger.exception('Unable to index %s%s, rejected',
+                                     classname, itemid)
+                    rejected.append((classname, itemid))
+            self.db.commit()
+        finally:
+            self.processing = False
+
+        if rejected:
+            with open(self.reject_file, 'a') as f:
+                for identifier in rejected:
+                    f.write('\t'.join(identifier) + '\n')
+
+        for name in names:
+            try:
+                os.remove(os.path.join(self.spool_dir, name))
+            except FileNotFoundError:
+                # processed by another worker
+                pass
+        return count
@@ -2,10 +2,11 @@
 is a mapping of words to occurance IDs. The second maps the IDs to (Class,
 propname, itemid) instances.
 """
-import re
-
-from roundup.anypy.strings import u2s, us2u
+from roundup.anypy.strings import s2u, u2s, us2u
 from roundup.backends.indexer_common import Indexer as IndexerBase
+from roundup.backends.indexer_common import (decode_positions,
+                                             encode_positions,
+                                             phrase_match)
 
 
 class Indexer(IndexerBase):
@@ -13,6 +14,7 @@ class Indexer(IndexerBase):
         IndexerBase.__init__(self, db)
         self.db = db
         self.reindex = 0
+        self.query_language = True
 
     def close(self):
         """close the indexing database"""
@@ -21,8 +23,9 @@ class Indexer(IndexerBase):
 
     def save_index(self):
         """Save the changes to the index."""
-        # not necessary - the RDBMS connection will handle this for us
-        pass
+        # not necessary - the RDBMS connection will handle this for us.
+        # We are called after the commit, invalidate cached searches.
+        self.bump_generation()
 
     def force_reindex(self):
         """Force a reindexing of the database.  This essentially
@@ -38,6 +41,7 @@ class Indexer(IndexerBase):
         """ "identifier" is  (classname, itemid, property) """
         if mime_type != 'text/plain':
             return
+        self.cache_dirty = True
 
         # Ensure all elements of the identifier are strings 'cos the itemid
         # column is varchar even if item ids may be numbers elsewhere in the
@@ -62,53 +66,66 @@ class Indexer(IndexerBase):
             sql = 'delete from __words where _textid=%s' % a
             self.db.cursor.execute(sql, (text_id, ))
 
-        # ok, find all the unique words in the text
+        # ok, find all the unique words in the text and their positions
         text = us2u(text, "replace")
-        text = text.upper()
-        wordlist = [u2s(w)
-                    for w in re.findall(r'(?u)\b\w{%d,%d}\b'
-                                        % (self.minlength, self.maxlength),
-                                        text)]
-        words = set()
-        for word in wordlist:
-            if self.is_stopword(word):
-                continue
-            words.add(word)
+        positions = self.word_positions(text)
 
         # for each word, add an entry in the db
-        sql = 'insert into __words (_word, _textid) values (%s, %s)' % (a, a)
-        words = [(word, text_id) for word in words]
+        sql = 'insert into __words (_word, _textid, _positions) '\
+            'values (%s, %s, %s)' % (a, a, a)
+        words = [(u2s(word), text_id, encode_positions(pos))
+                 for word, pos in positions.items()]
         self.db.cursor.executemany(sql, words)
 
     def find(self, wordlist):
-        """look up all the words in the wordlist.
-        If none are found return an empty dictionary
-        * more rules here
+        """look up all the terms in the wordlist.
+        If none are found return an empty list.
+
+        Terms are words, "quoted phrases" or prefix* (see
+        parse_query). Plain words are intersected in the database,
+        prefixes and phrases are resolved to text ids first.
         """
         if not wordlist:
             return []
 
-        a = self.db.arg  # placeholder for prepared statement
-        cap_wl = [word.upper() for word in wordlist
-                  if self.minlength <= len(word) <= self.maxlength]
-        clean_wl = [word for word in cap_wl if not self.is_stopword(word)]
-
-        if not clean_wl:
+        terms = self.parse_query(wordlist)
+        if not terms:
             return []
 
+        clean_wl = [value for kind, value in terms if kind == 'word']
+        textids = None
+        if clean_wl:
+            textids = set(self.find_words(clean_wl))
+            if not textids:
+                return []
+        for kind, value in terms:
+            if kind == 'prefix':
+                found = self.find_prefix(value)
+            elif kind == 'phrase':
+                found = self.find_phrase(value)
+            else:
+                continue
+            if textids is not None:
+                found &= textids
+            if not found:
+                return []
+            textids = found
+
+        a = ','.join([self.db.arg] * len(textids))
+        sql = 'select _class, _itemid, _prop from __textids '\
+            'where _textid in (%s)' % a
+        self.db.cursor.execute(sql, tuple(textids))
+        return self.db.cursor.fetchall()
+
+    def find_words(self, clean_wl):
+        """Return the ids of the texts containing all the words."""
+        a = self.db.arg  # placeholder for prepared statement
+
         if self.db.implements_intersect:
             # simple AND search
             sql = 'select distinct(_textid) from __words where _word=%s' % a
             sql = '\nINTERSECT\n'.join([sql] * len(clean_wl))
             self.db.cursor.execute(sql, tuple(clean_wl))
-            r = self.db.cursor.fetchall()
-            if not r:
-                return []
-            a = ','.join([a] * len(r))
-            sql = 'select _class, _itemid, _prop from __textids '\
-                'where _textid in (%s)' % a
-            self.db.cursor.execute(sql, tuple(int(row[0]) for row in r))
-
         else:
             # A more complex version for MySQL since it doesn't
             # implement INTERSECT
@@ -132,14 +149,35 @@ class Indexer(IndexerBase):
                          ' '.join(match_list))
             self.db.cursor.execute(sql, clean_wl)
 
-            r = [x[0] for x in self.db.cursor.fetchall()]
-            if not r:
-                return []
-
-            a = ','.join([a] * len(r))
-            sql = 'select _class, _itemid, _prop from __textids '\
-                'where _textid in (%s)' % a
+        return [int(row[0]) for row in self.db.cursor.fetchall()]
 
-            self.db.cursor.execute(sql, tuple(map(int, r)))
-
-        return self.db.cursor.fetchall()
+    def find_prefix(self, prefix):
+        """Return the set of text ids containing a word starting with
+        prefix. The word index makes this a range scan.
+        """
+        a = self.db.arg
+        # all words starting with prefix sort before this one
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        sql = 'select _word, _textid from __words '\
+            'where _word >= %s and _word < %s' % (a, a)
+        self.db.cursor.execute(sql, (u2s(prefix), u2s(upper)))
+        # recheck, the collation of the database may order differently
+        return {int(row[1]) for row in self.db.cursor.fetchall()
+                if s2u(row[0]).startswith(prefix)}
+
+    def find_phrase(self, offsets):
+        """Return the set of text ids containing the (offset, word)
+        list offsets as a phrase.
+        """
+        words = {word for offset, word in offsets}
+        a = ','.join([self.db.arg] * len(words))
+        sql = 'select _textid, _word, _positions from __words '\
+            'where _word in (%s)' % a
+        self.db.cursor.execute(sql, tuple(u2s(w) for w in words))
+        texts = {}
+        for row in self.db.cursor.fetchall():
+            texts.setdefault(int(row[0]), {})[s2u(row[1])] = set(
+                decode_positions(row[2]))
+        return {textid for textid, positions in texts.items()
+                if len(positions) == len(words) and
+                phrase_match(offsets, positions)}
@@ -5,12 +5,12 @@ import os
 from whoosh import analysis, fields, index, query
 
 from roundup.anypy.strings import us2u
-from roundup.backends.indexer_common import Indexer as IndexerBase
+from roundup.backends.indexer_common import BatchIndexer
 
 
-class Indexer(IndexerBase):
+class Indexer(BatchIndexer):
     def __init__(self, db):
-        IndexerBase.__init__(self, db)
+        BatchIndexer.__init__(self, db)
         self.db_path = db.config.DATABASE
         self.reindex = 0
         self.writer = None
@@ -37,17 +37,25 @@ class Indexer(IndexerBase):
 
     def save_index(self):
         '''Save the changes to the index.'''
+        if self.batching():
+            self.save_batch()
+            return
         if not self.writer:
             return
         self.writer.commit()
         self.deleted = set()
         self.writer = None
+        self.bump_generation()
 
     def close(self):
         '''close the indexing database'''
-        pass
+        if self.batching():
+            self.flush_batch()
 
     def rollback(self):
+        if self.batching():
+            self.rollback_batch()
+            return
         if not self.writer:
             return
         self.writer.cancel()
@@ -87,6 +95,10 @@ class Indexer(IndexerBase):
         # indexed so we know what we're matching when we get results
         identifier = u"%s:%s:%s" % identifier
 
+        if self.batching():
+            self.batch_document(identifier, text)
+            return
+
         # FIXME need to enhance this to handle the whoosh.store.LockError
         # that maybe raised if there is already another process with a lock.
         writer = self._get_writer()
@@ -104,8 +116,25 @@ class Indexer(IndexerBase):
         # Note: use '.lower()' because it seems like Whoosh gets
         # better results that way.
         writer.add_document(identifier=identifier, content=text)
+        self.cache_dirty = True
         self.save_index()
 
+    def write_documents(self, documents):
+        '''Add a batch of documents using a single writer.'''
+        writer = self._get_index().writer()
+        for identifier, text in documents.items():
+            # identifier is a unique field, update_document replaces
+            # an older version of the document
+            writer.update_document(identifier=identifier, content=text)
+        writer.commit()
+
+    def optimize(self):
+        '''Merge all index segments into one.'''
+        if self.batching():
+            self.flush_batch()
+        self._get_index().optimize()
+        return True
+
     def find(self, wordlist):
         '''look up all the words in the wordlist.
         If none are found return an empty dictionary
@@ -2,12 +2,13 @@
 '''
 import os
 import re
+import shutil
 import time
 
 import xapian
 
 from roundup.anypy.strings import b2s, s2b
-from roundup.backends.indexer_common import Indexer as IndexerBase
+from roundup.backends.indexer_common import BatchIndexer
 from roundup.i18n import _
 
 # Note that Xapian always uses UTF-8 encoded string, see
@@ -16,9 +17,9 @@ from roundup.i18n import _
 # Python..."
 
 
-class Indexer(IndexerBase):
+class Indexer(BatchIndexer):
     def __init__(self, db):
-        IndexerBase.__init__(self, db)
+        BatchIndexer.__init__(self, db)
         self.db_path = db.config.DATABASE
         self.reindex = 0
         self.transaction_active = False
@@ -41,6 +42,11 @@ class Indexer(IndexerBase):
 
     def save_index(self):
         '''Save the changes to the index.'''
+        if self.batching():
+            self.save_batch()
+            return
+        # documents are written by add_text, invalidate cached searches
+        self.bump_generation()
         if not self.transaction_active:
             return
         database = self._get_database()
@@ -49,9 +55,13 @@ class Indexer(IndexerBase):
 
     def close(self):
         '''close the indexing database'''
-        pass
+        if self.batching():
+            self.flush_batch()
 
     def rollback(self):
+        if self.batching():
+            self.rollback_batch()
+            return
         if not self.transaction_active:
             return
         database = self._get_database()
@@ -75,6 +85,10 @@ class Indexer(IndexerBase):
         if not text:
             text = ''
 
+        if self.batching():
+            self.batch_document(identifier, text)
+            return
+
         # open the database and start a transaction if needed
         database = self._get_database()
 
@@ -84,6 +98,12 @@ class Indexer(IndexerBase):
         #      database.begin_transaction()
         #      self.transaction_active = True
 
+        identifier, doc = self._make_document(identifier, text)
+        database.replace_document(identifier, doc)
+        self.cache_dirty = True
+
+    def _make_document(self, identifier, text):
+        '''Return the key and the xapian document for the text.'''
         stemmer = xapian.Stem(self.language)
 
         # We use the identifier twice: once in the actual "text" being
@@ -104,8 +124,42 @@ class Indexer(IndexerBase):
                 continue
             term = stemmer(s2b(word.lower()))
             doc.add_posting(term, match.start(0))
+        return identifier, doc
 
-        database.replace_document(identifier, doc)
+    def write_documents(self, documents):
+        '''Add a batch of documents with a single commit.'''
+        database = self._get_database()
+        for identifier, text in documents.items():
+            database.replace_document(*self._make_document(identifier,
+                                                           text))
+        database.commit()
+        database.close()
+
+    def optimize(self):
+        '''Compact the database into a new copy and replace the
+        original with it.
+
+        The write lock is held while compacting so no changes are
+        lost, but the swap renames the index directory: searches
+        opening the index between the two renames fail and open
+        readers lose their files. Run it while the tracker is
+        quiescent.'''
+        if self.batching():
+            self.flush_batch()
+        index = os.path.join(self.db_path, 'text-index')
+        compacted = index + '.compact'
+        old = index + '.old'
+        for path in (compacted, old):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        # hold the write lock so no changes are lost while compacting
+        database = self._get_database()
+        database.compact(compacted)
+        os.rename(index, old)
+        os.rename(compacted, index)
+        database.close()
+        shutil.rmtree(old)
+        return True
 
     def find(self, wordlist):
         '''look up all the words in the wordlist.
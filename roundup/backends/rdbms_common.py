@@ -359,7 +359,7 @@ class Database(FileStorage, hyperdb.Database, roundupdb.Database):
 
     # update this number when we need to make changes to the SQL structure
     # of the backend database
-    current_db_version = 8
+    current_db_version = 9
     db_version_updated = False
 
     def upgrade_db(self):
@@ -413,6 +413,10 @@ class Database(FileStorage, hyperdb.Database, roundupdb.Database):
             self.log_info('upgrade to version 8')
             self.fix_version_7_tables()
 
+        if version < 9:
+            self.log_info('upgrade to version 9')
+            self.fix_version_8_tables()
+
         self.database_schema['version'] = self.current_db_version
         self.db_version_updated = True
         return 1
@@ -461,6 +465,22 @@ class Database(FileStorage, hyperdb.Database, roundupdb.Database):
         # You would think ALTER commands would be the same but nooo.
         pass
 
+    def fix_version_8_tables(self):
+        # store word positions in the native full-text index. Existing
+        # index entries have no positions so the index is rebuilt.
+        self._add_word_positions()
+        from roundup.backends.indexer_rdbms import Indexer
+        # unwrap the indexer if indexing is deferred
+        indexer = getattr(self.indexer, 'indexer', self.indexer)
+        if isinstance(indexer, Indexer):
+            indexer.force_reindex()
+
+    def _add_word_positions(self):
+        # an upgrade from version 1 creates __words with the column
+        self.sql('select * from __words where 1=0')
+        if '_positions' not in [d[0] for d in self.cursor.description]:
+            self.sql('ALTER TABLE __words ADD _positions TEXT')
+
     def _convert_journal_tables(self):
         """Get current journal table contents, drop the table and re-create"""
         c = self.cursor
@@ -1330,6 +1350,7 @@ class Database(FileStorage, hyperdb.Database, roundupdb.Database):
         # see if we have this node cached
         if (classname, nodeid) in self.cache:
             del self.cache[(classname, nodeid)]
+        self.note_change(classname)
 
         # see if there's any obvious commit actions that we should get rid of
         for entry in self.transactions[:]:
@@ -1580,6 +1601,7 @@ class Database(FileStorage, hyperdb.Database, roundupdb.Database):
 
         # save the indexer
         self.indexer.save_index()
+        self.save_write_generations()
 
         # clear out the transactions
         self.transactions = []
@@ -1601,6 +1623,7 @@ class Database(FileStorage, hyperdb.Database, roundupdb.Database):
         logging.getLogger('roundup.hyperdb.backend').info('rollback')
 
         self.sql_rollback()
+        self.changed_classes = set()
 
         # roll back "other" transaction stuff
         for method, args in self.transactions:
@@ -1660,6 +1683,10 @@ class Class(hyperdb.Class):
     # Assuming DBs can do subselects, overwrite if they cannot.
     supports_subselects = True
 
+    # SQL expression for the day of a Date column, used by aggregate.
+    # The result is converted with _sql_day_to_date.
+    sql_date_day = 'date(%s)'
+
     def schema(self):
         """ A dumpable version of the schema that we can store in the
             database
@@ -2499,6 +2526,34 @@ class Class(hyperdb.Class):
         ids = [str(x[0]) for x in self.db.cursor.fetchall()]
         return ids
 
+    def journal_counts(self, since, action, propname=None):
+        """See hyperdb.Class.journal_counts. The entries are counted
+        by the database, for a propname only the parameters of the
+        entries mentioning it are decoded.
+        """
+        a = self.db.arg
+        args = [self.db.to_sql_value(Date)(since), action]
+        if propname is None:
+            sql = ('select nodeid, count(*) from %s__journal where '
+                   'date>=%s and action=%s group by nodeid' % (
+                       self.classname, a, a))
+            self.db.sql(sql, args)
+            # nodeid is an integer column, hyperdb ids are strings
+            return {str(nodeid): int(n) for nodeid, n in
+                    self.db.cursor.fetchall()}
+        # the parameters are the repr of a dict, check the matches
+        sql = ('select nodeid, params from %s__journal where date>=%s '
+               'and action=%s and params like %s' % (
+                   self.classname, a, a, a))
+        self.db.sql(sql, args + ["%%'%s':%%" % propname])
+        counts = {}
+        for nodeid, params in self.db.cursor.fetchall():
+            params = eval_import(params)
+            if isinstance(params, dict) and propname in params:
+                nodeid = str(nodeid)
+                counts[nodeid] = counts.get(nodeid, 0) + 1
+        return counts
+
     def _subselect(self, proptree, parentname=None):
         """Create a subselect. This is factored out because some
            databases (hmm only one, so far) doesn't support subselects
@@ -3163,6 +3218,116 @@ class Class(hyperdb.Class):
             yield str(row[0])
         cursor.close()
 
+    def prefetch(self, nodeids, propnames=()):
+        """Load the given nodes into the node cache using filter_iter,
+        and the Multilink properties in propnames with one query per
+        property.
+        """
+        missing = [nodeid for nodeid in nodeids
+                   if (self.classname, nodeid) not in self.db.cache]
+        if missing:
+            for _nodeid in self.filter_iter(None, {'id': missing}):
+                pass
+
+        for propname in propnames:
+            prop = self.properties.get(propname)
+            if not isinstance(prop, Multilink) or prop.computed:
+                continue
+            nodes = {}
+            for nodeid in nodeids:
+                node = self.db.cache.get((self.classname, nodeid))
+                if node is not None and propname not in node:
+                    nodes[nodeid] = node
+            if not nodes:
+                continue
+            values = {nodeid: [] for nodeid in nodes}
+            sql = 'select %s, %s from %s where %s in (%s)' % (
+                prop.nodeid_name, prop.linkid_name, prop.table_name,
+                prop.nodeid_name, ','.join([self.db.arg] * len(nodes)))
+            cursor = self.db.sql_new_cursor(name='prefetch')
+            self.db.sql(sql, list(nodes), cursor)
+            for nodeid, linkid in cursor:
+                values[str(nodeid)].append(int(linkid))
+            cursor.close()
+            for nodeid, linkids in values.items():
+                nodes[nodeid][propname] = [str(x) for x in sorted(linkids)]
+
+    @staticmethod
+    def _sql_day_to_date(value):
+        """Convert the day (YYYY-MM-DD or YYYYMMDD) returned for
+        sql_date_day to a date.
+        """
+        day = str(value).replace('-', '')
+        return date.Date('%s-%s-%s' % (day[:4], day[4:6], day[6:8]))
+
+    def aggregate(self, search_matches, filterspec, group_by=(),
+                  metrics=('count',), retired=False, exact_match_spec={}):
+        """See hyperdb.Class.aggregate. The groups are computed by the
+        database, dates are grouped by day and the days are combined
+        to longer periods afterwards.
+        """
+        group_by, metrics = self._aggregate_spec(group_by, metrics)
+        icn = self.classname
+        a = self.db.arg
+        if self.supports_subselects:
+            sq = self._filter_sql(search_matches, filterspec,
+                                  retired=retired,
+                                  exact_match_spec=exact_match_spec)
+            if sq is None:
+                return self._aggregate_rows([], group_by, metrics)
+            where = '_%s.id in (%s)' % (icn, sq[1])
+            args = list(sq[2])
+        else:
+            args = self.filter(search_matches, filterspec, retired=retired,
+                               exact_match_spec=exact_match_spec)
+            if not args:
+                return self._aggregate_rows([], group_by, metrics)
+            where = '_%s.id in (%s)' % (icn, ','.join([a] * len(args)))
+
+        props = self.getprops()
+        cols = []
+        groups = []
+        loj = []
+        convert = []
+        for i, (name, unit) in enumerate(group_by):
+            prop = props[name]
+            if isinstance(prop, Multilink):
+                tn = '_ml%d' % i
+                loj.append('LEFT OUTER JOIN %s as %s on %s.%s=_%s.id' % (
+                    prop.table_name, tn, tn, prop.nodeid_name, icn))
+                col = '%s.%s' % (tn, prop.linkid_name)
+                convert.append(str)
+            elif unit:
+                col = self.sql_date_day % ('_%s._%s' % (icn, name))
+                convert.append(self._sql_day_to_date)
+            else:
+                col = '_%s._%s' % (icn, name)
+                convert.append(self.db.to_hyperdb_value(prop.__class__))
+            cols.append(col)
+            groups.append(col)
+        for function, propname in metrics:
+            if function == 'count':
+                cols.append('count(*)')
+                convert.append(int)
+            else:
+                cols.append('%s(_%s._%s)' % (function, icn, propname))
+                convert.append(self.db.to_hyperdb_value(
+                    props[propname].__class__))
+
+        sql = 'select %s from _%s %s where %s' % (
+            ','.join(cols), icn, ' '.join(loj), where)
+        if groups:
+            sql += ' group by %s' % ','.join(groups)
+        cursor = self.db.sql_new_cursor(name='aggregate')
+        self.db.sql(sql, args, cursor)
+        rows = []
+        for row in cursor:
+            row = [None if v is None else cvt(v)
+                   for v, cvt in zip(row, convert)]
+            rows.append((tuple(row[:len(groups)]), row[len(groups):]))
+        cursor.close()
+        return self._aggregate_rows(rows, group_by, metrics)
+
     def filter_sql(self, sql):
         """Return a list of the ids of the items in this class that match
         the SQL provided. The SQL is a complete "select" statement.
@@ -1,7 +1,5 @@
-import codecs
 import csv
 import re
-import sys
 from datetime import timedelta
 
 from roundup import hyperdb, token_r, date, password
@@ -1572,10 +1570,73 @@ class LoginAction(Action):
         return 0
 
 
+class CSVOutput:
+    """Collect the rows of a CSV export and send them to the client in
+    chunks, compressed if the client accepts it.
+    """
+    def __init__(self, client, encoder=None):
+        self.client = client
+        self.encoder = encoder
+        self.buffer = StringIO()
+        self.writer = csv.writer(self.buffer, quoting=csv.QUOTE_NONNUMERIC)
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+
+    def flush(self):
+        data = self.buffer.getvalue().encode(self.client.charset, 'replace')
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        if self.encoder:
+            data = self.encoder.encode(data)
+        if data:
+            self.client._socket_op(self.client.request.wfile.write, data)
+
+    def close(self):
+        self.flush()
+        if self.encoder:
+            self.client._socket_op(self.client.request.wfile.write,
+                                   self.encoder.finish())
+
+
 class ExportCSVAction(Action):
     name = 'export'
     permissionType = 'View'
     list_sep = ';'              # Separator for list types
+    # number of items loaded and sent at once
+    batch_size = 50
+
+    def start_output(self):
+        """Send the headers and return a CSVOutput, None for a HEAD
+        request.
+        """
+        encoder = None
+        if self.client.env['REQUEST_METHOD'] != 'HEAD':
+            encoder = self.client.stream_encoder()
+        self.client.header()
+        if self.client.env['REQUEST_METHOD'] == 'HEAD':
+            return None
+        return CSVOutput(self.client, encoder)
+
+    def item_batches(self, klass, itemids, columns):
+        """Yield the itemids in batches, the columns of a batch are
+        loaded with one query (see Class.prefetch).
+        """
+        for start in range(0, len(itemids), self.batch_size):
+            batch = itemids[start:start + self.batch_size]
+            klass.prefetch(batch, columns)
+            yield batch
+
+    def checked_columns(self, classname, columns):
+        """Return the columns for which the permission must be checked
+        for every item. The user may view the other columns of all
+        items.
+        """
+        return set([name for name in columns
+                    if not self.db.security.hasPermission(
+                        self.permissionType, self.client.userid,
+                        classname, property=name,
+                        skip_permissions_with_check=True)])
 
     def handle(self):
         ''' Export the specified search query as CSV. '''
@@ -1626,21 +1687,22 @@ class ExportCSVAction(Action):
         # some browsers will honor the filename here...
         header['Content-Disposition'] = 'inline; filename=query.csv'
 
-        self.client.header()
-
-        if self.client.env['REQUEST_METHOD'] == 'HEAD':
-            # all done, return a dummy string
+        output = self.start_output()
+        if output is None:
+            # HEAD request, all done, return a dummy string
             return 'dummy'
 
-        wfile = self.client.request.wfile
-        if sys.version_info[0] > 2:
-            wfile = codecs.getwriter(self.client.charset)(wfile, 'replace')
-        elif self.client.charset != self.client.STORAGE_CHARSET:
-            wfile = codecs.EncodedFile(wfile,
-                                       self.client.STORAGE_CHARSET,
-                                       self.client.charset, 'replace')
+        # labels of linked items by column, filled for every batch of
+        # rows by get_labels
+        labels = {}
 
-        writer = csv.writer(wfile, quoting=csv.QUOTE_NONNUMERIC)
+        def get_labels(cls, col, ids):
+            """Load the labels of the linked items ids not seen yet."""
+            known = labels.setdefault((cls.classname, col), {})
+            missing = [linkid for linkid in ids if linkid not in known]
+            cls.prefetch(missing)
+            for linkid in missing:
+                known[linkid] = str(cls.get(linkid, col))
 
         # handle different types of columns.
         def repr_no_right(cls, col):
@@ -1652,23 +1714,29 @@ class ExportCSVAction(Action):
         def repr_link(cls, col):
             """Generate a function which returns the string representation of
             a link depending on `cls` and `col`."""
+            known = labels.setdefault((cls.classname, col), {})
+
             def fct(arg):
                 if arg is None:
                     return ""
                 else:
-                    return str(cls.get(arg, col))
+                    return known[arg]
+            fct.linked = (cls, col)
             return fct
 
         def repr_list(cls, col):
+            known = labels.setdefault((cls.classname, col), {})
+
             def fct(arg):
                 if arg is None:
                     return ""
                 elif type(arg) is list:
-                    seq = [str(cls.get(val, col)) for val in arg]
+                    seq = [known[val] for val in arg]
                     # python2/python 3 have different order in lists
                     # sort to not break tests
                     seq.sort()
                     return self.list_sep.join(seq)
+            fct.linked = (cls, col)
             return fct
 
         def repr_date():
@@ -1728,22 +1796,41 @@ class ExportCSVAction(Action):
 
         columns = ncols
         # generate the CSV output
-        self.client._socket_op(writer.writerow, columns)
+        output.writerow(columns)
         # and search
         filter = klass.filter_with_permissions
-        for itemid in filter(matches, filterspec, sort, group):
-            row = []
-            for name in columns:
-                # check permission for this property on this item
-                # TODO: Permission filter doesn't work for the 'user' class
-                if not self.hasPermission(self.permissionType, itemid=itemid,
-                                          classname=request.classname,
-                                          property=name):
-                    repr_function = repr_no_right(request.classname, name)
-                else:
-                    repr_function = represent[name]
-                row.append(repr_function(klass.get(itemid, name)))
-            self.client._socket_op(writer.writerow, row)
+        itemids = filter(matches, filterspec, sort, group)
+        checked = self.checked_columns(request.classname, columns)
+        for batch in self.item_batches(klass, itemids, columns):
+            values = [[klass.get(itemid, name) for name in columns]
+                      for itemid in batch]
+            for index, name in enumerate(columns):
+                linked = getattr(represent[name], 'linked', None)
+                if linked:
+                    ids = set()
+                    for row in values:
+                        value = row[index]
+                        if isinstance(value, list):
+                            ids.update(value)
+                        elif value is not None:
+                            ids.add(value)
+                    get_labels(linked[0], linked[1], ids)
+            for itemid, row in zip(batch, values):
+                for index, name in enumerate(columns):
+                    # check permission for this property on this item
+                    # TODO: Permission filter doesn't work for the 'user'
+                    # class
+                    if name in checked and not self.hasPermission(
+                            self.permissionType, itemid=itemid,
+                            classname=request.classname, property=name):
+                        repr_function = repr_no_right(request.classname,
+                                                      name)
+                    else:
+                        repr_function = represent[name]
+                    row[index] = repr_function(row[index])
+                output.writerow(row)
+            output.flush()
+        output.close()
 
         # force close of connection since we can't send a
         # Content-Length header.
@@ -1752,7 +1839,7 @@ class ExportCSVAction(Action):
         return '\n'
 
 
-class ExportCSVWithIdAction(Action):
+class ExportCSVWithIdAction(ExportCSVAction):
     ''' A variation of ExportCSVAction that returns ID number rather than
         names. This is the original csv export function.
     '''
@@ -1809,51 +1896,46 @@ class ExportCSVWithIdAction(Action):
         # some browsers will honor the filename here...
         h['Content-Disposition'] = 'inline; filename=query.csv'
 
-        self.client.header()
-
-        if self.client.env['REQUEST_METHOD'] == 'HEAD':
-            # all done, return a dummy string
+        output = self.start_output()
+        if output is None:
+            # HEAD request, all done, return a dummy string
             return 'dummy'
 
-        wfile = self.client.request.wfile
-        if sys.version_info[0] > 2:
-            wfile = codecs.getwriter(self.client.charset)(wfile, 'replace')
-        elif self.client.charset != self.client.STORAGE_CHARSET:
-            wfile = codecs.EncodedFile(wfile,
-                                       self.client.STORAGE_CHARSET,
-                                       self.client.charset, 'replace')
-
-        writer = csv.writer(wfile, quoting=csv.QUOTE_NONNUMERIC)
-        self.client._socket_op(writer.writerow, columns)
+        output.writerow(columns)
 
         # and search
         filter = klass.filter_with_permissions
-        for itemid in filter(matches, filterspec, sort, group):
-            row = []
-            for name in columns:
-                # check permission to view this property on this item
-                if not self.hasPermission(self.permissionType, itemid=itemid,
-                                          classname=request.classname,
-                                          property=name):
-                    # FIXME: is this correct, or should we just
-                    # emit a '[hidden]' string. Note that this may
-                    # allow an attacker to figure out hidden schema
-                    # properties.
-                    # A bad property name will result in an exception.
-                    # A valid property results in a column of '[hidden]'
-                    #   values.
-                    raise exceptions.Unauthorised(self._(
-                        'You do not have permission to view %(class)s'
-                    ) % {'class': request.classname})
-                value = klass.get(itemid, name)
-                try:
-                    # python2/python 3 have different order in lists
-                    # sort to not break tests
-                    value.sort()
-                except AttributeError:
-                    pass  # value is not sortable, probably str
-                row.append(str(value))
-            self.client._socket_op(writer.writerow, row)
+        itemids = filter(matches, filterspec, sort, group)
+        checked = self.checked_columns(request.classname, columns)
+        for batch in self.item_batches(klass, itemids, columns):
+            for itemid in batch:
+                row = []
+                for name in columns:
+                    # check permission to view this property on this item
+                    if name in checked and not self.hasPermission(
+                            self.permissionType, itemid=itemid,
+                            classname=request.classname, property=name):
+                        # FIXME: is this correct, or should we just
+                        # emit a '[hidden]' string. Note that this may
+                        # allow an attacker to figure out hidden schema
+                        # properties.
+                        # A bad property name will result in an exception.
+                        # A valid property results in a column of
+                        #   '[hidden]' values.
+                        raise exceptions.Unauthorised(self._(
+                            'You do not have permission to view %(class)s'
+                        ) % {'class': request.classname})
+                    value = klass.get(itemid, name)
+                    try:
+                        # python2/python 3 have different order in lists
+                        # sort to not break tests
+                        value.sort()
+                    except AttributeError:
+                        pass  # value is not sortable, probably str
+                    row.append(str(value))
+                output.writerow(row)
+            output.flush()
+        output.close()
 
         # force close of connection since we can't send a
         # Content-Length header.
@@ -7,6 +7,7 @@ import binascii
 import codecs
 import email.utils
 import errno
+import hashlib
 import logging
 import mimetypes
 import os
@@ -16,6 +17,7 @@ import stat
 import sys
 import tempfile
 import time
+import zlib
 from email.mime.multipart import MIMEMultipart
 from traceback import format_exc
 
@@ -274,6 +276,88 @@ class Session:
             self.client.add_cookie(self.cookie_name, self._sid, expire=expire)
 
 
+class StreamEncoder:
+    """Compress a response that is sent in chunks.
+
+    Every chunk is flushed so the browser can decode it on arrival.
+    """
+    def __init__(self, encoding, brotli=None):
+        self.encoding = encoding
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=4,
+                                                mode=brotli.MODE_TEXT)
+        else:
+            # wbits 31 writes a gzip header and trailer
+            self.compressor = zlib.compressobj(5, zlib.DEFLATED, 31)
+
+    def encode(self, data):
+        if self.encoding == 'br':
+            return (self.compressor.process(data) +
+                    self.compressor.flush())
+        return (self.compressor.compress(data) +
+                self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+class ChunkedOutput:
+    """File-like object a page template writes to when the page is sent
+    while it is rendered (html_chunk_size in config.ini).
+
+    The text is collected until chunk_size characters are written.
+    The headers are sent with the first chunk.
+    """
+    def __init__(self, client, content_type, chunk_size):
+        self.client = client
+        self.content_type = content_type
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.length = 0
+        self.encoder = None
+
+    def write(self, text):
+        self.pending.append(text)
+        self.length += len(text)
+        if self.length >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        client = self.client
+        content = ''.join(self.pending).encode(client.charset,
+                                               'xmlcharrefreplace')
+        self.pending = []
+        self.length = 0
+        if not client.headers_done:
+            if 'Content-Type' not in client.additional_headers:
+                client.additional_headers['Content-Type'] = \
+                    self.content_type
+            self.encoder = client.stream_encoder()
+            client.header()
+        if self.encoder:
+            content = self.encoder.encode(content)
+        if content:
+            client._socket_op(client.request.wfile.write, content)
+
+    def close(self, text=''):
+        """Send text and the rest of the page.
+
+        If nothing was sent yet, the page is returned instead so it
+        can be sent with a Content-Length header.
+        """
+        self.client.chunked_output = None
+        if not self.client.headers_done:
+            return ''.join(self.pending) + text
+        self.write(text)
+        self.flush()
+        if self.encoder:
+            self.client._socket_op(self.client.request.wfile.write,
+                                   self.encoder.finish())
+        return ''
+
+
 # import from object as well so it's a new style object and I can use super()
 class BinaryFieldStorage(cgi.FieldStorage, object):
     '''This class works around the bug https://bugs.python.org/issue27777.
@@ -546,6 +630,12 @@ class Client:
         # flag to indicate that the HTTP headers have been sent
         self.headers_done = 0
 
+        # ChunkedOutput of a page that is sent while it is rendered
+        self.chunked_output = None
+
+        # csrf nonces created while rendering a page with an ETag
+        self.csrf_nonces = None
+
         # record of headers sent for debugging
         self.headers_sent = []
 
@@ -843,12 +933,32 @@ class Client:
 
         # type header set by rest handler
         # self.setHeader("Content-Type", "text/xml")
-        if self.response_code == 204:  # no body with 204
+        if self.response_code in (204, 304):  # no body with 204 or 304
             self.write("")
+        elif not isinstance(output, bytes):
+            # a collection sent while it is loaded
+            self.write_stream(output)
         else:
             self.setHeader("Content-Length", str(len(output)))
             self.write(output)
 
+    def write_stream(self, chunks):
+        """Send the byte strings of the iterable chunks as they are
+        generated, compressed if the client accepts it.
+        """
+        if self.env['REQUEST_METHOD'] == 'HEAD':
+            self.header()
+            return
+        encoder = self.stream_encoder()
+        self.header()
+        for chunk in chunks:
+            if encoder:
+                chunk = encoder.encode(chunk)
+            if chunk:
+                self._socket_op(self.request.wfile.write, chunk)
+        if encoder:
+            self._socket_op(self.request.wfile.write, encoder.finish())
+
     def add_ok_message(self, msg, escape=True):
         add_message(self._ok_message, msg, escape)
 
@@ -948,8 +1058,21 @@ class Client:
                 self.additional_headers['Expires'] = \
                     email.utils.formatdate(date, usegmt=True)
 
+                # answer conditional requests for unchanged pages
+                validator = self.html_validator()
+                if validator is not None:
+                    self.check_html_etag(validator)
+                    self.csrf_nonces = []
+
                 # render the content
-                self.write_html(self.renderContext())
+                html = self.renderContext()
+                if (validator is not None and not self.headers_done
+                        and self.response_code == 200
+                        and not self._error_message):
+                    self.setHeader("ETag", self.html_etag(validator,
+                                                          self.csrf_nonces))
+                self.csrf_nonces = None
+                self.write_html(html)
             except SendFile as designator:
                 # The call to serve_file may result in an Unauthorised
                 # exception or a NotModified exception.  Those
@@ -2400,6 +2523,100 @@ class Client:
 
         return False
 
+    def html_validator(self):
+        """Return the values a rendered page depends on or None if the
+        page is not answered by a 304 response.
+
+        For an item view of a class without links to itself the
+        activity of the item is used instead of the write generation
+        of its class. It is used with its full precision, str() of
+        a Date drops the fraction of the second.
+        """
+        config = self.instance.config
+        if (not config.WEB_HTML_ETAGS
+                or self.env['REQUEST_METHOD'] not in ('GET', 'HEAD')
+                or self.env.get('CGI_SHOW_TIMING')
+                or '@action' in self.form
+                or self._ok_message or self._error_message):
+            return None
+        try:
+            tplname = self.selectTemplate(self.classname, self.template)
+        except templating.NoTemplate:
+            return None
+        db = self.db
+        templates = config.TEMPLATES
+        try:
+            mtime = max(os.stat(templates).st_mtime,
+                        *[entry.stat().st_mtime
+                          for entry in os.scandir(templates)])
+        except OSError:
+            return None
+        validator = [tplname, mtime, self.userid,
+                     db.user.get(self.userid, 'roles'),
+                     self.session_api._sid, self.language,
+                     self.env.get('PATH_INFO', ''),
+                     self.env.get('QUERY_STRING', '')]
+        own_class = None
+        if self.nodeid:
+            klass = db.getclass(self.classname)
+            if not [prop for prop in klass.getprops().values()
+                    if getattr(prop, 'classname', None) == klass.classname]:
+                own_class = klass.classname
+                try:
+                    activity = klass.get(self.nodeid, 'activity')
+                except IndexError:
+                    return None
+                validator.append('%s %r' % (activity.serialise(),
+                                            activity.second))
+        for classname in sorted(db.classes):
+            if classname != own_class:
+                generation = db.write_generation(classname)
+                if generation is None:
+                    return None
+                validator.append(generation)
+        return validator
+
+    def html_etag(self, validator, nonces):
+        """Return the ETag of a page. The csrf nonces of the page are
+        part of the ETag, the page is only reused while they are valid.
+        """
+        digest = hashlib.sha256(s2b(repr(validator + list(nonces))))
+        return '"%s"' % ':'.join([digest.hexdigest()[:32]] + list(nonces))
+
+    def check_html_etag(self, validator):
+        """Raise NotModified if the If-None-Match header has the ETag of
+        the page and its csrf nonces are valid for at least half of
+        the csrf_token_lifetime.
+        """
+        if hasattr(self.request, 'headers'):
+            inm = self.request.headers.get('If-None-Match')
+        else:
+            inm = self.env.get('HTTP_IF_NONE_MATCH')
+        if not inm:
+            return
+        otks = self.db.getOTKManager()
+        min_lifetime = self.instance.config.WEB_CSRF_TOKEN_LIFETIME * 30
+        for tag in [t.strip() for t in inm.split(',')]:
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            value = tag.strip('"')
+            # compress_encode appends the encoding to the ETag
+            candidates = [value] + [value[:-len(e) - 1]
+                                    for e in self.compressors
+                                    if value.endswith('-' + e)]
+            for candidate in candidates:
+                nonces = candidate.split(':')[1:]
+                if self.html_etag(validator, nonces) != '"%s"' % candidate:
+                    continue
+                for nonce in nonces:
+                    timestamp = otks.get(nonce, '__timestamp', default=None)
+                    if (timestamp is None or
+                            timestamp - otks.lifetime(0) < min_lifetime):
+                        return
+                self.setHeader("ETag", tag)
+                self.setVary("Accept-Encoding")
+                raise NotModified
+
     def send_error_to_admin(self, subject, html, txt):
         """Send traceback information to admin via email.
            We send both, the formatted html (with more information) and
@@ -2510,9 +2727,20 @@ class Client:
                 'error_message': self._error_message,
             }
             pt = self.instance.templates.load(tplname)
+            show_timing = self.env.get('CGI_SHOW_TIMING', '').upper()
+            chunk_size = self.instance.config.WEB_HTML_CHUNK_SIZE
+            if (chunk_size and hasattr(pt, 'stream') and not show_timing
+                and not self.headers_done
+                and self.env['REQUEST_METHOD'] != 'HEAD'):
+                self.chunked_output = ChunkedOutput(self, pt.content_type,
+                                                    chunk_size)
             # let the template render figure stuff out
             try:
-                result = pt.render(self, None, None, **args)
+                if self.chunked_output:
+                    pt.stream(self.chunked_output, self, None, None, **args)
+                    result = self.chunked_output.close()
+                else:
+                    result = pt.render(self, None, None, **args)
             except IndexerQueryError as e:
                 result = self.renderError(e.args[0])
             except ExpressionError as e:
@@ -2523,8 +2751,6 @@ class Client:
             if 'Content-Type' not in self.additional_headers:
                 self.additional_headers['Content-Type'] = pt.content_type
 
-            show_timing = self.env.get('CGI_SHOW_TIMING', '').upper()
-
             # check content_type so we don't calculate timing if
             # we can't display it. This also prevents matching
             # '</body>' in js, css, svg or comment strings in
@@ -2760,6 +2986,28 @@ class Client:
         else:
             self.additional_headers['Vary'] = header
 
+    def stream_encoder(self):
+        """Return a StreamEncoder for a response sent in chunks, None if
+        the response is not compressed. Sets the Content-Encoding header.
+        """
+        if not self.instance.config.WEB_DYNAMIC_COMPRESSION:
+            return None
+
+        if ('Content-Encoding' in self.additional_headers or
+            self.additional_headers.get('Content-Type') in
+                self.precompressed_mime_types):
+            return None
+
+        self.setVary('Accept-Encoding')
+        # zstd has no incremental interface
+        accept_encoding = self.request.headers.get('accept-encoding') or []
+        for encoding in ['br', 'gzip']:
+            if encoding in self.compressors and encoding in accept_encoding:
+                self.additional_headers['Content-Encoding'] = encoding
+                return StreamEncoder(encoding,
+                                     getattr(self, 'brotli', None))
+        return None
+
     def compress_encode(self, byte_content, quality=4):
 
         if not self.instance.config.WEB_DYNAMIC_COMPRESSION:
@@ -2845,6 +3093,15 @@ class Client:
             self._socket_op(self.request.wfile.write, content)
 
     def write_html(self, content):
+        if self.chunked_output:
+            # rendering the page failed, an error page is sent
+            output = self.chunked_output
+            if self.headers_done:
+                # the page is partially sent, append the error
+                output.close(content)
+                return
+            self.chunked_output = None
+
         if sys.version_info[0] > 2:
             # An action setting appropriate headers for a non-HTML
             # response may return a bytes object directly.
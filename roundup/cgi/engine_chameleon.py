@@ -2,16 +2,28 @@
 
 __docformat__ = 'restructuredtext'
 
+import os
+
 import chameleon
+from chameleon.loader import ModuleLoader
 
 from roundup.cgi.templating import context, TALLoaderBase
 from roundup.anypy.strings import s2u
 
 
 class Loader(TALLoaderBase):
-    def __init__(self, template_dir):
+    def __init__(self, template_dir, cache_dir=None):
         self.template_dir = template_dir
-        self.loader = chameleon.PageTemplateLoader(template_dir)
+        self.cache_dir = cache_dir
+        config = {}
+        if cache_dir:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            # store the python modules generated from the templates.
+            # ModuleLoader writes to a temporary file and renames it,
+            # so the directory can be shared by several processes.
+            config['loader'] = ModuleLoader(cache_dir)
+        self.loader = chameleon.PageTemplateLoader(template_dir, **config)
 
     def load(self, tplname):
         try:
@@ -22,6 +34,12 @@ class Loader(TALLoaderBase):
 
         return RoundupPageTemplate(self.loader.load(src))
 
+    def precompile(self):
+        """ Compile all templates, chameleon compiles a template when
+            it is first rendered."""
+        for name in self.template_names():
+            self.load(name).cook_check()
+
 
 class RoundupPageTemplate(object):
     def __init__(self, pt):
@@ -23,15 +23,16 @@ minimal set (to avoid Roundup state changes from template).
       [ ] implement VERSION file in environment for auto
           upgrade
 
-[ ] precompile() is a stub
-
 [ ] add {{ debug() }} dumper to inspect available variables
     https://github.com/mitsuhiko/jinja2/issues/174
 """
 
+import fnmatch
 import jinja2
 import mimetypes
+import os
 import sys
+import tempfile
 
 # http://jinja.pocoo.org/docs/api/#loaders
 
@@ -39,12 +40,69 @@ from roundup.cgi.templating import context, LoaderBase, TemplateBase
 from roundup.anypy.strings import s2u
 
 
+class AtomicBytecodeCache(jinja2.BytecodeCache):
+    """ Bytecode cache that can be shared by several processes and
+        threads.
+
+        The bytecode is written to a unique temporary file that is
+        renamed into place, so nobody reads a partially written file.
+        The files are named like the ones of FileSystemBytecodeCache.
+    """
+    pattern = '__jinja2_%s.cache'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _filename(self, bucket):
+        return os.path.join(self.directory, self.pattern % bucket.key)
+
+    def load_bytecode(self, bucket):
+        try:
+            f = open(self._filename(bucket), 'rb')
+        except OSError:
+            return
+        with f:
+            bucket.load_bytecode(f)
+
+    def dump_bytecode(self, bucket):
+        filename = self._filename(bucket)
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory,
+                                       prefix=os.path.basename(filename))
+        except OSError:
+            # the cache is an optimisation, the template is compiled
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp, filename)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if fnmatch.fnmatch(name, self.pattern % '*'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
 class Jinja2Loader(LoaderBase):
-    def __init__(self, template_dir):
+    def __init__(self, template_dir, cache_dir=None):
+        bytecode_cache = None
+        if cache_dir:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            bytecode_cache = AtomicBytecodeCache(cache_dir)
         self._env = jinja2.Environment(
             loader=jinja2.FileSystemLoader(template_dir),
             extensions=['jinja2.ext.i18n'],
-            autoescape=True
+            autoescape=True,
+            bytecode_cache=bytecode_cache
         )
 
         # Adding a custom filter that can transform roundup's vars to unicode
@@ -74,24 +132,36 @@ class Jinja2Loader(LoaderBase):
         return pt
 
     def precompile(self):
-        pass
+        """ Compile all templates, this fills the bytecode cache."""
+        for name in self._env.list_templates(extensions=('html', 'xml')):
+            self._env.get_template(name)
 
 
 class Jinja2ProxyPageTemplate(TemplateBase):
     def __init__(self, template):
         self._tpl = template
 
-    def render(self, client, classname, request, **options):
+    def _context(self, client, classname, request, options):
         # [ ] limit the information passed to the minimal necessary set
         c = context(client, self, classname, request)
 
         c.update({'options': options,
                   'gettext': lambda s: s2u(client.gettext(s)),
                   'ngettext': lambda s, p, n: s2u(client.ngettext(s, p, n))})
+        return c
+
+    def render(self, client, classname, request, **options):
+        c = self._context(client, classname, request, options)
         s = self._tpl.render(c)
         return s if sys.version_info[0] > 2 else \
             s.encode(client.STORAGE_CHARSET, )
 
+    def stream(self, output, client, classname, request, **options):
+        """Render the template, writing the text to output"""
+        c = self._context(client, classname, request, options)
+        for s in self._tpl.generate(c):
+            output.write(s)
+
     def __getitem__(self, name):
         # [ ] figure out what are these for
         raise NotImplementedError
@@ -3,21 +3,31 @@ Zope.
 """
 __docformat__ = 'restructuredtext'
 
+import hashlib
 import mimetypes
 import os
+import pickle
 import stat
+import sys
+import tempfile
 
+from roundup import __version__
 from roundup.cgi.PageTemplates import PageTemplate
 from roundup.cgi.PageTemplates.Expressions import getEngine
 from roundup.cgi.TAL import TALInterpreter
+from roundup.cgi.TAL.HTMLTALParser import HTMLTALParser
+from roundup.cgi.TAL.TALGenerator import TALGenerator
+from roundup.cgi.TAL.TALParser import TALParser
 from roundup.cgi.templating import StringIO, TALLoaderBase, context
 
 
 class Loader(TALLoaderBase):
     templates = {}
 
-    def __init__(self, template_dir):
+    def __init__(self, template_dir, cache_dir=None):
         self.template_dir = template_dir
+        # directory for compiled templates shared by all processes
+        self.cache_dir = cache_dir
 
     def load(self, tplname):
         # find the source
@@ -43,7 +53,10 @@ class Loader(TALLoaderBase):
         # use pt_edit so we can pass the content_type guess too
         content_type = mimetypes.guess_type(filename)[0] or 'text/html'
         with open(src) as srcd:
-            pt.pt_edit(srcd.read(), content_type)
+            if self.cache_dir:
+                self.load_compiled(pt, src, srcd.read(), content_type)
+            else:
+                pt.pt_edit(srcd.read(), content_type)
         pt.id = filename
         pt.mtime = stime
         # Add it to the cache.  We cannot do this until the template
@@ -64,6 +77,70 @@ class Loader(TALLoaderBase):
         self.templates[src] = pt
         return pt
 
+    def cache_file(self, src):
+        return os.path.join(self.cache_dir, hashlib.sha256(
+            src.encode('utf-8', 'surrogateescape')).hexdigest() + '.tal')
+
+    def load_compiled(self, pt, src, text, content_type):
+        """Set up pt from the compiled program in the cache directory.
+
+        The cache entry is used if it was made from the same source
+        text by the same Roundup version. Otherwise the template is
+        compiled and the cache entry is replaced.
+        """
+        key = (__version__, content_type,
+               hashlib.sha256(text.encode('utf-8', 'surrogateescape')).digest())
+        cache_file = self.cache_file(src)
+        try:
+            with open(cache_file, 'rb') as f:
+                unpickler = pickle.Unpickler(f)
+                # compiled expressions are stored as their source
+                unpickler.persistent_load = getEngine().compile
+                if unpickler.load() == key:
+                    pt.content_type = content_type
+                    pt._text = text
+                    (pt._v_program, pt._v_macros,
+                     pt._v_warnings) = unpickler.load()
+                    pt._v_errors = ()
+                    pt._v_cooked = 1
+                    return
+        except FileNotFoundError:
+            pass
+        except Exception:  # noqa: BLE001 - broken entry, recompile
+            pass
+
+        pt.pt_edit(text, content_type)
+        if pt._v_errors:
+            return
+
+        def persistent_id(obj):
+            source, compiled = pt._v_expressions.get(id(obj), (None, None))
+            if compiled is obj:
+                return source
+            return None
+
+        tmp = None
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # write under a unique temporary name so other processes
+            # and threads never read a partial entry
+            fd, tmp = tempfile.mkstemp(
+                dir=self.cache_dir, prefix=os.path.basename(cache_file))
+            with os.fdopen(fd, 'wb') as f:
+                pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+                pickler.persistent_id = persistent_id
+                pickler.dump(key)
+                pickler.dump((pt._v_program, pt._v_macros, pt._v_warnings))
+            os.replace(tmp, cache_file)
+        except Exception:  # noqa: BLE001 - e.g. unpicklable objects
+            # the cache is an optimisation, the template is compiled
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
 
 class RoundupPageTemplate(PageTemplate.PageTemplate):
     """A Roundup-specific PageTemplate.
@@ -73,8 +150,41 @@ class RoundupPageTemplate(PageTemplate.PageTemplate):
 
     """
 
+    def _cook(self):
+        """Compile the TAL and METAL statements.
+
+        Same as PageTemplate._cook but it remembers the source of
+        the compiled expressions in _v_expressions, so
+        Loader.load_compiled can store the program.
+        """
+        source_file = self.pt_source_file()
+        engine = _ExpressionRecorder(getEngine())
+        if self.html():
+            gen = TALGenerator(engine, xml=0, source_file=source_file)
+            parser = HTMLTALParser(gen)
+        else:
+            gen = TALGenerator(engine, source_file=source_file)
+            parser = TALParser(gen)
+
+        self._v_errors = ()
+        try:
+            parser.parseString(self._text)
+            self._v_program, self._v_macros = parser.getCode()
+        except Exception:
+            self._v_errors = ["Compilation failed",
+                              "%s: %s" % sys.exc_info()[:2]]
+        self._v_warnings = parser.getWarnings()
+        self._v_expressions = engine.expressions
+        self._v_cooked = 1
+
     def render(self, client, classname, request, **options):
         """Render this Page Template"""
+        output = StringIO()
+        self.stream(output, client, classname, request, **options)
+        return output.getvalue()
+
+    def stream(self, output, client, classname, request, **options):
+        """Render this Page Template, writing the text to output"""
 
         if not self._v_cooked:
             self._cook()
@@ -90,8 +200,25 @@ class RoundupPageTemplate(PageTemplate.PageTemplate):
         c.update({'options': options})
 
         # and go
-        output = StringIO()
         TALInterpreter.TALInterpreter(self._v_program, self.macros,
                                       getEngine().getContext(c), output,
                                       tal=1, strictinsert=0)()
-        return output.getvalue()
+
+
+class _ExpressionRecorder:
+    """Expression compiler recording the source of every expression
+    it compiles.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        # id(compiled) -> (source, compiled), holding a reference keeps
+        # the id unique
+        self.expressions = {}
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def compile(self, expression):
+        compiled = self.engine.compile(expression)
+        self.expressions[id(compiled)] = (expression, compiled)
+        return compiled
@@ -21,16 +21,19 @@ __docformat__ = 'restructuredtext'
 
 import calendar
 import csv
+import hashlib
 import logging
 import os.path
 import re
 import textwrap
+import threading
+import time
 
 from roundup import date, hyperdb, support
 from roundup.anypy import urllib_
 from roundup.anypy.cgi_ import cgi
 from roundup.anypy.html import html_escape
-from roundup.anypy.strings import StringIO, b2s, bs2b, is_us, s2u, u2s, us2s
+from roundup.anypy.strings import StringIO, b2s, bs2b, is_us, s2b, s2u, u2s, us2s
 from roundup.cgi import TranslationService, ZTUtils
 from roundup.cgi.timestamp import pack_timestamp
 from roundup.exceptions import RoundupException
@@ -264,6 +267,9 @@ def anti_csrf_nonce(client, lifetime=None):
              sid=client.session_api._sid,
              __timestamp=ts)
     otks.commit()
+    if client.csrf_nonces is not None:
+        # the page gets an ETag, see Client.html_etag()
+        client.csrf_nonces.append(key)
     return key
 
 # templating
@@ -292,8 +298,9 @@ class Unauthorised(RoundupException):
 
 class LoaderBase:
     """ Base for engine-specific template Loader class."""
-    def __init__(self, template_dir):
+    def __init__(self, template_dir, cache_dir=None):
         # loaders are given the template directory as a first argument
+        # and optionally a directory to cache compiled templates in
         pass
 
     def precompile(self):
@@ -321,8 +328,9 @@ class LoaderBase:
 class TALLoaderBase(LoaderBase):
     """ Common methods for the legacy TAL loaders."""
 
-    def __init__(self, template_dir):
+    def __init__(self, template_dir, cache_dir=None):
         self.template_dir = template_dir
+        self.cache_dir = cache_dir
 
     def _find(self, name):
         """ Find template, return full path and filename of the
@@ -343,6 +351,12 @@ class TALLoaderBase(LoaderBase):
 
     def precompile(self):
         """ Precompile templates in load directory by loading them """
+        for name in self.template_names():
+            self.load(name)
+
+    def template_names(self):
+        """ Return the names (without extension) of the html and xml
+            templates in the load directory."""
         for dir_entry in os.scandir(self.template_dir):
             filename = dir_entry.name
             # skip subdirs
@@ -357,8 +371,7 @@ class TALLoaderBase(LoaderBase):
                 continue
 
             # remove extension
-            filename = filename[:-len(extension)]
-            self.load(filename)
+            yield filename[:-len(extension)]
 
     def __getitem__(self, name):
         """Special method to access templates by loader['name']"""
@@ -375,6 +388,10 @@ class MultiLoader(LoaderBase):
     def add_loader(self, loader):
         self.loaders.append(loader)
 
+    def precompile(self):
+        for loader in self.loaders:
+            loader.precompile()
+
     def check(self, name):
         for loader in self.loaders:
             if loader.check(name):
@@ -398,7 +415,7 @@ class TemplateBase:
     content_type = 'text/html'
 
 
-def get_loader(template_dir, template_engine):
+def get_loader(template_dir, template_engine, cache_dir=None):
 
     # Support for multiple engines using fallback mechanizm
     # meaning that if first engine can't find template, we
@@ -417,7 +434,7 @@ def get_loader(template_dir, template_engine):
             from .engine_zopetal import Loader
         else:
             raise Exception('Unknown template engine "%s"' % engine_name)
-        ml.add_loader(Loader(template_dir))
+        ml.add_loader(Loader(template_dir, cache_dir))
 
     if len(engines) == 1:
         return ml.loaders[0]
@@ -608,6 +625,104 @@ def lookupKeys(linkcl, key, ids, num_re=num_re):
     return l
 
 
+# option lists of Link and Multilink menus, see menu_options()
+_menu_cache = {}
+MENU_CACHE_SIZE = 100
+
+
+def _menu_option(linkcl, optionid, labelprop, additional_fns):
+    """ Return the (optionid, label, additional labels) tuple for a
+    menu option or None if the item does not exist.
+    """
+    try:
+        option = linkcl.get(optionid, labelprop) or ''
+    except IndexError:
+        # optionid does not exist. E.G.
+        #   IndexError: no such queue z
+        # can be set using ?queue=z in URL for
+        # a new issue
+        return None
+    return (optionid, option, [str(fn(optionid)) for fn in additional_fns])
+
+
+def menu_options(db, userid, linkcl, sort_on, additional, conditions,
+                 extra_ids=()):
+    """ Return the options of a Link or Multilink menu as a list of
+    (optionid, label, additional labels) tuples.
+
+    The options are the items of linkcl matching the conditions that
+    the user may view. They are cached until a transaction changing
+    linkcl or a class linked by the "additional" properties is
+    committed. The list is only cached for users allowed to view all
+    items of linkcl, they share it. Permissions with a check function
+    can depend on any item (e.g. the user's own record), so their
+    results are not cached. The ids in extra_ids are listed first if
+    they are not options (e.g. a retired current value).
+    """
+    labelprop = linkcl.labelprop(1)
+    additional_fns = []
+    classnames = [linkcl.classname]
+    props = linkcl.getprops()
+    for propname in additional:
+        prop = props[propname]
+        if isinstance(prop, hyperdb.Link):
+            cl = db.getclass(prop.classname)
+            classnames.append(cl.classname)
+            fn = lambda optionid, cl=cl, linkcl=linkcl, propname=propname, \
+                    labelprop=cl.labelprop(): \
+                cl.get(linkcl.get(optionid, propname), labelprop)
+        else:
+            fn = lambda optionid, linkcl=linkcl, propname=propname: \
+                linkcl.get(optionid, propname)
+        additional_fns.append(fn)
+
+    key = None
+    changed = getattr(db, 'changed_classes', None) or ()
+    if not [c for c in classnames if c in changed] and \
+       db.security.hasPermission('View', userid, linkcl.classname,
+                                 skip_permissions_with_check=True):
+        generations = tuple(db.write_generation(c) for c in classnames)
+        key = (db.config.DATABASE, linkcl.classname, tuple(sort_on),
+               tuple(additional), generations,
+               tuple(sorted((k, tuple(v) if isinstance(v, list) else v)
+                            for k, v in conditions.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # conditions not usable as a key
+            key = None
+        if None in generations:
+            key = None
+
+    options = _menu_cache.get(key) if key else None
+    if options is None:
+        options = []
+        for optionid in linkcl.filter(None, conditions, sort_on,
+                                      (None, None)):
+            if not db.security.hasPermission("View", userid,
+                                             linkcl.classname,
+                                             itemid=optionid):
+                continue
+            option = _menu_option(linkcl, optionid, labelprop,
+                                  additional_fns)
+            if option:
+                options.append(option)
+        if key:
+            if len(_menu_cache) >= MENU_CACHE_SIZE:
+                _menu_cache.clear()
+            _menu_cache[key] = options
+
+    optionids = [o[0] for o in options]
+    extra = []
+    for optionid in extra_ids:
+        if optionid not in optionids:
+            option = _menu_option(linkcl, optionid, labelprop,
+                                  additional_fns)
+            if option:
+                extra.insert(0, option)
+    return extra + options
+
+
 def _set_input_default_args(dic):
     # 'text' is the default value anyway --
     # but for CSS usage it should be present
@@ -1029,6 +1144,10 @@ class HTMLClass(HTMLInputMixin, HTMLPermissions):
 class _HTMLItem(HTMLInputMixin, HTMLPermissions):
     """ Accesses through an *item*
     """
+    # properties the user is known to be allowed to view, None stands
+    # for the item itself (see Batch.prefetch_page)
+    _viewable = ()
+
     def __init__(self, client, classname, nodeid, anonymous=0):
         self._client = client
         self._db = client.db
@@ -1068,6 +1187,8 @@ class _HTMLItem(HTMLInputMixin, HTMLPermissions):
     def is_view_ok(self):
         """ Is the user allowed to View this item?
         """
+        if None in self._viewable:
+            return 1
         perm = self._db.security.hasPermission
         if perm('Web Access', self._client.userid) and perm(
                 'View', self._client.userid, self._classname,
@@ -1121,6 +1242,8 @@ class _HTMLItem(HTMLInputMixin, HTMLPermissions):
                                      self._nodeid, prop, items[0],
                                      value, self._anonymous)
         if htmlprop is not None:
+            if items[0] in self._viewable:
+                htmlprop._view_ok = True
             if has_rest:
                 if isinstance(htmlprop, MultilinkHTMLProperty):
                     return [h[items[1]] for h in htmlprop]
@@ -1170,13 +1293,45 @@ class _HTMLItem(HTMLInputMixin, HTMLPermissions):
         # XXX do this
         return []
 
+    def _prefetch_history(self, history):
+        """ Load the items linked by the journal entries in history and
+        the users who made the changes with one query per class.
+        """
+        linked = {'user': set()}
+        for _id, evt_date, user, action, args in history:
+            linked['user'].add(user)
+            if not isinstance(args, dict):
+                continue
+            for k, value in args.items():
+                prop = self._props.get(k)
+                if not value or not isinstance(prop, (hyperdb.Link,
+                                                      hyperdb.Multilink)):
+                    continue
+                ids = linked.setdefault(prop.classname, set())
+                if isinstance(prop, hyperdb.Link):
+                    ids.add(value)
+                    continue
+                for linkid in value:
+                    if isinstance(linkid, tuple):
+                        ids.update(linkid[1])
+                    else:
+                        ids.add(linkid)
+        for classname, ids in linked.items():
+            try:
+                linkcl = self._db.getclass(classname)
+            except KeyError:
+                continue
+            linkcl.prefetch(sorted(i for i in ids if str(i).isdigit()))
+
     def history(self, direction='descending', dre=re.compile(r'^\d+$'),
-                limit=None, showall=False):
+                limit=None, showall=False, offset=0):
         """Create an html view of the journal for the item.
 
            Display property changes for all properties that does not have quiet set.
            If showall=True then all properties regardless of quiet setting will be
            shown.
+           If limit is set only the most recent limit entries after
+           skipping the offset most recent entries are shown.
         """
         if not self.is_view_ok():
             return self._('[hidden]')
@@ -1192,15 +1347,19 @@ class _HTMLItem(HTMLInputMixin, HTMLPermissions):
         history.sort(key=lambda a: a[:3])
         history.reverse()
 
-        # restrict the volume
+        # restrict the volume, the skipped entries are still needed
+        # to find the values changed by the shown entries
         if limit:
-            history = history[:limit]
+            history = history[:offset + limit]
+        self._prefetch_history(history)
 
         timezone = self._db.getUserTimezone()
         l = []
         current = {}
         comments = {}
-        for _id, evt_date, user, action, args in history:
+        usernames = {}
+        linkinfo = {}
+        for index, (_id, evt_date, user, action, args) in enumerate(history):
             date_s = str(evt_date.local(timezone)).replace(".", " ")
             arg_s = ''
             if action in ['link', 'unlink'] and isinstance(args, tuple):
@@ -1253,22 +1412,26 @@ class _HTMLItem(HTMLInputMixin, HTMLPermissions):
                                     isinstance(prop, hyperdb.Link)):
                         # figure what the link class is
                         classname = prop.classname
-                        try:
-                            linkcl = self._db.getclass(classname)
-                        except KeyError:
-                            labelprop = None
-                            comments[classname] = self._(
-                                "The linked class %(classname)s no longer exists"
-                            ) % locals()
-                        labelprop = linkcl.labelprop(1)
-                        try:
-                            template = self._client.selectTemplate(classname,
-                                                                   'item')
-                            if template.startswith('_generic.'):
-                                raise NoTemplate('not really...')
-                            hrefable = 1
-                        except NoTemplate:
-                            hrefable = 0
+                        if classname not in linkinfo:
+                            try:
+                                linkcl = self._db.getclass(classname)
+                            except KeyError:
+                                labelprop = None
+                                comments[classname] = self._(
+                                    "The linked class %(classname)s no longer exists"
+                                ) % locals()
+                            labelprop = linkcl.labelprop(1)
+                            try:
+                                template = self._client.selectTemplate(
+                                    classname, 'item')
+                                if template.startswith('_generic.'):
+                                    raise NoTemplate('not really...')
+                                hrefable = 1
+                            except NoTemplate:
+                                hrefable = 0
+                            linkinfo[classname] = (linkcl, labelprop,
+                                                   hrefable)
+                        linkcl, labelprop, hrefable = linkinfo[classname]
 
                     if isinstance(prop, hyperdb.Multilink) and args[k]:
                         ml = []
@@ -1410,11 +1573,16 @@ class _HTMLItem(HTMLInputMixin, HTMLPermissions):
                         " by the history display!</em></strong>" % action)
                     arg_s = '<strong><em>' + str(args) + '</em></strong>'
 
+            if index < offset:
+                # skipped entry, only needed for the current values
+                continue
             date_s = date_s.replace(' ', '&nbsp;')
             # if the user's an itemid, figure the username (older journals
             # have the username)
             if dre.match(user):
-                user = self._db.user.get(user, 'username')
+                if user not in usernames:
+                    usernames[user] = self._db.user.get(user, 'username')
+                user = usernames[user]
             l.append('<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>' % (
                 date_s, html_escape(user), self._(action), arg_s))
         if comments:
@@ -1539,6 +1707,9 @@ class HTMLProperty(HTMLInputMixin, HTMLPermissions):
 
         A wrapper object which may be stringified for the plain() behaviour.
     """
+    # set if the user is known to be allowed to view the property
+    _view_ok = False
+
     def __init__(self, client, classname, nodeid, prop, name, value,
                  anonymous=0):
         self._client = client
@@ -1654,6 +1825,8 @@ class HTMLProperty(HTMLInputMixin, HTMLPermissions):
     def is_view_ok(self):
         """ Is the user allowed to View the current class?
         """
+        if self._view_ok:
+            return 1
         perm = self._db.security.hasPermission
         if perm('Web Access',  self._client.userid) and perm(
                 'View', self._client.userid, self._classname,
@@ -1662,6 +1835,13 @@ class HTMLProperty(HTMLInputMixin, HTMLPermissions):
         return self.is_edit_ok()
 
 
+# rendered values of String properties, see StringHTMLProperty._cached()
+_render_cache = {}
+RENDER_CACHE_SIZE = 1000
+# roundup-server can render pages in several threads
+_render_cache_lock = threading.Lock()
+
+
 class StringHTMLProperty(HTMLProperty):
     hyper_re = re.compile(r'''(
         (?P<url>
@@ -1691,6 +1871,9 @@ class StringHTMLProperty(HTMLProperty):
 
     valid_schemes = {}
 
+    # (class, id, exists) of the designators looked up by _cached()
+    _item_lookups = None
+
     def _hyper_repl(self, match):
         if match.group('url'):
             return self._hyper_repl_url(match, '<a href="%s" rel="nofollow noopener">%s</a>%s')
@@ -1735,14 +1918,19 @@ class StringHTMLProperty(HTMLProperty):
         fragment = match.group('fragment')
         if fragment is None:
             fragment = ""
+        exists = self._item_exists(cls, itemid)
+        if self._item_lookups is not None:
+            self._item_lookups.append((cls, itemid, exists))
+        if not exists:
+            return item
+        return replacement % locals()
+
+    def _item_exists(self, cls, itemid):
         try:
             # make sure cls is a valid tracker classname
-            cl = self._db.getclass(cls)
-            if not cl.hasnode(itemid):
-                return item
-            return replacement % locals()
+            return bool(self._db.getclass(cls).hasnode(itemid))
         except KeyError:
-            return item
+            return False
 
     def _hyper_repl_rst(self, match):
         if match.group('url'):
@@ -1798,6 +1986,41 @@ class StringHTMLProperty(HTMLProperty):
             # just return the matched text
             return match.group(0)
 
+    def _cached(self, render, *options):
+        """ Return render() using the render cache.
+
+        The cache is keyed by the property, a hash of its value and the
+        options of the rendering. Designators hyperlinked or left alone
+        because the item did not exist are checked again, a cached
+        text is only used if none of the items was created or
+        destroyed since.
+        """
+        if self._value is None:
+            return render()
+        key = (self._db.config.DATABASE, self._classname, self._nodeid,
+               self._name, hashlib.sha256(s2b(str(self._value))).digest(),
+               options)
+        outer = self._item_lookups
+        with _render_cache_lock:
+            entry = _render_cache.pop(key, None)
+        if entry is not None and not [
+                l for l in entry[1] if self._item_exists(*l[:2]) != l[2]]:
+            lookups = entry[1]
+        else:
+            self._item_lookups = lookups = []
+            try:
+                entry = (render(), lookups)
+            finally:
+                self._item_lookups = outer
+        with _render_cache_lock:
+            while len(_render_cache) >= RENDER_CACHE_SIZE:
+                # evict the least recently used texts
+                del _render_cache[next(iter(_render_cache))]
+            _render_cache[key] = entry
+        if outer is not None:
+            outer.extend(lookups)
+        return entry[0]
+
     def url_quote(self):
         """ Return the string in plain format but escaped for use in a url """
         return urllib_.quote(self.plain())
@@ -1818,16 +2041,13 @@ class StringHTMLProperty(HTMLProperty):
 
         if self._value is None:
             return ''
-        if escape:
-            s = html_escape(str(self._value))
-        else:
-            s = str(self._value)
         if hyperlink:
             # no, we *must* escape this text
-            if not escape:
-                s = html_escape(s)
-            s = self.hyper_re.sub(self._hyper_repl, s)
-        return s
+            return self._cached(lambda: self.hyper_re.sub(
+                self._hyper_repl, html_escape(str(self._value))), 'plain')
+        if escape:
+            return html_escape(str(self._value))
+        return str(self._value)
 
     def wrapped(self, escape=1, hyperlink=1, columns=80):
         """Render a "wrapped" representation of the property.
@@ -1849,6 +2069,11 @@ class StringHTMLProperty(HTMLProperty):
 
         if self._value is None:
             return ''
+        return self._cached(lambda: self._wrapped(escape, hyperlink, columns),
+                            'wrapped', bool(escape or hyperlink),
+                            bool(hyperlink), columns)
+
+    def _wrapped(self, escape, hyperlink, columns):
         s = '\n'.join(textwrap.wrap(str(self._value), columns,
                                     break_long_words=False))
         if escape:
@@ -1870,6 +2095,10 @@ class StringHTMLProperty(HTMLProperty):
 
         if not ReStructuredText:
             return self.plain(escape=0, hyperlink=hyperlink)
+        return self._cached(lambda: self._rst(hyperlink), 'rst',
+                            bool(hyperlink))
+
+    def _rst(self, hyperlink):
         s = self.plain(escape=0, hyperlink=0)
         if hyperlink:
             s = self.hyper_re.sub(self._hyper_repl_rst, s)
@@ -1908,6 +2137,11 @@ class StringHTMLProperty(HTMLProperty):
 
         if not markdown:
             return self.plain(escape=0, hyperlink=hyperlink)
+        return self._cached(lambda: self._markdown(hyperlink), 'markdown',
+                            markdown, bool(hyperlink),
+                            self._db.config['MARKDOWN_BREAK_ON_NEWLINE'])
+
+    def _markdown(self, hyperlink):
         s = self.plain(escape=0, hyperlink=0)
         if hyperlink:
             s = self.hyper_re.sub(self._hyper_repl_markdown, s)
@@ -2613,7 +2847,6 @@ class LinkHTMLProperty(HTMLProperty):
         linkcl = self._db.getclass(self._prop.classname)
         html = ['<select %s>' % self.cgi_escape_attrs(name=self._formname,
                                                       **html_kwargs)]
-        k = linkcl.labelprop(1)
         s = ''
         if value is None:
             s = 'selected="selected" '
@@ -2629,44 +2862,12 @@ class LinkHTMLProperty(HTMLProperty):
         else:
             sort_on = ('+', linkcl.orderprop())
 
-        options = [opt
-                   for opt in linkcl.filter(
-                           None, conditions, sort_on, (None, None))
-                   if self._db.security.hasPermission(
-                           "View", self._client.userid, linkcl.classname,
-                           itemid=opt)]
-
         # make sure we list the current value if it's retired
-        if value and value not in options:
-            options.insert(0, value)
-
-        if additional:
-            additional_fns = []
-            props = linkcl.getprops()
-            for propname in additional:
-                prop = props[propname]
-                if isinstance(prop, hyperdb.Link):
-                    cl = self._db.getclass(prop.classname)
-                    labelprop = cl.labelprop()
-                    fn = lambda optionid, cl=cl, linkcl=linkcl, \
-                                propname=propname, labelprop=labelprop: \
-                            cl.get(linkcl.get(optionid, propname), labelprop)
-                else:
-                    fn = lambda optionid, linkcl=linkcl, propname=propname: \
-                            linkcl.get(optionid, propname)
-                additional_fns.append(fn)
-
-        for optionid in options:
-            # get the option value, and if it's None use an empty string
-            try:
-                option = linkcl.get(optionid, k) or ''
-            except IndexError:
-                # optionid does not exist. E.G.
-                #   IndexError: no such queue z
-                # can be set using ?queue=z in URL for
-                # a new issue
-                continue
+        options = menu_options(self._db, self._client.userid, linkcl,
+                               sort_on, additional, conditions,
+                               [value] if value else ())
 
+        for optionid, option, additional_labels in options:
             # figure if this option is selected
             s = ''
             # record the marker for the selected item if requested
@@ -2689,11 +2890,8 @@ class LinkHTMLProperty(HTMLProperty):
             # truncate if it's too long
             if size is not None and len(lab) > size:
                 lab = lab[:size-3] + '...'
-            if additional:
-                m = []
-                for fn in additional_fns:
-                    m.append(str(fn(optionid)))
-                lab = lab + ' (%s)' % ', '.join(m)
+            if additional_labels:
+                lab = lab + ' (%s)' % ', '.join(additional_labels)
 
             # and generate
             tr = str
@@ -2917,16 +3115,9 @@ class MultilinkHTMLProperty(HTMLProperty):
         else:
             sort_on = ('+', linkcl.orderprop())
 
-        options = [opt
-                   for opt in linkcl.filter(None, conditions, sort_on)
-                   if self._db.security.hasPermission(
-                           "View", self._client.userid, linkcl.classname,
-                           itemid=opt)]
-
         # make sure we list the current values if they're retired
-        for val in value:
-            if val not in options:
-                options.insert(0, val)
+        options = menu_options(self._db, self._client.userid, linkcl,
+                               sort_on, additional, conditions, value)
 
         if not height:
             height = len(options)
@@ -2936,32 +3127,12 @@ class MultilinkHTMLProperty(HTMLProperty):
             height = min(height, 7)
         html = ['<select multiple %s>' % self.cgi_escape_attrs(
             name=self._formname, size=height, **html_kwargs)]
-        k = linkcl.labelprop(1)
 
         if value:  # FIXME '- no selection -' mark for translation
             html.append('<option value="%s">- no selection -</option>'
                         % ','.join(['-' + v for v in value]))
 
-        if additional:
-            additional_fns = []
-            props = linkcl.getprops()
-            for propname in additional:
-                prop = props[propname]
-                if isinstance(prop, hyperdb.Link):
-                    cl = self._db.getclass(prop.classname)
-                    labelprop = cl.labelprop()
-                    fn = lambda optionid, cl=cl, linkcl=linkcl, \
-                                propname=propname, labelprop=labelprop: \
-                            cl.get(linkcl.get(optionid, propname), labelprop)
-                else:
-                    fn = lambda optionid, linkcl=linkcl, propname=propname: \
-                            linkcl.get(optionid, propname)
-                additional_fns.append(fn)
-
-        for optionid in options:
-            # get the option value, and if it's None use an empty string
-            option = linkcl.get(optionid, k) or ''
-
+        for optionid, option, additional_labels in options:
             # figure if this option is selected
             s = ''
             if optionid in value or option in value:
@@ -2975,11 +3146,8 @@ class MultilinkHTMLProperty(HTMLProperty):
             # truncate if it's too long
             if size is not None and len(lab) > size:
                 lab = lab[:size-3] + '...'
-            if additional:
-                m = []
-                for fn in additional_fns:
-                    m.append(str(fn(optionid)))
-                lab = lab + ' (%s)' % ', '.join(m)
+            if additional_labels:
+                lab = lab + ' (%s)' % ', '.join(additional_labels)
 
             # and generate
             tr = str
@@ -3461,6 +3629,68 @@ function help_window(helpurl, width, height) {
 </script>
 """ % (self._client.client_nonce, self.base)
 
+    def _result_cache_key(self, klass, permission):
+        """ Return the key of the result ids of the current search in the
+            one time key database, None if results are not cached
+            (index_result_cache_ttl in config.ini).
+
+            The key depends on the session (or the user if there is
+            no session), the search and the write generations of the
+            classes the search and the permission checks use.
+        """
+        db = self._client.db
+        if not db.config.WEB_INDEX_RESULT_CACHE_TTL:
+            return None
+
+        names = list(self.filterspec or {})
+        names.extend([p for d, p in self.sort + self.group if p])
+        classnames = set([klass.classname, 'user'])
+        for name in names:
+            path = name.split('.')
+            for i in range(len(path)):
+                prop = klass.get_transitive_prop('.'.join(path[:i + 1]))
+                if isinstance(prop, (hyperdb.Link, hyperdb.Multilink)):
+                    classnames.add(prop.classname)
+
+        changed = getattr(db, 'changed_classes', None) or ()
+        if [c for c in classnames if c in changed]:
+            return None
+        generations = [(c, db.write_generation(c))
+                       for c in sorted(classnames)]
+        if [g for c, g in generations if g is None]:
+            return None
+
+        key = repr((self._client.session_api._sid or self._client.userid,
+                    self._client.userid, klass.classname, permission,
+                    sorted(self.filterspec.items()) if self.filterspec
+                    else None, self.sort, self.group, self.search_text,
+                    generations))
+        return 'result-ids-' + hashlib.sha256(s2b(key)).hexdigest()
+
+    def _cached_result(self, key):
+        """ Return the cached result ids for key or None."""
+        if key is None:
+            return None
+        otks = self._client.db.getOTKManager()
+        try:
+            values = otks.getall(key)
+        except KeyError:
+            return None
+        if values.get('expires', 0) < time.time():
+            return None
+        ids = values.get('ids')
+        return ids.split(',') if ids else []
+
+    def _cache_result(self, key, ids):
+        """ Store the result ids for key with the configured lifetime."""
+        if key is None:
+            return
+        otks = self._client.db.getOTKManager()
+        ttl = self._client.db.config.WEB_INDEX_RESULT_CACHE_TTL
+        otks.set(key, ids=','.join(ids), expires=time.time() + ttl,
+                 __timestamp=otks.lifetime(ttl))
+        otks.commit()
+
     def batch(self, permission='View'):
         """ Return a batch object for results from the "current search"
         """
@@ -3474,35 +3704,44 @@ function help_window(helpurl, width, height) {
         sort = self.sort
         group = self.group
 
-        # get the list of ids we're batching over
+        # get the list of ids we're batching over. Page 2..N of a
+        # search usually get the ids from the cache, the key includes
+        # the search text so the index is not searched again.
         klass = self.client.db.getclass(self.classname)
-        if self.search_text:
-            indexer = self.client.db.indexer
-            if indexer.query_language:
-                try:
+        key = self._result_cache_key(klass, permission)
+        allowed = self._cached_result(key)
+        if allowed is None:
+            if self.search_text:
+                indexer = self.client.db.indexer
+                if indexer.query_language:
+                    try:
+                        matches = indexer.search(
+                            [self.search_text], klass)
+                    except Exception as e:
+                        self.client.add_error_message(" ".join(e.args))
+                        raise
+                else:
                     matches = indexer.search(
-                        [self.search_text], klass)
-                except Exception as e:
-                    self.client.add_error_message(" ".join(e.args))
-                    raise
+                        [u2s(w.upper()) for w in re.findall(
+                            r'(?u)\b\w{%s,%s}\b' % (indexer.minlength,
+                                                    indexer.maxlength),
+                            s2u(self.search_text, "replace")
+                        )], klass)
             else:
-                matches = indexer.search(
-                    [u2s(w.upper()) for w in re.findall(
-                        r'(?u)\b\w{%s,%s}\b' % (indexer.minlength,
-                                                indexer.maxlength),
-                        s2u(self.search_text, "replace")
-                    )], klass)
-        else:
-            matches = None
+                matches = None
 
-        # filter for visibility
-        allowed = klass.filter_with_permissions(
-            matches, fspec, sort, group, permission=permission, userid=userid
-        )
+            # filter for visibility
+            allowed = klass.filter_with_permissions(
+                matches, fspec, sort, group, permission=permission,
+                userid=userid
+            )
+            self._cache_result(key, allowed)
 
-        # return the batch object, using IDs only
+        # return the batch object, using IDs only. Load the data
+        # of the displayed columns for the whole page at once.
         return Batch(self.client, allowed, self.pagesize, self.startwith,
-                     classname=self.classname)
+                     classname=self.classname,
+                     prefetch=self.columns + [p for d, p in self.group])
 
 
 # extend the standard ZTUtils Batch object to remove dependency on
@@ -3522,6 +3761,9 @@ class Batch(ZTUtils.Batch):
         orphan    if the next batch would contain less items than this
                   value, then it is combined with this batch
         overlap   the number of items shared between adjacent batches
+        prefetch  if sequence is a list of ids, names of the properties
+                  to load for all items of the batch when the first
+                  item is accessed
         ========= ========================================================
 
         Attributes: Note that the "start" attribute, unlike the
@@ -3532,11 +3774,14 @@ class Batch(ZTUtils.Batch):
         "sequence_length" is the length of the original, unbatched, sequence.
     """
     def __init__(self, client, sequence, size, start, end=0, orphan=0,
-                 overlap=0, classname=None):
+                 overlap=0, classname=None, prefetch=None):
         self.client = client
         self.last_index = self.last_item = None
         self.current_item = None
         self.classname = classname
+        self.prefetch = prefetch
+        # properties the user may view in all items of the class
+        self.viewable = None
         self.sequence_length = len(sequence)
         ZTUtils.Batch.__init__(self, sequence, size, start, end, orphan,
                                overlap)
@@ -3559,11 +3804,61 @@ class Batch(ZTUtils.Batch):
 
         item = self._sequence[index + self.first]
         if self.classname:
+            if self.prefetch is not None and self.viewable is None:
+                self.prefetch_page()
             # map the item ids to instances
             item = HTMLItem(self.client, self.classname, item)
+            if self.viewable:
+                item._viewable = self.viewable
         self.current_item = item
         return item
 
+    def prefetch_page(self):
+        """ Load the items of this batch and the labels of their Link
+            and Multilink properties with a fixed number of queries.
+            Also find the properties the user may view in every item of
+            the class, so they are not checked again for each item.
+        """
+        db = self.client.db
+        klass = db.getclass(self.classname)
+        props = klass.getprops()
+        columns = [name for name in self.prefetch if name in props]
+        nodeids = self._sequence[self.first:self.first + self.length]
+        klass.prefetch(nodeids, columns)
+
+        # collect the linked items and load them per class
+        linked = {}
+        for name in columns:
+            prop = props[name]
+            if not isinstance(prop, (hyperdb.Link, hyperdb.Multilink)):
+                continue
+            ids = linked.setdefault(prop.classname, set())
+            for nodeid in nodeids:
+                try:
+                    value = klass.get(nodeid, name, allow_abort=False)
+                except (IndexError, ValueError):
+                    continue
+                if isinstance(prop, hyperdb.Multilink):
+                    ids.update(value)
+                elif value:
+                    ids.add(value)
+        for classname, ids in linked.items():
+            if ids:
+                db.getclass(classname).prefetch(sorted(ids))
+
+        # Permissions without a check method grant access to all
+        # items, so the result of the check is the same for every row.
+        check = db.security.hasPermission
+        userid = self.client.userid
+        self.viewable = set(
+            name for name in columns
+            if check('View', userid, self.classname, name,
+                     skip_permissions_with_check=True))
+        if check('View', userid, self.classname,
+                 skip_permissions_with_check=True):
+            # None stands for the item itself
+            self.viewable.add(None)
+
     def propchanged(self, *properties):
         """ Detect if one of the properties marked as being a group
             property changed in the last iteration fetch
@@ -442,6 +442,19 @@ class IsolationOption(Option):
         raise OptionValueError(self, value, self.class_description)
 
 
+class RateLimitStoreOption(Option):
+    """Where the state of the api rate limit is kept"""
+
+    allowed = ('otk', 'memory', 'mmap', 'redis')
+    class_description = "Allowed values: %s" % ', '.join(allowed)
+
+    def str2value(self, value):
+        _val = value.lower()
+        if _val in self.allowed:
+            return _val
+        raise OptionValueError(self, value, self.class_description)
+
+
 class IndexerOption(Option):
     """Valid options for indexer"""
 
@@ -1096,6 +1109,17 @@ SETTINGS = (
             "      %s jinja2 module." % jinja2_avail),
         (FilePathOption, "templates", "html",
             "Path to the HTML templates directory."),
+        (NullableFilePathOption, "template_cache", "",
+            "Directory to store compiled templates in. All processes\n"
+            "running the tracker share the compiled templates, so a\n"
+            "new process does not have to compile them again. The\n"
+            "directory must be writable by the web and email\n"
+            "processes and not by untrusted users. If not set,\n"
+            "templates are compiled by every process.\n"
+            "The zopetal engine stores the compiled templates,\n"
+            "jinja2 the template bytecode and chameleon the python\n"
+            "modules generated from the templates. Use\n"
+            "'roundup-admin precompile' to fill the cache."),
         (MultiFilePathOption, "static_files", "",
             "A list of space separated directory paths (or a single\n"
             "directory).  These directories hold additional public\n"
@@ -1182,6 +1206,42 @@ SETTINGS = (
             "stop-words (eg. A,AND,ARE,AS,AT,BE,BUT,BY, ...). This is\n"
             "not used by the postgres native-fts indexer. But is used to\n"
             "filter search terms with the sqlite native-fts indexer."),
+        (IntegerNumberGeqZeroOption, "indexer_cache_size", "0",
+            "Number of full-text search results to cache. Repeating a\n"
+            "search (e.g. when paging through the results) reuses the\n"
+            "result of the index lookup until the index changes.\n"
+            "The cache is stored in the search-cache subdirectory of\n"
+            "the database directory and is shared by all processes.\n"
+            "Set to 0 to disable the cache."),
+        (BooleanOption, "indexer_deferred", "no",
+            "If set, changes to items do not update the full-text\n"
+            "index directly. The changed items are recorded in the\n"
+            "index-queue subdirectory of the database directory and\n"
+            "indexed by running 'roundup-admin indexqueue run'.\n"
+            "This removes the indexing cost from web and email\n"
+            "submissions. Searches do not find changes still in the\n"
+            "queue."),
+        (IntegerNumberGeqZeroOption, "indexer_extract_max_size", "0",
+            "Maximum number of characters of an html message or file\n"
+            "that are converted to text for the full-text index.\n"
+            "Longer content is truncated. The conversion is done\n"
+            "when running 'roundup-admin indexqueue run', even if\n"
+            "indexer_deferred is not set.\n"
+            "Set to 0 to disable indexing of html content."),
+        (IntegerNumberGeqZeroOption, "indexer_batch_size", "0",
+            "Used by the whoosh and xapian indexers. If set, changes\n"
+            "are collected and written to the index once this many\n"
+            "documents are pending instead of on every commit.\n"
+            "This speeds up bulk imports and reindexing, but changes\n"
+            "are not found until the batch is written. Pending\n"
+            "documents are always written when the database is\n"
+            "closed. 0 disables batching."),
+        (IntegerNumberGeqZeroOption, "indexer_batch_interval", "0",
+            "Used by the whoosh and xapian indexers. If set, pending\n"
+            "changes are written to the index at the first commit\n"
+            "after they have been pending for this many seconds.\n"
+            "Can be combined with indexer_batch_size. 0 disables\n"
+            "batching by time."),
         (OctalNumberOption, "umask", "0o002",
             "Defines the file creation mode mask."),
         (IntegerNumberGeqZeroOption, 'csv_field_size', '131072',
@@ -1266,6 +1326,34 @@ SETTINGS = (
             "header supplied by the client. It will compress the response\n"
             "on the fly using a common encoding. Disable it if your\n"
             "upstream server does compression of dynamic data."),
+        (IntegerNumberGeqZeroOption, "html_chunk_size", "0",
+            "If set to a number larger than 0, html pages are sent to\n"
+            "the browser while they are rendered, in chunks of about\n"
+            "this many characters. Pages smaller than the chunk size\n"
+            "are sent as usual. Once the first chunk is sent, headers\n"
+            "set by the template and errors while rendering can not\n"
+            "change the response any more, errors are appended to the\n"
+            "page. Dynamic compression uses gzip or brotli (zstd is not\n"
+            "used for chunked pages). Only the zopetal and jinja2\n"
+            "template engines support chunked output."),
+        (IntegerNumberGeqZeroOption, "index_result_cache_ttl", "0",
+            "If set to a number larger than 0, the sorted ids found by\n"
+            "the search of an index page are stored in the one time key\n"
+            "database for this many seconds. The other pages of the\n"
+            "result are shown without searching again. The cached ids\n"
+            "are per session and are discarded when items of the\n"
+            "searched classes or users are changed."),
+        (BooleanOption, "html_etags", "no",
+            "Setting this option sends an ETag with html pages. A\n"
+            "browser or proxy asking for an unchanged page with\n"
+            "If-None-Match gets a 304 (Not Modified) response without\n"
+            "rendering the page. The ETag is derived from the user, the\n"
+            "session, the templates, the url and the write generations\n"
+            "of the classes (or the activity of the item shown). A page\n"
+            "is only reused while its csrf tokens are valid for at least\n"
+            "half of the csrf_token_lifetime. Pages sent in chunks\n"
+            "(html_chunk_size) get no ETag when the headers were sent\n"
+            "before the page was completely rendered."),
         (BooleanOption, "use_precompressed_files", "no",
             "Setting this option enables Roundup to serve precompressed\n"
             "static files. The admin must create the compressed files with\n"
@@ -1345,6 +1433,10 @@ you want to enable translation based on browsers lang
 (if enabled), trackers lang (if set) or environment."""),
         (LogLevelOption, 'rest_logging', 'none',
             "Log-Level for REST errors."),
+        (IntegerNumberGeqZeroOption, 'rest_summary_cache_ttl', "60",
+         "Number of seconds the response of /rest/summary is\n"
+         "reused for a user as long as no issue is changed.\n"
+         "A value of 0 turns off the cache.\n"),
         (IntegerNumberGeqZeroOption, 'api_calls_per_interval', "0",
          "Limit API calls per api_interval_in_sec seconds to\n"
          "this number.\n"
@@ -1359,6 +1451,18 @@ you want to enable translation based on browsers lang
         (IntegerNumberGtZeroOption, 'api_interval_in_sec', "3600",
          "Defines the interval in seconds over which an api client can\n"
          "make api_calls_per_interval api calls. Tune this as needed.\n"),
+        (RateLimitStoreOption, 'api_rate_limit_store', "otk",
+         "Where the state of the api rate limit is kept:\n"
+         "otk - in the one time key database of the sessiondb section.\n"
+         "  Every api call writes to the database.\n"
+         "memory - in the memory of the server process. Use it with\n"
+         "  roundup-server in thread mode or a wsgi server running\n"
+         "  the tracker in a single process.\n"
+         "mmap - in a memory mapped file in the database directory\n"
+         "  shared by the processes on a host, e.g. roundup-server\n"
+         "  in fork mode.\n"
+         "redis - in the redis server of the sessiondb redis_url.\n"
+         "  Use it when the tracker is served by several hosts.\n"),
         (IntegerNumberGeqZeroOption, 'api_failed_login_limit', "4",
          "Limit login failure to the API per api_failed_login_interval_in_sec\n"
          "seconds.\n"
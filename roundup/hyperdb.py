@@ -24,6 +24,7 @@ __docformat__ = 'restructuredtext'
 
 # standard python modules
 import copy
+import datetime
 import logging
 import os
 import re
@@ -1368,6 +1369,20 @@ class Class:
         ur = set(self.db.user.get_roles(uid))
         allow_obsolete = bool(hr & ur)
 
+        # the permission checks only depend on the checked property
+        # (and linked item), remember the result for the next entries
+        checked = {}
+
+        def allowed(classname, itemid=None, property=None):
+            key = (classname, itemid, property)
+            if key not in checked:
+                checked[key] = (
+                    perm("View", uid, classname, itemid=itemid,
+                         property=property) or
+                    perm("Edit", uid, classname, itemid=itemid,
+                         property=property))
+            return checked[key]
+
         for j in self.db.getjournal(self.classname, nodeid):
             # hide/remove journal entry if:
             #   property is quiet
@@ -1393,16 +1408,9 @@ class Class:
                     # check if user can access the property on the
                     # item. This allows the check function in the
                     # property to deny access.
-                    if enforceperm and not (perm("View",
-                                                 uid,
-                                                 self.classname,
-                                                 itemid=nodeid,
-                                                 property=key) or
-                                            perm("Edit",
-                                                 uid,
-                                                 self.classname,
-                                                 itemid=nodeid,
-                                                 property=key)):
+                    if enforceperm and not allowed(self.classname,
+                                                   itemid=nodeid,
+                                                   property=key):
                         logger.debug("skipping unaccessible property "
                                      "%s::%s seen by user%s in %s",
                                      self.classname, key, uid, j_repr)
@@ -1458,28 +1466,15 @@ class Class:
                                      j_repr, action, self.classname, nodeid)
                         continue
                     # can user view the property in linkee class
-                    if enforceperm and not (perm("View",
-                                                 uid,
-                                                 linkcl,
-                                                 property=key) or
-                                            perm("Edit",
-                                                 uid,
-                                                 linkcl,
-                                                 property=key)):
+                    if enforceperm and not allowed(linkcl, property=key):
                         logger.debug("skipping unaccessible property: "
                                      "%s with uid %s %sed %s%s",
                                      j_repr, uid, action,
                                      self.classname, nodeid)
                         continue
                     # check access to linkee object
-                    if enforceperm and not (perm("View",
-                                                 uid,
-                                                 cls.classname,
-                                                 itemid=linkid) or
-                                            perm("Edit",
-                                                 uid,
-                                                 cls.classname,
-                                                 itemid=linkid)):
+                    if enforceperm and not allowed(cls.classname,
+                                                   itemid=linkid):
                         logger.debug("skipping unaccessible object: "
                                      "%s uid %s %sed %s%s",
                                      j_repr, uid, action,
@@ -1496,6 +1491,33 @@ class Class:
                                self.classname, nodeid, j)
         return journal
 
+    def journal_counts(self, since, action, propname=None):
+        """Count the journal entries of action (e.g. 'create' or
+        'set') made at or after the date since.
+
+        If propname is given only the 'set' entries changing this
+        property are counted.
+
+        Return a dictionary mapping the ids of the nodes with such
+        entries to their number. Unlike history no permissions are
+        checked.
+
+        This default reads the journals of the nodes changed since the
+        date, the SQL backends count the entries in the database.
+        """
+        counts = {}
+        for nodeid in self.filter(None, {'activity': '%s;' % since},
+                                  retired=None):
+            for _nodeid, ts, _tag, act, params in self.db.getjournal(
+                    self.classname, nodeid):
+                if ts < since or act != action:
+                    continue
+                if propname is not None and not (
+                        isinstance(params, dict) and propname in params):
+                    continue
+                counts[nodeid] = counts.get(nodeid, 0) + 1
+        return counts
+
     # Locating nodes:
     def hasnode(self, nodeid):
         """Determine if the given nodeid actually exists
@@ -1814,6 +1836,15 @@ class Class:
     # anyway).
     filter_iter = filter
 
+    def prefetch(self, nodeids, propnames=()):
+        """Load the given nodes into the backend's node cache, so that
+        following get() calls don't query the database for each node.
+        Multilink properties listed in propnames are loaded too.
+
+        This is only an optimisation, the default does nothing.
+        """
+        pass
+
     def filter_with_permissions(self, search_matches, filterspec, sort=[],
                                 group=[], retired=False, exact_match_spec={},
                                 limit=None, offset=None,
@@ -1867,6 +1898,215 @@ class Class:
                            if check(permission, userid, cn, itemid=item_id)]
         return allowed
 
+    def filter_iter_with_permissions(self, search_matches, filterspec,
+                                     sort=[], group=[], retired=False,
+                                     exact_match_spec={}, limit=None,
+                                     offset=None, permission='View',
+                                     userid=None):
+        """ Do the same as filter_with_permissions but return an
+            iterator over the ids (see filter_iter). Unless the user
+            may see all items of the class, the permission is checked
+            for each item as it is returned.
+        """
+        if userid is None:
+            userid = self.db.getuid()
+        cn = self.classname
+        sec = self.db.security
+        filterspec = sec.filterFilterspec(userid, cn, filterspec)
+        if exact_match_spec:
+            exact_match_spec = sec.filterFilterspec(userid, cn,
+                                                    exact_match_spec)
+        sort = sec.filterSortspec(userid, cn, sort)
+        group = sec.filterSortspec(userid, cn, group)
+        check = sec.hasPermission
+        allowed = check(permission, userid, cn,
+                        skip_permissions_with_check=True)
+        for item_id in self.filter_iter(search_matches, filterspec, sort,
+                                        group, retired, exact_match_spec,
+                                        limit, offset):
+            if allowed or check(permission, userid, cn, itemid=item_id):
+                yield item_id
+
+    aggregate_units = ('day', 'week', 'month', 'year')
+
+    def _aggregate_spec(self, group_by, metrics):
+        """Check the group_by and metrics of aggregate. Return the
+        group_by as a list of (propname, unit) and the metrics as a
+        list of (function, propname) pairs.
+        """
+        props = self.getprops()
+        groups = []
+        for name in group_by:
+            name, _sep, unit = name.partition(':')
+            prop = props.get(name)
+            if prop is None:
+                raise HyperdbValueError(_('Unknown property %(prop)s of '
+                                          'class %(class)s') % {
+                                              'prop': name,
+                                              'class': self.classname})
+            if isinstance(prop, Date):
+                unit = unit or 'day'
+                if unit not in self.aggregate_units:
+                    raise HyperdbValueError(_(
+                        'Unknown unit %(unit)s for grouping by %(prop)s, '
+                        'use one of %(units)s') % {
+                            'unit': unit, 'prop': name,
+                            'units': ', '.join(self.aggregate_units)})
+            elif unit or name == 'id' or not isinstance(
+                    prop, (Link, Multilink, String, Boolean, Number,
+                           Integer)):
+                raise HyperdbValueError(_('Can not group by %(prop)s') %
+                                        {'prop': name})
+            groups.append((name, unit or None))
+        functions = []
+        for metric in metrics:
+            m = re.match(r'^(min|max)\((\w+)\)$', metric)
+            if metric == 'count':
+                functions.append(('count', None))
+            elif m and isinstance(props.get(m.group(2)),
+                                  (Date, Number, Integer)):
+                functions.append((m.group(1), m.group(2)))
+            else:
+                raise HyperdbValueError(_(
+                    'Unknown metric %(metric)s, use count, min(property) '
+                    'or max(property) of a Date, Number or Integer '
+                    'property') % {'metric': metric})
+        return groups, functions
+
+    @staticmethod
+    def _aggregate_period(value, unit):
+        """Return the start of the period (day, week starting on
+        monday, month or year) of the date value.
+        """
+        if value is None:
+            return None
+        if unit == 'year':
+            return date.Date('%04d-01-01' % value.year)
+        if unit == 'month':
+            return date.Date('%04d-%02d-01' % (value.year, value.month))
+        day = date.Date('%04d-%02d-%02d' % (value.year, value.month,
+                                            value.day))
+        if unit == 'week':
+            weekday = datetime.date(value.year, value.month,
+                                    value.day).weekday()
+            day = day - date.Interval('%dd' % weekday)
+        return day
+
+    def _aggregate_rows(self, rows, group_by, metrics):
+        """Combine rows of (group values, metric values) with equal
+        group values, a count in the metric values is the number of
+        items of the row. Return the list of tuples of aggregate.
+        """
+        props = self.getprops()
+        # dates are not hashable, groups maps their string to the key
+        # and the metric values
+        groups = {}
+        for key, values in rows:
+            key = tuple([self._aggregate_period(v, unit) if unit else v
+                         for v, (_n, unit) in zip(key, group_by)])
+            hkey = tuple([v.serialise() if isinstance(v, date.Date) else v
+                          for v in key])
+            if hkey not in groups:
+                groups[hkey] = (key, list(values))
+                continue
+            old = groups[hkey][1]
+            for i, ((function, _pn), value) in enumerate(zip(metrics,
+                                                              values)):
+                if function == 'count':
+                    old[i] += value
+                elif value is None:
+                    pass
+                elif old[i] is None or (value < old[i] if function == 'min'
+                                        else value > old[i]):
+                    old[i] = value
+        if not group_by and not groups:
+            # the metrics of no nodes
+            groups[()] = ((), [0 if function == 'count' else None
+                               for function, _pn in metrics])
+
+        def sortkey(key):
+            result = []
+            for value, (name, _unit) in zip(key, group_by):
+                if value is None:
+                    result.append((0,))
+                elif isinstance(props[name], (Link, Multilink)):
+                    result.append((1, int(value)))
+                else:
+                    result.append((1, value))
+            return result
+        return [key + tuple(values) for key, values in
+                sorted(groups.values(), key=lambda g: sortkey(g[0]))]
+
+    def aggregate(self, search_matches, filterspec, group_by=(),
+                  metrics=('count',), retired=False, exact_match_spec={}):
+        """Summarize the nodes matching the filter (see filter for
+        search_matches, filterspec, retired and exact_match_spec) in
+        groups of nodes with the same values of the group_by
+        properties.
+
+        "group_by" is a list of property names. The value of a Date
+        property is reduced to the start of its period, a name like
+        'creation:week' selects a 'day' (the default), 'week'
+        (starting on monday), 'month' or 'year'. A node is counted in
+        the group of every item of a Multilink, an empty value forms a
+        group with value None.
+
+        "metrics" is a list of 'count' (the number of nodes),
+        'min(prop)' and 'max(prop)' where prop is a Date, Number or
+        Integer property.
+
+        Return a list of tuples sorted by the group values, each
+        tuple has the values of group_by followed by the values of
+        metrics.
+
+        This default walks the nodes, the SQL backends compute the
+        groups in the database.
+        """
+        group_by, metrics = self._aggregate_spec(group_by, metrics)
+        props = self.getprops()
+        rows = []
+        for nodeid in self.filter(search_matches, filterspec,
+                                  retired=retired,
+                                  exact_match_spec=exact_match_spec):
+            keys = [()]
+            for name, _unit in group_by:
+                value = self.get(nodeid, name)
+                if isinstance(props[name], Multilink):
+                    values = value or [None]
+                else:
+                    values = [value]
+                keys = [k + (v,) for k in keys for v in values]
+            values = [1 if function == 'count' else self.get(nodeid, pn)
+                      for function, pn in metrics]
+            rows.extend([(key, values) for key in keys])
+        return self._aggregate_rows(rows, group_by, metrics)
+
+    def aggregate_with_permissions(self, search_matches, filterspec,
+                                   group_by=(), metrics=('count',),
+                                   retired=False, exact_match_spec={},
+                                   permission='View', userid=None):
+        """ Do the same as aggregate but include only the items the
+            user is entitled to see (see filter_with_permissions).
+            The userid defaults to the current database user.
+        """
+        if userid is None:
+            userid = self.db.getuid()
+        cn = self.classname
+        sec = self.db.security
+        if not sec.hasPermission(permission, userid, cn,
+                                 skip_permissions_with_check=True):
+            # restrict the search to the permitted items
+            search_matches = self.filter_with_permissions(
+                search_matches, filterspec, retired=retired,
+                exact_match_spec=exact_match_spec, permission=permission,
+                userid=userid)
+        filterspec = sec.filterFilterspec(userid, cn, filterspec)
+        if exact_match_spec:
+            exact_match_spec = sec.filterFilterspec(userid, cn,
+                                                    exact_match_spec)
+        return self.aggregate(search_matches, filterspec, group_by,
+                              metrics, retired, exact_match_spec)
+
     def count(self):
         """Get the number of nodes in this class.
 
@@ -1938,6 +2178,7 @@ class Class:
 
     def fireReactors(self, event, nodeid, oldvalues):
         """Fire all registered reactors"""
+        self.db.note_change(self.classname)
         for _prio, _name, react in self.reactors[event]:
             try:
                 react(self.db, self, nodeid, oldvalues)
@@ -59,13 +59,16 @@ class Tracker:
         self.cgi_actions = {}
         self.templating_utils = {}
         self.templating_util_methods = {}
+        # responses of the REST interface reused by later requests
+        self.rest_cache = {}
 
         libdir = os.path.join(self.tracker_home, 'lib')
         self.libdir = (os.path.isdir(libdir) and libdir) or ''
 
         self.load_interfaces()
         self.templates = templating.get_loader(self.config["TEMPLATES"],
-                                               self.config["TEMPLATE_ENGINE"])
+                                               self.config["TEMPLATE_ENGINE"],
+                                               self.config["TEMPLATE_CACHE"])
 
         rdbms_backend = self.config.RDBMS_BACKEND
 
@@ -4,7 +4,12 @@
 # set/get_tat and marshaling as string, support for testonly
 # and status method.
 
+import mmap
+import os
+import struct
+import threading
 from datetime import datetime, timedelta
+from hashlib import md5
 
 try:
     # used by python 3.11 and newer use tz aware dates
@@ -22,6 +27,7 @@ except ImportError:
         return datetime.strptime(date, "%Y-%m-%dT%H:%M:%S.%f")
 
 from roundup.anypy.datetime_ import utcnow
+from roundup.backends import portalocker
 
 
 class RateLimit:  # pylint: disable=too-few-public-methods
@@ -69,20 +75,22 @@ class Gcra:
         # to datetime
         self.memory[key] = fromisoformat(tat)
 
-    def update(self, key, limit, testonly=False):
+    def update(self, key, limit, testonly=False, cost=1):
         '''Determine if the item associated with the key should be
-           rejected given the RateLimit limit.
+           rejected given the RateLimit limit. cost is the number of
+           calls the item counts for.
         '''
         now = utcnow()
         tat = max(self.get_tat(key), now)
         separation = (tat - now).total_seconds()
-        max_interval = limit.period.total_seconds() - limit.inverse
+        max_interval = limit.period.total_seconds() - cost * limit.inverse
         if separation > max_interval:
             reject = True
         else:
             reject = False
             if not testonly:
-                new_tat = max(tat, now) + timedelta(seconds=limit.inverse)
+                new_tat = max(tat, now) + timedelta(
+                    seconds=cost * limit.inverse)
                 self.set_tat(key, new_tat)
         return reject
 
@@ -142,3 +150,215 @@ class Gcra:
             pass
 
         return ret
+
+
+def tat_to_seconds(tat):
+    """Return the tat as seconds since the start of the unix epoch."""
+    return (tat - dt_epoch).total_seconds()
+
+
+def seconds_to_tat(seconds):
+    """Return the tat for seconds since the start of the unix epoch."""
+    return dt_epoch + timedelta(seconds=seconds)
+
+
+class RateLimitStore:
+    """Keeps the tats of the rate limited keys between requests.
+
+    update() checks and updates the tat of a key in one atomic step,
+    so concurrent requests can not both use the last available call.
+    """
+
+    def update(self, key, limit, cost=1):
+        """Return a tuple of the rejection of a request with the key
+           that counts for cost calls (see Gcra.update) and the status
+           of the key after the request (see Gcra.status).
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def apply(key, tat, limit, cost):
+        """Run the request on the tat (None if the key is unknown).
+           Return the rejection, the new tat and the status.
+        """
+        gcra = Gcra()
+        if tat is not None:
+            gcra.set_tat(key, tat)
+        reject = gcra.update(key, limit, cost=cost)
+        return reject, gcra.get_tat(key), gcra.status(key, limit)
+
+
+class OtkStore(RateLimitStore):
+    """Store the tats in the one time key database. Every update is
+       committed to the database.
+    """
+
+    def __init__(self, otk, lifetime=3600):
+        self.otk = otk
+        self.lifetime = lifetime
+
+    def update(self, key, limit, cost=1):
+        try:
+            tat = fromisoformat(self.otk.getall(key)['tat'])
+        except KeyError:
+            # ignore if tat not set, it's 1970-1-1 by default.
+            tat = None
+        reject, tat, status = self.apply(key, tat, limit, cost)
+        # Calculate a timestamp that will make OTK expire the
+        # unused entry in the future
+        self.otk.set(key, tat=tat.isoformat(),
+                     __timestamp=self.otk.lifetime(self.lifetime))
+        self.otk.commit()
+        return reject, status
+
+
+class MemoryStore(RateLimitStore):
+    """Store the tats in the memory of the process. The tats are
+       shared by the threads of a server but not by processes.
+    """
+
+    # drop the keys whose tat has passed when there are more keys
+    max_keys = 10000
+
+    def __init__(self):
+        self.gcra = Gcra()
+        self.lock = threading.Lock()
+
+    def update(self, key, limit, cost=1):
+        with self.lock:
+            reject = self.gcra.update(key, limit, cost=cost)
+            status = self.gcra.status(key, limit)
+            if len(self.gcra.memory) > self.max_keys:
+                now = utcnow()
+                for k, tat in list(self.gcra.memory.items()):
+                    if tat <= now:
+                        del self.gcra.memory[k]
+        return reject, status
+
+
+class MmapStore(RateLimitStore):
+    """Store the tats in a memory mapped file. The tats are shared by
+       all processes on the host using the file, e.g. the children of
+       a forking server.
+
+       The file is a hash table of slots entries, each a hash of the
+       key and its tat. When all slots near the slot of a key are
+       used, the key with the oldest tat is dropped.
+    """
+
+    slot = struct.Struct("<Qd")
+    # number of slots searched for a key
+    probes = 16
+
+    def __init__(self, path, slots=4096):
+        self.path = path
+        self.slots = slots
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        # the lock on the file is not exclusive between processes
+        # sharing the file descriptor, so every process opens the
+        # file.
+        if self.pid == os.getpid():
+            return
+        if self.pid is not None:
+            # inherited from the parent process
+            self.map.close()
+            self.file.close()
+        size = self.slots * self.slot.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.file = os.fdopen(fd, "r+b")
+        if os.fstat(fd).st_size < size:
+            self.file.truncate(size)
+        self.map = mmap.mmap(fd, size)
+        self.pid = os.getpid()
+
+    def find(self, key):
+        """Return the offset of the slot for key and its tat (None
+           if the key is not stored).
+        """
+        h = struct.unpack("<Q", md5(key.encode("utf-8")).digest()[:8])[0]
+        h = h or 1  # 0 marks an empty slot
+        now = tat_to_seconds(utcnow())
+        free = oldest = None
+        for i in range(self.probes):
+            offset = ((h + i) % self.slots) * self.slot.size
+            slot_hash, tat = self.slot.unpack_from(self.map, offset)
+            if slot_hash == h:
+                return h, offset, tat
+            if free is None and (slot_hash == 0 or tat <= now):
+                free = offset
+            if oldest is None or tat < oldest[1]:
+                oldest = (offset, tat)
+        return h, oldest[0] if free is None else free, None
+
+    def update(self, key, limit, cost=1):
+        with self.lock:
+            self.open()
+            portalocker.lock(self.file, portalocker.LOCK_EX)
+            try:
+                h, offset, tat = self.find(key)
+                if tat is not None:
+                    tat = seconds_to_tat(tat)
+                reject, tat, status = self.apply(key, tat, limit, cost)
+                self.slot.pack_into(self.map, offset, h,
+                                    tat_to_seconds(tat))
+            finally:
+                portalocker.unlock(self.file)
+        return reject, status
+
+
+class RedisStore(RateLimitStore):
+    """Store the tats in redis, shared by all hosts serving the
+       tracker. A tat is updated in a redis transaction that is
+       retried if the tat was changed by another request.
+    """
+
+    def __init__(self, url):
+        import redis
+        self.WatchError = redis.WatchError
+        self.redis = redis.Redis.from_url(url=url, decode_responses=False)
+
+    def update(self, key, limit, cost=1):
+        rkey = "RateLimit:%s" % key
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(rkey)
+                    tat = pipe.get(rkey)
+                    if tat is not None:
+                        tat = seconds_to_tat(float(tat))
+                    reject, tat, status = self.apply(key, tat, limit, cost)
+                    pipe.multi()
+                    # the tat is never later than a period from now
+                    pipe.set(rkey, repr(tat_to_seconds(tat)),
+                             ex=int(limit.period.total_seconds()) + 1)
+                    pipe.execute()
+                    return reject, status
+                except self.WatchError:
+                    continue
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(name, location):
+    """Return the store of type name ('memory', 'mmap' or 'redis')
+       for location: a name for the memory store, the path of the
+       file for mmap and the url of the server for redis. The stores
+       are created once per process and shared by its threads.
+    """
+    with _stores_lock:
+        if (name, location) not in _stores:
+            if name == "memory":
+                store = MemoryStore()
+            elif name == "mmap":
+                store = MmapStore(location)
+            elif name == "redis":
+                store = RedisStore(location)
+            else:
+                raise ValueError("Unknown rate limit store %s" % name)
+            _stores[(name, location)] = store
+        return _stores[(name, location)]
@@ -28,7 +28,7 @@ from roundup.anypy.urllib_ import urlsplit
 from roundup.cgi.exceptions import NotFound, PreconditionFailed, Unauthorised
 from roundup.exceptions import Reject, UsageError
 from roundup.i18n import _
-from roundup.rate_limit import Gcra, RateLimit
+from roundup.rate_limit import OtkStore, RateLimit, get_store
 
 logger = logging.getLogger('roundup.rest')
 
@@ -118,6 +118,10 @@ def _data_decorator(func):
             }
         else:
             if hasattr(self.db, 'stats') and self.report_stats:
+                if isinstance(data, CachedResponse):
+                    # shared with other requests, the stats are not
+                    # part of it
+                    data = dict(data)
                 self.db.stats['elapsed'] = time.time() - self.start
                 data['@stats'] = self.db.stats
             result = {
@@ -193,14 +197,25 @@ def calculate_etag(node, key, classname="Missing", node_id="0",
     Note that repr() is chosen for the node rather than str() since
     repr is meant to be an unambiguous representation.
 
+    Stored Multilink properties are not part of the representation:
+    they are the expensive ones to load, and any change to an item
+    (including to its Multilinks) also updates its activity and actor
+    which are included. Computed Multilinks (see rev_multilink) change
+    when other items link to this one, so they are included.
+
     classname and node_id are used for logging only.
     '''
 
-    items = node.items(protected=True)  # include every item
+    props = node.cl.getprops(protected=True)  # include every item
+    items = [(name, node.cl.get(node.nodeid, name))
+             for name in sorted(props)
+             if not (isinstance(props[name], hyperdb.Multilink) and
+                     not props[name].computed)]
     etag = hmac.new(bs2b(key), bs2b(repr_format +
-                                    repr(sorted(items))), md5).hexdigest()
-    logger.debug("object=%s%s; tag=%s; repr=%s", classname, node_id,
-                 etag, repr(node.items(protected=True)))
+                                    repr(items)), md5).hexdigest()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("object=%s%s; tag=%s; repr=%s", classname, node_id,
+                     etag, repr(items))
     # Quotes are part of ETag spec, normal headers don't have quotes
     return '"%s"' % etag
 
@@ -226,9 +241,11 @@ def check_etag(node, key, etags, classname="Missing", node_id="0",
         # but can include content-encoding suffix like:
         #   '"a46a5572190e4fad63958c135f3746fa-gzip"'
         # turn the latter into the former as we don't care what
-        # encoding was used to send the body with the etag.
+        # encoding was used to send the body with the etag. The
+        # etag of a response for a query has a suffix too (see
+        # RestfulInstance.response_etag).
         try:
-            suffix_start = etag.rindex('-')
+            suffix_start = etag.index('-')
             clean_etag = etag[:suffix_start] + '"'
         except (ValueError, AttributeError):
             # - not in etag or etag is None
@@ -243,6 +260,34 @@ def check_etag(node, key, etags, classname="Missing", node_id="0",
     return False
 
 
+def check_none_match(node_etag, headers):
+    '''Return True if the If-None-Match header lists node_etag.
+
+    A "*" matches any etag. Weak etags (W/"...") and etags with a
+    content-encoding suffix added on the way out are compared by
+    their underlying value.
+    '''
+    header = headers.get("If-None-Match", None)
+    if not header:
+        return False
+    for etag in header.split(','):
+        etag = etag.strip()
+        if etag == '*':
+            return True
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        if etag == node_etag:
+            return True
+        try:
+            suffix_start = etag.rindex('-')
+            etag = etag[:suffix_start] + '"'
+        except ValueError:
+            pass
+        if etag == node_etag:
+            return True
+    return False
+
+
 def obtain_etags(headers, input_payload):
     '''Get ETags value from headers or payload data
        Only supports one etag value not list.
@@ -441,7 +486,8 @@ class RestfulInstance(object):
     __default_patch_op = "replace"  # default operator for PATCH method
     __accepted_content_type = {
         "application/json": "json",
-        "application/*": "json"     # json is preferred over application/xml
+        "application/*": "json",    # json is preferred over application/xml
+        "application/x-ndjson": "ndjson",
     }
     __default_accept_type = "json"
 
@@ -450,6 +496,13 @@ class RestfulInstance(object):
 
     api_version = None
 
+    # format of the response set by dispatch
+    output_format = None
+
+    # set while the operations of an atomic batch are run, they are
+    # committed together (see post_batch)
+    in_atomic_batch = False
+
     # to allow override from interfaces.py.
     # Used for msg class. Could
     # be useful to set to text/markdown.
@@ -459,6 +512,12 @@ class RestfulInstance(object):
     # limit is 1 less than this size.
     max_response_row_size = 10000001
 
+    # number of items of a collection loaded at once (see prefetch_items)
+    prefetch_batch_size = 50
+
+    # number of parsed Accept headers remembered (see parse_accept)
+    max_accept_headers = 100
+
     def __init__(self, client, db):
         self.client = client
         self.db = db
@@ -478,9 +537,6 @@ class RestfulInstance(object):
         self.base_path = '%srest' % (self.db.config.TRACKER_WEB)
         self.data_path = self.base_path + '/data'
 
-        if dicttoxml:  # add xml if supported
-            self.__accepted_content_type["application/xml"] = "xml"
-
     def props_from_args(self, cl, args, itemid=None, skip_protected=True):
         """Construct a list of properties from the given arguments,
         and return them after validation.
@@ -629,6 +685,81 @@ class RestfulInstance(object):
 
         return result
 
+    def schema_table(self, name, build):
+        """Return the value called name that depends only on the
+        schema and the config of the tracker. It is computed by
+        build() on first use and kept in the rest_cache of the
+        tracker, so it is computed once per tracker load.
+
+        Without optimize the tracker executes schema.py on every
+        request so changes apply without a restart, then the value
+        is built for every request as well.
+        """
+        instance = self.client.instance
+        cache = getattr(instance, 'rest_cache', None)
+        if cache is None or not getattr(instance, 'optimize', False):
+            return build()
+        key = ('schema', name)
+        try:
+            return cache[key]
+        except KeyError:
+            value = cache[key] = build()
+            return value
+
+    def content_types(self):
+        """Return the mime types of the structured output formats
+        mapped to the format and the lists of them used in error
+        messages. Also holds the parsed Accept headers seen so far.
+        """
+        def build():
+            accepted = dict(self.__accepted_content_type)
+            if dicttoxml:  # add xml if supported
+                accepted["application/xml"] = "xml"
+            return {
+                'accepted': accepted,
+                'extensions': frozenset(accepted.values()),
+                'acceptable_extensions': ", ".join(sorted(
+                    set(accepted.values()))),
+                'acceptable_types': ", ".join(sorted(accepted)),
+                'report_types': ", ".join(sorted(
+                    list(accepted) + ["*/*"])),
+                'accept_headers': {},
+            }
+        return self.schema_table('content_types', build)
+
+    def parse_accept(self, accept):
+        """Return parse_accept_header(accept). Clients send the same
+        few Accept headers, so the result is remembered for up to
+        max_accept_headers different headers.
+        """
+        parsed = self.content_types()['accept_headers']
+        try:
+            return parsed[accept]
+        except KeyError:
+            pass
+        result = parse_accept_header(accept)
+        if len(parsed) >= self.max_accept_headers:
+            parsed.clear()
+        parsed[accept] = result
+        return result
+
+    def attribute_methods(self, class_name):
+        """Return a dict mapping the properties of the class to the
+        methods allowed on their attribute uri. Raises NotFound if
+        there is no such class.
+        """
+        if class_name not in self.db.classes:
+            raise NotFound('Class %s not found' % class_name)
+
+        def build():
+            class_obj = self.db.getclass(class_name)
+            methods = dict.fromkeys(class_obj.getprops(protected=True),
+                                    "OPTIONS, GET")
+            methods.update(dict.fromkeys(class_obj.getprops(protected=False),
+                                         "OPTIONS, GET, PUT, DELETE, PATCH"))
+            return methods
+        return self.schema_table(('attribute_methods', class_name), build)
+
     def patch_data(self, op, old_val, new_val):
         """Perform patch operation based on old_val and new_val
 
@@ -681,6 +812,13 @@ class RestfulInstance(object):
 
         return result
 
+    def commit(self):
+        '''Commit the changes of a request unless it is run by an
+        atomic batch, which commits all of its operations together.
+        '''
+        if not self.in_atomic_batch:
+            self.db.commit()
+
     def raise_if_no_etag(self, class_name, item_id, input_payload,
                          repr_format="json"):
         class_obj = self.db.getclass(class_name)
@@ -693,11 +831,210 @@ class RestfulInstance(object):
                 "If-Match is missing or does not match."
                 " Retrieve asset and retry modification if valid.")
 
-    def format_item(self, node, item_id, props=None, verbose=1):
-        ''' display class obj as requested by verbose and
-            props.
+    def response_etag(self, etag, input_payload):
+        '''Return the etag of the response to a GET on an item or
+        attribute with the etag of the item. The query selects the
+        properties and their format, so it is added to the etag as a
+        suffix. check_etag ignores the suffix, so the etag can be
+        used with If-Match too.
+
+        With @verbose > 1 the labels of linked items are included, so
+        the write generations of all classes are added as well.
+        Returns None if they are not available: the response can not
+        be validated and is not answered with 304.
+        '''
+        query = []
+        verbose = 1
+        for form_field in input_payload.value:
+            query.append((form_field.name, form_field.value))
+            if form_field.name == "@verbose":
+                try:
+                    verbose = int(form_field.value)
+                except ValueError:
+                    pass
+        if not query:
+            return etag
+        if verbose > 1:
+            for classname in sorted(self.db.classes):
+                generation = self.db.write_generation(classname)
+                if generation is None:
+                    return None
+                query.append(generation)
+        suffix = hmac.new(bs2b(self.db.config.WEB_SECRET_KEY),
+                          bs2b(repr(query)), md5).hexdigest()
+        return '%s-%s"' % (etag[:-1], suffix)
+
+    def collection_etag(self, class_name, input_payload):
+        '''Return an etag for the collection of class_name selected by
+        the query in input_payload or None if the result can not be
+        validated.
+
+        The etag is derived from the query, the user and its roles and
+        the write generations of all classes: the permission checks
+        and the formatted properties of linked items can depend on
+        items of other classes. Filters on Date properties can use
+        ranges relative to the current time, their result changes
+        without a write so these collections get no etag.
+        '''
+        query = []
+        for form_field in input_payload.value:
+            key = form_field.name
+            query.append((key, form_field.value))
+            if key.startswith("@"):
+                continue
+            cl = self.db.getclass(class_name)
+            for pn in key.rstrip(':~').split('.'):
+                prop = cl.getprops(protected=True).get(pn)
+                if prop is None or isinstance(prop, hyperdb.Date):
+                    return None
+                classname = getattr(prop, 'classname', None)
+                if classname is None:
+                    break
+                cl = self.db.getclass(classname)
+        uid = self.db.getuid()
+        validator = [class_name, query, uid,
+                     self.db.user.get(uid, 'roles')]
+        for classname in sorted(self.db.classes):
+            generation = self.db.write_generation(classname)
+            if generation is None:
+                return None
+            validator.append(generation)
+        etag = hmac.new(bs2b(self.db.config.WEB_SECRET_KEY),
+                        bs2b(repr(validator)), md5).hexdigest()
+        return '"%s"' % etag
+
+    def prefetch_items(self, class_obj, item_ids, props, verbose=1):
+        '''Load the properties props of the items item_ids of
+        class_obj into the node cache before they are formatted.
+
+        Transitive properties (e.g. assignedto.username) and, for
+        verbose > 1, the labels of linked items are loaded for all
+        items with one query per linked class and per Multilink (see
+        Class.prefetch) instead of queries per item.
+        '''
+        todo = [(class_obj, item_ids, [pn.split('.') for pn in props])]
+        while todo:
+            cl, ids, paths = todo.pop()
+            cl_props = cl.getprops(protected=True)
+            cl.prefetch(ids, [path[0] for path in paths
+                              if isinstance(cl_props.get(path[0]),
+                                            hyperdb.Multilink)])
+            linked = {}
+            for path in paths:
+                prop = cl_props.get(path[0])
+                if not isinstance(prop, (hyperdb.Link, hyperdb.Multilink)):
+                    continue
+                linkcl = self.db.getclass(prop.classname)
+                rest = path[1:]
+                if not rest:
+                    if verbose < 2:
+                        continue
+                    rest = [linkcl.labelprop()]
+                linked_ids, linked_paths = linked.setdefault(
+                    prop.classname, (set(), []))
+                for item_id in ids:
+                    value = cl.get(item_id, path[0])
+                    if isinstance(value, list):
+                        linked_ids.update(value)
+                    elif value is not None:
+                        linked_ids.add(value)
+                linked_paths.append(rest)
+            for classname, (linked_ids, linked_paths) in linked.items():
+                if linked_ids:
+                    todo.append((self.db.getclass(classname),
+                                 sorted(linked_ids), linked_paths))
+
+    def embed_props(self, class_obj, value):
+        '''Return the names of the properties listed (comma separated)
+        in value of an @embed. Only Link and Multilink properties of
+        class_obj can be embedded.
+        '''
+        props = class_obj.getprops(protected=True)
+        result = []
+        for pn in value.split(","):
+            if not isinstance(props.get(pn),
+                              (hyperdb.Link, hyperdb.Multilink)):
+                raise UsageError("Property %s of class %s can not be "
+                                 "embedded, it is not a Link or Multilink."
+                                 % (pn, class_obj.classname))
+            if pn not in result:
+                result.append(pn)
+        return result
+
+    def may_view(self, class_name, prop, item_id, view_cache=None):
+        '''Check the View permission on prop (None for the item
+        itself) of the item item_id.
+
+        view_cache memoises per class and property whether the
+        permission is granted without a check function. In this case
+        it holds for all items and the items are not checked one by
+        one.
         '''
         uid = self.db.getuid()
+        if view_cache is not None:
+            key = (class_name, prop)
+            if key not in view_cache:
+                view_cache[key] = self.db.security.hasPermission(
+                    'View', uid, class_name, prop,
+                    skip_permissions_with_check=True)
+            if view_cache[key]:
+                return True
+        return self.db.security.hasPermission('View', uid, class_name,
+                                              prop, item_id)
+
+    def embed_items(self, class_obj, item_ids, embed, included,
+                    verbose=1):
+        '''Add the items linked by the properties embed of the items
+        item_ids of class_obj to included, a dictionary mapping class
+        names to dictionaries of formatted items by id.
+
+        The linked items are loaded per class (see prefetch_items) and
+        the permission checks are memoised per class and property.
+        Items (and properties) the user may not view are left out.
+        '''
+        view_cache = {}
+        cn = class_obj.classname
+        class_obj.prefetch(item_ids, [pn for pn in embed if isinstance(
+            class_obj.getprops(protected=True)[pn], hyperdb.Multilink)])
+        linked = {}
+        for pn in embed:
+            prop = class_obj.getprops(protected=True)[pn]
+            done = included.setdefault(prop.classname, {})
+            linked_ids = linked.setdefault(prop.classname, set())
+            for item_id in item_ids:
+                if not self.may_view(cn, pn, item_id, view_cache):
+                    continue
+                value = class_obj.get(item_id, pn)
+                if not isinstance(value, list):
+                    value = [value] if value is not None else []
+                linked_ids.update([v for v in value if v not in done])
+        for classname, linked_ids in linked.items():
+            linkcl = self.db.getclass(classname)
+            ids = [i for i in sorted(linked_ids, key=int)
+                   if self.may_view(classname, None, i, view_cache)]
+            if not ids:
+                continue
+            props = set(linkcl.getprops(protected=False))
+            self.prefetch_items(linkcl, ids, props, verbose)
+            class_path = '%s/%s/' % (self.data_path, classname)
+            for item_id in ids:
+                r = {'id': item_id, 'link': class_path + item_id}
+                r.update(self.format_item(linkcl.getnode(item_id), item_id,
+                    props=props, verbose=verbose, view_cache=view_cache))
+                included[classname][item_id] = r
+
+    def format_included(self, included):
+        '''Return the included section of a response from the
+        dictionary filled by embed_items.
+        '''
+        return {classname: [items[i] for i in sorted(items, key=int)]
+                for classname, items in included.items() if items}
+
+    def format_item(self, node, item_id, props=None, verbose=1,
+                    view_cache=None):
+        ''' display class obj as requested by verbose and
+            props. view_cache is passed to may_view.
+        '''
         class_name = node.cl.classname
 
         # version never gets used since we only
@@ -717,9 +1054,7 @@ class RestfulInstance(object):
                 nd = node
                 cn = class_name
                 for p in pn.split('.'):
-                    if not self.db.security.hasPermission(
-                            'View', uid, cn, p, working_id
-                    ):
+                    if not self.may_view(cn, p, working_id, view_cache):
                         break
                     cl = self.db.getclass(cn)
                     nd = cl.getnode(working_id)
@@ -782,6 +1117,129 @@ class RestfulInstance(object):
 
         return result
 
+    def format_batch(self, class_obj, item_ids, display_props, verbose,
+                     embed=None, included=None):
+        '''Return the collection entries of the items item_ids, the
+        items are loaded together (see prefetch_items). The items
+        linked by the properties embed are added to included (see
+        embed_items).
+        '''
+        class_path = '%s/%s/' % (self.data_path, class_obj.classname)
+        if display_props:
+            self.prefetch_items(class_obj, item_ids, display_props, verbose)
+        entries = []
+        for item_id in item_ids:
+            # No need to check permission on id here, as we have only
+            # security-checked results
+            r = {'id': item_id, 'link': class_path + item_id}
+            if display_props:
+                # format_item does the permission checks
+                r.update(self.format_item(class_obj.getnode(item_id),
+                    item_id, props=display_props, verbose=verbose))
+            entries.append(r)
+        if embed:
+            self.embed_items(class_obj, item_ids, embed, included, verbose)
+        return entries
+
+    def stream_batches(self, result, class_obj, obj_iter, page_size,
+                       offset, display_props, verbose, embed=None):
+        '''Yield the entries of a streamed collection in lists of
+        prefetch_batch_size entries. Only page_size entries are
+        formatted, the rest of the items are counted. When done,
+        the total and the embedded items are stored in result.
+        '''
+        included = {}
+        if page_size is not None and page_size <= 0:
+            page_size = None
+        sent = count = 0
+        batch = []
+        for item_id in obj_iter:
+            count += 1
+            if page_size is not None and sent >= page_size:
+                continue
+            batch.append(item_id)
+            sent += 1
+            if len(batch) == self.prefetch_batch_size:
+                yield self.format_batch(class_obj, batch, display_props,
+                                        verbose, embed, included)
+                batch = []
+        if batch:
+            yield self.format_batch(class_obj, batch, display_props,
+                                    verbose, embed, included)
+        result['@total_size'] = offset + count
+        if embed:
+            result['included'] = self.format_included(included)
+
+    def add_filter(self, class_obj, key, value, filter_props, exact_props):
+        '''Add the filter key=value of a GET on class_obj to
+        filter_props, or to exact_props for an exact match (key
+        ending in ':') on a String.
+        '''
+        uid = self.db.getuid()
+        class_name = class_obj.classname
+        exact = False
+        if key.endswith(':'):
+            exact = True
+            key = key[:-1]
+        elif key.endswith('~'):
+            key = key[:-1]
+        p = key.split('.', 1)[0]
+        try:
+            prop = class_obj.getprops()[p]
+        except KeyError:
+            raise UsageError("Field %s is not valid for %s class." %
+                             (p, class_name))
+        # Call this for the side effect of validating the key
+        # use _discard as _ is apparently a global for the translation
+        # service.
+        _discard = self.transitive_props(class_name, [key])
+
+        # We drop properties without search permission silently
+        # This reflects the current behavior of other roundup
+        # interfaces
+        # Note that hasSearchPermission already returns 0 for
+        # non-existing properties.
+        if not self.db.security.hasSearchPermission(
+            uid, class_name, key
+        ):
+            raise (Unauthorised(
+                'User does not have search permission on "%s.%s"'
+                % (class_name, key)))
+
+        linkcls = class_obj
+        for p in key.split('.'):
+            prop = linkcls.getprops(protected=True)[p]
+            linkcls = getattr(prop, 'classname', None)
+            if linkcls:
+                linkcls = self.db.getclass(linkcls)
+
+        if isinstance(prop, (hyperdb.Link, hyperdb.Multilink)):
+            if key in filter_props:
+                vals = filter_props[key]
+            else:
+                vals = []
+            for p in value.split(","):
+                dig = (p and p.isdigit()) or \
+                    (p[0] in ('-', '+') and p[1:].isdigit())
+                if prop.try_id_parsing and dig:
+                    vals.append(p)
+                else:
+                    vals.append(linkcls.lookup(p))
+            filter_props[key] = vals
+        else:
+            if not isinstance(prop, hyperdb.String):
+                exact = False
+            props = filter_props
+            if exact:
+                props = exact_props
+            if key in props:
+                if isinstance(props[key], list):
+                    props[key].append(value)
+                else:
+                    props[key] = [props[key], value]
+            else:
+                props[key] = value
+
     @Routing.route("/data/<:class_name>", 'GET')
     @_data_decorator
     def get_collection(self, class_name, input_payload):
@@ -808,8 +1266,13 @@ class RestfulInstance(object):
         if not self.db.security.hasPermission('View', uid, class_name):
             raise Unauthorised('Permission to view %s denied' % class_name)
 
+        etag = self.collection_etag(class_name, input_payload)
+        if etag is not None:
+            if check_none_match(etag, self.client.request.headers):
+                self.client.setHeader("ETag", etag)
+                return 304, {}
+
         class_obj = self.db.getclass(class_name)
-        class_path = '%s/%s/' % (self.data_path, class_name)
 
         # Handle filtering and pagination
         filter_props = {}
@@ -820,8 +1283,10 @@ class RestfulInstance(object):
         }
         verbose = 1
         display_props = set()
+        embed = []
         sort = []
         group = []
+        stream = self.output_format == "ndjson"
         for form_field in input_payload.value:
             key = form_field.name
             value = form_field.value
@@ -844,6 +1309,13 @@ class RestfulInstance(object):
                 if len(f) == 1:
                     f = value.split(":")
                 display_props.update(self.transitive_props(class_name, f))
+            elif key == "@embed":
+                embed.extend([pn for pn in
+                              self.embed_props(class_obj, value)
+                              if pn not in embed])
+            elif key == "@stream":
+                if self.output_format == "json":
+                    stream = value.lower() == "true"
             elif key == "@sort":
                 f = value.split(",")
                 for p in f:
@@ -895,68 +1367,8 @@ class RestfulInstance(object):
                 # like @apiver
                 pass
             else:  # serve the filter purpose
-                exact = False
-                if key.endswith(':'):
-                    exact = True
-                    key = key[:-1]
-                elif key.endswith('~'):
-                    key = key[:-1]
-                p = key.split('.', 1)[0]
-                try:
-                    prop = class_obj.getprops()[p]
-                except KeyError:
-                    raise UsageError("Field %s is not valid for %s class." %
-                                     (p, class_name))
-                # Call this for the side effect of validating the key
-                # use _discard as _ is apparently a global for the translation
-                # service.
-                _discard = self.transitive_props(class_name, [key])
-
-                # We drop properties without search permission silently
-                # This reflects the current behavior of other roundup
-                # interfaces
-                # Note that hasSearchPermission already returns 0 for
-                # non-existing properties.
-                if not self.db.security.hasSearchPermission(
-                    uid, class_name, key
-                ):
-                    raise (Unauthorised(
-                        'User does not have search permission on "%s.%s"'
-                        % (class_name, key)))
-
-                linkcls = class_obj
-                for p in key.split('.'):
-                    prop = linkcls.getprops(protected=True)[p]
-                    linkcls = getattr(prop, 'classname', None)
-                    if linkcls:
-                        linkcls = self.db.getclass(linkcls)
-
-                if isinstance(prop, (hyperdb.Link, hyperdb.Multilink)):
-                    if key in filter_props:
-                        vals = filter_props[key]
-                    else:
-                        vals = []
-                    for p in value.split(","):
-                        dig = (p and p.isdigit()) or \
-                            (p[0] in ('-', '+') and p[1:].isdigit())
-                        if prop.try_id_parsing and dig:
-                            vals.append(p)
-                        else:
-                            vals.append(linkcls.lookup(p))
-                    filter_props[key] = vals
-                else:
-                    if not isinstance(prop, hyperdb.String):
-                        exact = False
-                    props = filter_props
-                    if exact:
-                        props = exact_props
-                    if key in props:
-                        if isinstance(props[key], list):
-                            props[key].append(value)
-                        else:
-                            props[key] = [props[key], value]
-                    else:
-                        props[key] = value
+                self.add_filter(class_obj, key, value, filter_props,
+                                exact_props)
         l = [filter_props]  # noqa: E741
         kw = {}
         if sort:
@@ -965,6 +1377,31 @@ class RestfulInstance(object):
             l.append(group)
         if exact_props:
             kw['exact_match_spec'] = exact_props
+
+        # add verbose elements. 2 and above get identifying label.
+        if verbose > 1:
+            lp = class_obj.labelprop()
+            display_props.add(lp)
+
+        if embed and self.output_format == "ndjson":
+            raise UsageError("@embed can not be used with ndjson output.")
+
+        if stream:
+            # the items are sent as they are loaded, there is no limit
+            # on the number of rows (the backends need a limit to use
+            # an offset)
+            if page['size'] is not None and page['size'] > 0 and \
+               page['index'] is not None and page['index'] > 1:
+                kw['limit'] = self.max_response_row_size
+                kw['offset'] = (page['index'] - 1) * page['size']
+            obj_iter = class_obj.filter_iter_with_permissions(None, *l, **kw)
+            result = StreamedCollection()
+            result.batches = self.stream_batches(
+                result, class_obj, obj_iter, page['size'], kw.get('offset', 0),
+                display_props, verbose, embed)
+            self.client.setHeader("Allow", "OPTIONS, GET, POST")
+            return 200, result
+
         if page['size'] is None:
             kw['limit'] = self.max_response_row_size
         elif page['size'] > 0:
@@ -988,27 +1425,22 @@ class RestfulInstance(object):
         # Note: We don't sort explicitly in python. The filter implementation
         # of the DB already sorts by ID if no sort option was given.
 
-        # add verbose elements. 2 and above get identifying label.
-        if verbose > 1:
-            lp = class_obj.labelprop()
-            display_props.add(lp)
+        result_len = len(obj_list)
+
+        # only the items of the page are returned
+        if page['size'] is not None and page['size'] > 0:
+            obj_list = obj_list[:page['size']]
 
         # extract result from data
         result = {}
         result['collection'] = []
-        for item_id in obj_list:
-            r = {}
-            # No need to check permission on id here, as we have only
-            # security-checked results
-            r = {'id': item_id, 'link': class_path + item_id}
-            if display_props:
-                # format_item does the permission checks
-                r.update(self.format_item(class_obj.getnode(item_id),
-                    item_id, props=display_props, verbose=verbose))
-            if r:
-                result['collection'].append(r)
-
-        result_len = len(result['collection'])
+        included = {}
+        for start in range(0, len(obj_list), self.prefetch_batch_size):
+            batch = obj_list[start:start + self.prefetch_batch_size]
+            result['collection'].extend(self.format_batch(
+                class_obj, batch, display_props, verbose, embed, included))
+        if embed:
+            result['included'] = self.format_included(included)
 
         if not overflow:  # noqa: SIM108  - no nested ternary
             # add back the number of items in the offset.
@@ -1022,10 +1454,6 @@ class RestfulInstance(object):
             # max size on this query.
             total_len = -1
 
-        # truncate result['collection'] to page size
-        if page['size'] is not None and page['size'] > 0:
-            result['collection'] = result['collection'][:page['size']]
-
         # pagination - page_index from 1...N
         if page['size'] is not None and page['size'] > 0:
             result['@links'] = {}
@@ -1051,8 +1479,114 @@ class RestfulInstance(object):
         result['@total_size'] = total_len
         self.client.setHeader("X-Count-Total", str(total_len))
         self.client.setHeader("Allow", "OPTIONS, GET, POST")
+        if etag is not None:
+            self.client.setHeader("ETag", etag)
         return 200, result
 
+    @Routing.route("/data/<:class_name>/@aggregate", 'GET')
+    @_data_decorator
+    def get_aggregate(self, class_name, input_payload):
+        """GET the number of items (and other metrics) in groups of
+        items with the same values, computed by the database.
+
+        The items are filtered like for a GET on the class, only
+        items with View permission are included.
+
+        Args:
+            class_name (string): class name of the resource (Ex: issue, msg)
+            input_payload (list): the submitted form of the user
+                @group_by: comma separated properties, a Date can have
+                    a :day, :week, :month or :year suffix
+                @metrics: comma separated list of count, min(prop)
+                    and max(prop), default count
+
+        Returns:
+            int: http status code 200 (OK)
+            dict: groups: list of the groups with the values of the
+                @group_by properties and the @metrics
+        """
+        if class_name not in self.db.classes:
+            raise NotFound('Class %s not found' % class_name)
+
+        uid = self.db.getuid()
+
+        if not self.db.security.hasPermission('View', uid, class_name):
+            raise Unauthorised('Permission to view %s denied' % class_name)
+
+        class_obj = self.db.getclass(class_name)
+
+        filter_props = {}
+        exact_props = {}
+        group_by = []
+        metrics = []
+        verbose = 1
+        for form_field in input_payload.value:
+            key = form_field.name
+            value = form_field.value
+            if key in ("@group_by", "@metrics"):
+                for p in value.split(","):
+                    if not p:
+                        raise UsageError("Empty property "
+                                         "for class %s." % (class_name))
+                    if key == "@group_by":
+                        pn = p.split(':', 1)[0]
+                        group_by.append(p)
+                    else:
+                        pn = p[4:-1] if p.endswith(')') else None
+                        metrics.append(p)
+                    # grouping shows the values of the property like
+                    # sorting by it
+                    if pn and not self.db.security.hasSearchPermission(
+                        uid, class_name, pn
+                    ):
+                        raise (Unauthorised(
+                            'User does not have search permission on "%s.%s"'
+                            % (class_name, pn)))
+            elif key == "@verbose":
+                try:
+                    verbose = int(value)
+                except ValueError as e:
+                    raise UsageError("When using @verbose: %s" %
+                                     (e.args[0]))
+            elif key.startswith("@"):
+                # ignore any unsupported control key like @apiver
+                pass
+            else:  # serve the filter purpose
+                self.add_filter(class_obj, key, value, filter_props,
+                                exact_props)
+        if not metrics:
+            metrics = ['count']
+
+        kw = {}
+        if exact_props:
+            kw['exact_match_spec'] = exact_props
+        try:
+            rows = class_obj.aggregate_with_permissions(
+                None, filter_props, group_by, metrics, **kw)
+        except hyperdb.HyperdbValueError as e:
+            raise UsageError(e.args[0])
+
+        props = class_obj.getprops()
+        groups = []
+        for row in rows:
+            group = {}
+            for name, v in zip(group_by, row):
+                prop = props[name.split(':', 1)[0]]
+                if verbose and v is not None and \
+                   isinstance(prop, (hyperdb.Link, hyperdb.Multilink)):
+                    linkcls = self.db.getclass(prop.classname)
+                    cp = '%s/%s/' % (self.data_path, prop.classname)
+                    v = {"id": v, "link": cp + v}
+                    if verbose > 1:
+                        label = linkcls.labelprop()
+                        v[label] = linkcls.get(v["id"], label)
+                group[name] = v
+            group.update(zip(metrics, row[len(group_by):]))
+            groups.append(group)
+
+        self.client.setHeader("Allow", "OPTIONS, GET")
+        return 200, {'groups': groups}
+
     @Routing.route("/data/user/roles", 'GET')
     @_data_decorator
     def get_roles(self, input_payload):
@@ -1133,6 +1667,12 @@ class RestfulInstance(object):
         node = class_obj.getnode(itemid)
         etag = calculate_etag(node, self.db.config.WEB_SECRET_KEY,
                               class_name, itemid, repr_format="json")
+        response_etag = self.response_etag(etag, input_payload)
+        if response_etag and check_none_match(response_etag,
+                                              self.client.request.headers):
+            self.client.setHeader("ETag", response_etag)
+            return 304, {}
+
         props = None
         protected = False
         verbose = 1
@@ -1175,7 +1715,7 @@ class RestfulInstance(object):
             '@etag': etag
         }
 
-        self.client.setHeader("ETag", etag)
+        self.client.setHeader("ETag", response_etag or etag)
         return 200, result
 
     @Routing.route("/data/<:class_name>/<:item_id>/<:attr_name>", 'GET')
@@ -1218,6 +1758,11 @@ class RestfulInstance(object):
             data = node.__getattr__(attr_name)
         except AttributeError:
             raise UsageError(_("Invalid attribute %s") % attr_name)
+        response_etag = self.response_etag(etag, input_payload)
+        if response_etag and check_none_match(response_etag,
+                                              self.client.request.headers):
+            self.client.setHeader("ETag", response_etag)
+            return 304, {}
         result = {
             'id': item_id,
             'type': str(type(data)),
@@ -1227,7 +1772,102 @@ class RestfulInstance(object):
             '@etag': etag
         }
 
-        self.client.setHeader("ETag", etag)
+        self.client.setHeader("ETag", response_etag or etag)
+        return 200, result
+
+    @Routing.route("/data/<:class_name>/<:item_id>/@history", 'GET')
+    @_data_decorator
+    def get_history(self, class_name, item_id, input_payload):
+        """GET the journal of an item, most recent entries first.
+
+        Only the entries and properties the user may see are returned
+        (see hyperdb.Class.history). Large journals can be fetched a
+        page at a time using @page_size and @page_index.
+
+        Args:
+            class_name (string): class name of the resource (Ex: issue, msg)
+            item_id (string): id of the resource (Ex: 12, 15)
+            input_payload (list): the submitted form of the user
+
+        Returns:
+            int: http status code 200 (OK)
+            dict: the journal entries of the item
+                history: list of entries with date, user, action and args
+                @total_size: number of visible journal entries
+        """
+        if class_name not in self.db.classes:
+            raise NotFound('Class %s not found' % class_name)
+        if not self.db.security.hasPermission(
+            'View', self.db.getuid(), class_name, itemid=item_id
+        ):
+            raise Unauthorised(
+                'Permission to view %s%s denied' % (class_name, item_id)
+            )
+
+        page = {
+            'size': None,
+            'index': 1,
+        }
+        for form_field in input_payload.value:
+            key = form_field.name
+            if key.startswith("@page_"):
+                key = key[6:]
+                try:
+                    page[key] = int(form_field.value)
+                except ValueError as e:
+                    raise UsageError("When using @page_%s: %s" %
+                                     (key, e.args[0]))
+
+        class_obj = self.db.getclass(class_name)
+        props = class_obj.getprops()
+        history = class_obj.history(item_id)
+        history.sort(key=lambda a: a[:3])
+        history.reverse()
+        total_len = len(history)
+        if page['size'] is not None and page['size'] > 0:
+            start = (page['index'] - 1) * page['size']
+            history = history[start:start + page['size']]
+
+        entries = []
+        for _id, evt_date, user, action, args in history:
+            if isinstance(args, dict):
+                args = dict(args)
+                for k, v in args.items():
+                    if isinstance(props.get(k), hyperdb.Password) and v:
+                        args[k] = "[password hidden]"
+            entries.append({
+                'date': evt_date,
+                'user': user,
+                'action': action,
+                'args': args,
+            })
+        result = {
+            'id': item_id,
+            'link': '%s/%s/%s/@history' % (self.data_path, class_name,
+                                           item_id),
+            'history': entries,
+            '@total_size': total_len,
+        }
+
+        # pagination - page_index from 1...N
+        if page['size'] is not None and page['size'] > 0:
+            result['@links'] = {}
+            for rel in ('next', 'prev', 'self'):
+                if rel == 'next':
+                    if page['index'] * page['size'] >= total_len: continue  # noqa: E701
+                    index = page['index'] + 1
+                if rel == 'prev':
+                    if page['index'] <= 1: continue  # noqa: E701
+                    index = page['index'] - 1
+                if rel == 'self': index = page['index']  # noqa: E701
+
+                result['@links'][rel] = [{
+                    'rel': rel,
+                    'uri': "%s?@page_index=%s&@page_size=%s" % (
+                        result['link'], index, page['size'])}]
+
+        self.client.setHeader("X-Count-Total", str(total_len))
+        self.client.setHeader("Allow", "OPTIONS, GET")
         return 200, result
 
     @Routing.route("/data/<:class_name>", 'POST')
@@ -1366,7 +2006,7 @@ class RestfulInstance(object):
         # do the actual create
         try:
             item_id = class_obj.create(**props)
-            self.db.commit()
+            self.commit()
         except (TypeError, IndexError, ValueError) as message:
             raise ValueError(message)
         except KeyError as msg:
@@ -1429,7 +2069,7 @@ class RestfulInstance(object):
         try:
             self.raise_if_no_etag(class_name, item_id, input_payload)
             result = class_obj.set(item_id, **props)
-            self.db.commit()
+            self.commit()
         except (TypeError, IndexError, ValueError) as message:
             raise ValueError(message)
         except KeyError as message:
@@ -1484,7 +2124,7 @@ class RestfulInstance(object):
         try:
             self.raise_if_no_etag(class_name, item_id, input_payload)
             result = class_obj.set(item_id, **props)
-            self.db.commit()
+            self.commit()
         except (TypeError, IndexError, ValueError) as message:
             raise ValueError(message)
         except KeyError as message:
@@ -1542,7 +2182,7 @@ class RestfulInstance(object):
         for item_id in class_obj.list():
             class_obj.retire (item_id)
 
-        self.db.commit()
+        self.commit()
         result = {
             'status': 'ok',
             'count': count
@@ -1578,7 +2218,7 @@ class RestfulInstance(object):
 
         self.raise_if_no_etag(class_name, item_id, input_payload)
         class_obj.retire(item_id)
-        self.db.commit()
+        self.commit()
         result = {
             'status': 'ok'
         }
@@ -1631,7 +2271,7 @@ class RestfulInstance(object):
         try:
             self.raise_if_no_etag(class_name, item_id, input_payload)
             class_obj.set(item_id, **props)
-            self.db.commit()
+            self.commit()
         except (TypeError, IndexError, ValueError) as message:
             raise ValueError(message)
         except KeyError as message:
@@ -1682,6 +2322,10 @@ class RestfulInstance(object):
         # if patch operation is action, call the action handler
         action_args = [class_name + item_id]
         if op == 'action':
+            if self.in_atomic_batch:
+                # actions commit their changes themselves
+                raise UsageError(
+                    'actions can not be used in an atomic batch')
             # extract action_name and action_args from form fields
             name = None
             for form_field in input_payload.value:
@@ -1734,7 +2378,7 @@ class RestfulInstance(object):
 
             try:
                 result = class_obj.set(item_id, **props)
-                self.db.commit()
+                self.commit()
             except (TypeError, IndexError, ValueError) as message:
                 raise ValueError(message)
 
@@ -1807,7 +2451,7 @@ class RestfulInstance(object):
 
         try:
             result = class_obj.set(item_id, **props)
-            self.db.commit()
+            self.commit()
         except (TypeError, IndexError, ValueError) as message:
             raise ValueError(message)
         except KeyError as message:
@@ -1845,6 +2489,28 @@ class RestfulInstance(object):
         )
         return 204, ""
 
+    @Routing.route("/data/<:class_name>/@aggregate", 'OPTIONS')
+    @_data_decorator
+    def options_aggregate(self, class_name, input_payload):
+        """OPTION return the HTTP Header for the aggregate of a class
+
+        Returns:
+            int: http status code 204 (No content)
+            body (string): an empty string
+        """
+        if class_name not in self.db.classes:
+            raise NotFound('Class %s not found' % class_name)
+        self.client.setHeader(
+            "Allow",
+            "OPTIONS, GET"
+        )
+
+        self.client.setHeader(
+            "Access-Control-Allow-Methods",
+            "OPTIONS, GET"
+        )
+        return 204, ""
+
     @Routing.route("/data/<:class_name>/<:item_id>", 'OPTIONS')
     @_data_decorator
     def options_element(self, class_name, item_id, input_payload):
@@ -1870,6 +2536,27 @@ class RestfulInstance(object):
         )
         return 204, ""
 
+    @Routing.route("/data/<:class_name>/<:item_id>/@history", 'OPTIONS')
+    @_data_decorator
+    def options_history(self, class_name, item_id, input_payload):
+        """OPTION return the HTTP Header for the history uri
+
+        Returns:
+            int: http status code 204 (No content)
+            body (string): an empty string
+        """
+        if class_name not in self.db.classes:
+            raise NotFound('Class %s not found' % class_name)
+        self.client.setHeader(
+            "Allow",
+            "OPTIONS, GET"
+        )
+        self.client.setHeader(
+            "Access-Control-Allow-Methods",
+            "OPTIONS, GET"
+        )
+        return 204, ""
+
     @Routing.route("/data/<:class_name>/<:item_id>/<:attr_name>", 'OPTIONS')
     @_data_decorator
     def option_attribute(self, class_name, item_id, attr_name, input_payload):
@@ -1879,35 +2566,147 @@ class RestfulInstance(object):
             int: http status code 204 (No content)
             body (string): an empty string
         """
-        if class_name not in self.db.classes:
-            raise NotFound('Class %s not found' % class_name)
-        class_obj = self.db.getclass(class_name)
-        if attr_name in class_obj.getprops(protected=False):
+        try:
+            methods = self.attribute_methods(class_name)[attr_name]
+        except KeyError:
+            raise NotFound('Attribute %s not valid for Class %s' % (
+                attr_name, class_name))
+        if methods != "OPTIONS, GET":
             self.client.setHeader(
                 "Accept-Patch",
                 "application/x-www-form-urlencoded, multipart/form-data"
             )
-            self.client.setHeader(
-                "Allow",
-                "OPTIONS, GET, PUT, DELETE, PATCH"
-            )
-            self.client.setHeader(
-                "Access-Control-Allow-Methods",
-                "OPTIONS, GET, PUT, DELETE, PATCH"
-            )
-        elif attr_name in class_obj.getprops(protected=True):
-            # It must match a protected prop. These can't be written.
-            self.client.setHeader(
-                "Allow",
-                "OPTIONS, GET"
-            )
-            self.client.setHeader(
-                "Access-Control-Allow-Methods",
-                "OPTIONS, GET"
-            )
-        else:
-            raise NotFound('Attribute %s not valid for Class %s' % (
-                attr_name, class_name))
+        # Protected props can't be written, they only allow GET.
+        self.client.setHeader(
+            "Allow",
+            methods
+        )
+        self.client.setHeader(
+            "Access-Control-Allow-Methods",
+            methods
+        )
+        return 204, ""
+
+    @Routing.route("/batch", 'POST')
+    @_data_decorator
+    def post_batch(self, input_payload):
+        """POST a list of operations to run in one request
+
+        The json payload has a list of operations, each is an object
+        with the method, the path (e.g. /data/issue/12) and the data
+        sent with it:
+
+          {"operations": [
+              {"method": "PATCH", "path": "/data/issue/12",
+               "data": {"@etag": "...", "priority": "urgent"}},
+              {"method": "DELETE", "path": "/data/issue/14",
+               "data": {"@etag": "..."}}],
+           "@atomic": true}
+
+        By default the batch is atomic: all operations are committed
+        together. The first failing operation rolls back the changes
+        of all operations and the rest is not run. If @atomic is
+        false, every operation is committed on its own and a failing
+        operation doesn't stop the batch.
+
+        The batch counts for one rate limited call per operation.
+
+        Returns:
+            int: http status code 200 (OK)
+            dict:
+                results (list): the status and output of every
+                    operation run (data or error as in a single call)
+                @committed (bool): False if the changes were rolled back
+        """
+        try:
+            operations = input_payload.json_dict['operations']
+            atomic = input_payload.json_dict.get('@atomic', True)
+        except (AttributeError, KeyError, TypeError):
+            raise UsageError("A batch must be a json object with a list "
+                             "of operations.")
+        if not isinstance(operations, list) or not operations:
+            raise UsageError("A batch must have a list of operations.")
+        paths = []
+        for op in operations:
+            if not (isinstance(op, dict) and
+                    isinstance(op.get('method'), basestring) and
+                    isinstance(op.get('path'), basestring) and
+                    isinstance(op.get('data', {}), dict)):
+                raise UsageError("Every operation of a batch must have a "
+                                 "method, a path and optionally data.")
+            path = op['path'].strip('/')
+            if not path.startswith('rest/'):
+                path = 'rest/' + path
+            if path == 'rest/batch':
+                raise UsageError("A batch can not contain a batch.")
+            paths.append(path)
+
+        # dispatch counted the batch as one call
+        apiRateLimit = self.getRateLimit()
+        if apiRateLimit and len(operations) > 1:
+            exceeded, limitStatus = self.handle_apiRateLimitExceeded(
+                apiRateLimit, cost=len(operations) - 1)
+            if exceeded:
+                # exceeded is the formatted error response
+                return 429, json.loads(b2s(exceeded))['error']['msg']
+            for header, value in limitStatus.items():
+                if header not in ('Retry-After',):
+                    self.client.setHeader(header, value)
+
+        headers = self.client.additional_headers
+        saved_headers = dict(headers)
+        output_format = self.output_format
+        results = []
+        committed = True
+        self.in_atomic_batch = bool(atomic)
+        # operations never send their output as a stream
+        self.output_format = None
+        try:
+            for op, path in zip(operations, paths):
+                payload = SimulateFieldStorageFromJson(
+                    json.dumps(op.get('data', {})))
+                try:
+                    output = Routing.execute(self, path, op['method'],
+                                             payload)
+                except NotFound as msg:
+                    output = self.error_obj(404, msg)
+                except Reject as msg:
+                    output = self.error_obj(405, msg.args[0])
+                result = {'status': self.client.response_code}
+                result.update(output)
+                results.append(result)
+                headers.clear()
+                headers.update(saved_headers)
+                if self.client.response_code >= 400:
+                    self.db.rollback()
+                    if atomic:
+                        committed = False
+                        break
+        finally:
+            self.in_atomic_batch = False
+            self.output_format = output_format
+        if committed:
+            self.db.commit()
+
+        return 200, {'results': results, '@committed': committed}
+
+    @Routing.route("/batch", 'OPTIONS')
+    @_data_decorator
+    def options_batch(self, input_payload):
+        """OPTION return the HTTP Header for the /batch element
+
+        Returns:
+            int: http status code 204 (No content)
+            body (string): an empty string
+        """
+        self.client.setHeader(
+            "Allow",
+            "OPTIONS, POST"
+        )
+        self.client.setHeader(
+            "Access-Control-Allow-Methods",
+            "OPTIONS, POST"
+        )
         return 204, ""
 
     @openapi_doc({
@@ -1991,8 +2790,15 @@ class RestfulInstance(object):
     def describe(self, input_payload):
         """Describe the rest endpoint. Return direct children in
            links list.
+
+           The response is built once per tracker load and sent
+           encoded with an ETag (see cached_output).
         """
+        return 200, self.schema_table(('describe', self.base_path),
+                                      self.build_describe)
 
+    def build_describe(self):
+        """Return the CachedResponse of describe."""
         # paths looks like ['^rest/$', '^rest/summary$',
         #                   '^rest/data/<:class>$', ...]
         paths = Routing._Routing__route_map.keys()
@@ -2015,13 +2821,11 @@ class RestfulInstance(object):
             links.append({"uri": self.base_path + rel_path,
                           "rel": rel})
 
-        result = {
+        return CachedResponse({
             "default_version": self.__default_api_version,
             "supported_versions": self.__supported_api_versions,
             "links": links
-        }
-
-        return 200, result
+        })
 
     @Routing.route("/", 'OPTIONS')
     @_data_decorator
@@ -2100,35 +2904,69 @@ class RestfulInstance(object):
         ):
             raise Unauthorised('Permission to view summary denied')
 
+        uid = self.db.getuid()
+        ttl = self.db.config.WEB_REST_SUMMARY_CACHE_TTL
+        cache = getattr(self.client.instance, 'rest_cache', None)
+        if not ttl or cache is None:
+            validator = None
+        else:
+            # the summary is valid until an issue or status is changed
+            validator = [self.db.write_generation(cn)
+                         for cn in ('issue', 'status')]
+            if None in validator:
+                validator = None
+        if validator is not None:
+            expires, old_validator, result = cache.get(('summary', uid),
+                                                       (0, None, None))
+            if expires > time.time() and old_validator == validator:
+                return 200, dict(result)
+
         old = date.Date('-1w')
+        issue = self.db.issue
+
+        # the recently-active issues with their title and status
+        issue_ids = issue.filter_with_permissions(None,
+                                                  {'activity': '-1w;'})
+        issue.prefetch(issue_ids)
+        status_ids = {issue.get(issue_id, 'status') for issue_id in issue_ids}
+        status_ids.discard(None)
+        self.db.status.prefetch(sorted(status_ids))
+
+        # the journals are counted for all issues at once
+        created_ids = issue.journal_counts(old, 'create')
+        discussed = {}
+        if not issue.properties['messages'].quiet:
+            discussed = issue.journal_counts(old, 'set', 'messages')
+        # like the history, only count the message changes the user
+        # may see; permissions with a check function need the item
+        perm = self.db.security.hasPermission
+        if not (perm('View', uid, 'issue', 'messages',
+                     skip_permissions_with_check=True) or
+                perm('Edit', uid, 'issue', 'messages',
+                     skip_permissions_with_check=True)):
+            discussed = {
+                issue_id: discussed[issue_id] for issue_id in issue_ids
+                if issue_id in discussed and (
+                    perm('View', uid, 'issue', 'messages', issue_id) or
+                    perm('Edit', uid, 'issue', 'messages', issue_id))}
 
         created = []
         summary = {}
         messages = []
-
-        # loop through all the recently-active issues
-        for issue_id in self.db.issue.filter(None, {'activity': '-1w;'}):
-            num = 0
-            status_name = self.db.status.get(
-                self.db.issue.get(issue_id, 'status'),
-                'name'
-            )
+        for issue_id in issue_ids:
+            status_id = issue.get(issue_id, 'status')
+            status_name = status_id and self.db.status.get(status_id, 'name')
             issue_object = {
                 'id': issue_id,
                 'link': self.base_path + '/data/issue/' + issue_id,
-                'title': self.db.issue.get(issue_id, 'title')
+                'title': issue.get(issue_id, 'title')
             }
-            for _x, ts, _uid, action, data in self.db.issue.history(issue_id):
-                if ts < old:
-                    continue
-                if action == 'create':
-                    created.append(issue_object)
-                elif action == 'set' and 'messages' in data:
-                    num += 1
+            if issue_id in created_ids:
+                created.append(issue_object)
             summary.setdefault(status_name, []).append(issue_object)
-            messages.append((num, issue_object))
+            messages.append((discussed.get(issue_id, 0), issue_object))
 
-        sorted(messages, key=lambda tup: tup[0], reverse=True)
+        messages.sort(key=lambda tup: tup[0], reverse=True)
 
         result = {
             'created': created,
@@ -2136,6 +2974,14 @@ class RestfulInstance(object):
             'most_discussed': messages[:10]
         }
 
+        if validator is not None:
+            now = time.time()
+            for key, entry in list(cache.items()):
+                if key[0] == 'summary' and entry[0] <= now:
+                    # another thread may have removed it already
+                    cache.pop(key, None)
+            cache[('summary', uid)] = (now + ttl, validator, result)
+            result = dict(result)
         return 200, result
 
     def getRateLimit(self):
@@ -2155,34 +3001,37 @@ class RestfulInstance(object):
         # disable rate limiting if either parameter is 0
         return None
 
-    def handle_apiRateLimitExceeded(self, apiRateLimit):
-        """Determine if the rate limit is exceeded.
+    def getRateLimitStore(self):
+        ''' Return the store keeping the state of the rate limit
+            selected by the web api_rate_limit_store setting. Like
+            getRateLimit this can be replaced in interfaces.py.
+        '''
+        config = self.db.config
+        name = config.WEB_API_RATE_LIMIT_STORE
+        if name == "otk":
+            # unused entries expire 1 hour in the future
+            return OtkStore(self.db.Otk, lifetime=3600)
+        if name == "mmap":
+            location = os.path.join(config.DATABASE, "api_rate_limit")
+        elif name == "redis":
+            location = config.SESSIONDB_REDIS_URL
+        else:
+            location = config.TRACKER_HOME
+        return get_store(name, location)
+
+    def handle_apiRateLimitExceeded(self, apiRateLimit, cost=1):
+        """Determine if the rate limit is exceeded. The request
+           counts for cost calls.
 
            If not exceeded, return False and the rate limit header values.
            If exceeded, return error message and None
         """
-        gcra = Gcra()
         # unique key is an "ApiLimit-" prefix and the uid)
         apiLimitKey = "ApiLimit-%s" % self.db.getuid()
-        otk = self.db.Otk
-        try:
-            val = otk.getall(apiLimitKey)
-            gcra.set_tat_as_string(apiLimitKey, val['tat'])
-        except KeyError:
-            # ignore if tat not set, it's 1970-1-1 by default.
-            pass
         # see if rate limit exceeded and we need to reject the attempt
-        reject = gcra.update(apiLimitKey, apiRateLimit)
-
-        # Calculate a timestamp that will make OTK expire the
-        # unused entry 1 hour in the future
-        ts = otk.lifetime(3600)
-        otk.set(apiLimitKey,
-                tat=gcra.get_tat_as_string(apiLimitKey),
-                __timestamp=ts)
-        otk.commit()
+        reject, limitStatus = self.getRateLimitStore().update(
+            apiLimitKey, apiRateLimit, cost=cost)
 
-        limitStatus = gcra.status(apiLimitKey, apiRateLimit)
         if not reject:
             return (False, limitStatus)
 
@@ -2355,8 +3204,9 @@ class RestfulInstance(object):
         # account recovery workflow, using a JWT with a short
         # expiration time and limited rights (e.g. only password
         # change permission))
+        content_types = self.content_types()
         if ext_type and (len(ext_type) < MAX_MIME_EXTENSION_LENGTH):
-            if ext_type not in list(self.__accepted_content_type.values()):
+            if ext_type not in content_types['extensions']:
                 self.client.response_code = 406
                 return (
                     None, uri,
@@ -2366,8 +3216,8 @@ class RestfulInstance(object):
                           "not available.\nAcceptable types: "
                           "%(acceptable)s\n") %
                         {"requested": ext_type,
-                         "acceptable": ", ".join(sorted(
-                             set(self.__accepted_content_type.values())))}))
+                         "acceptable": content_types[
+                             'acceptable_extensions']}))
 
             # strip extension so uri makes sense.
             # E.G. .../issue.json -> .../issue
@@ -2378,7 +3228,7 @@ class RestfulInstance(object):
         # Acceptable types ordered with preferred one (by q value)
         # first in list.
         try:
-            accept_header = parse_accept_header(
+            accept_header = self.parse_accept(
                 self.client.request.headers.get('Accept')
             )
         except UsageError as e:
@@ -2387,8 +3237,8 @@ class RestfulInstance(object):
                 400, _("Unable to parse Accept Header. %(error)s. "
                        "Acceptable types: */*, %(acceptable_types)s") % {
                            'error': e.args[0],
-                           'acceptable_types': ", ".join(sorted(
-                               self.__accepted_content_type.keys()))}))
+                           'acceptable_types': content_types[
+                               'acceptable_types']}))
 
         if not accept_header:
             # we are using the default
@@ -2420,8 +3270,8 @@ class RestfulInstance(object):
                 break
 
             # check for structured rest return types (json xml)
-            if part[0] in self.__accepted_content_type:
-                accept_type = self.__accepted_content_type[part[0]]
+            if part[0] in content_types['accepted']:
+                accept_type = content_types['accepted'][part[0]]
                 # Version order:
                 #  1) accept header version=X specifier
                 #     application/vnd.x.y; version=1
@@ -2473,10 +3323,10 @@ class RestfulInstance(object):
             return (accept_type, uri, None)
 
         if valid_binary_content_types:
-            report_acceptable_types = valid_binary_content_types
+            report_acceptable_types = ", ".join(sorted(
+                valid_binary_content_types))
         else:
-            report_acceptable_types = list(self.__accepted_content_type.keys())
-            report_acceptable_types.append("*/*")
+            report_acceptable_types = content_types['report_types']
 
         return (None, uri,
                 self.error_obj(
@@ -2486,8 +3336,7 @@ class RestfulInstance(object):
                       "%(acceptable)s") %
                     {"requested":
                      self.client.request.headers.get('Accept'),
-                     "acceptable": ", ".join(sorted(
-                         report_acceptable_types))}))
+                     "acceptable": report_acceptable_types}))
 
     def dispatch(self, method, uri, input_payload):
         """format and process the request"""
@@ -2539,6 +3388,7 @@ class RestfulInstance(object):
         (output_format, uri, error) = self.determine_output_format(uri)
         if error:
             output = error
+        self.output_format = output_format
 
         if method.upper() == 'OPTIONS':
             # add access-control-allow-* access-control-max-age to support
@@ -2714,7 +3564,21 @@ class RestfulInstance(object):
         # Format the content type
         # if accept_mime_type is None, the client specified invalid
         # mime types so we default to json output.
-        if accept_mime_type == "json" or accept_mime_type is None:
+        if isinstance(output, dict) and \
+           isinstance(output.get('data'), CachedResponse):
+            return self.cached_output(accept_mime_type, output['data'],
+                                      pretty_print)
+        elif isinstance(output, dict) and \
+           isinstance(output.get('data'), StreamedCollection):
+            if accept_mime_type == "ndjson":
+                self.client.setHeader("Content-Type", "application/x-ndjson")
+            else:
+                self.client.setHeader("Content-Type", "application/json")
+            return self.stream_output(accept_mime_type, output['data'])
+        elif accept_mime_type == "ndjson":
+            self.client.setHeader("Content-Type", "application/x-ndjson")
+            output = RoundupJSONEncoder().encode(output)
+        elif accept_mime_type == "json" or accept_mime_type is None:
             self.client.setHeader("Content-Type", "application/json")
             if pretty_print:
                 indent = 4
@@ -2756,6 +3620,8 @@ class RestfulInstance(object):
             # content is immutable by default, the client shouldn't
             # need the etag for writing.
             self.client.setHeader("ETag", None)
+            if self.client.response_code == 304:
+                return b""
             return output['data']['data']
         else:
             self.client.response_code = 500
@@ -2767,6 +3633,81 @@ class RestfulInstance(object):
         # separate from following text in logs etc..
         return bs2b(output + "\n")
 
+    def cached_output(self, accept_mime_type, data, pretty_print):
+        """Return the encoded response for the CachedResponse data.
+        Every encoding is computed once and kept with data together
+        with its Content-Type and ETag. A request listing the ETag in
+        If-None-Match is answered with 304 (not modified).
+        """
+        key = (accept_mime_type, pretty_print)
+        try:
+            content_type, etag, output = data.encodings[key]
+        except KeyError:
+            output = self.format_dispatch_output(
+                accept_mime_type, {'data': dict(data)}, pretty_print)
+            content_type = self.client.additional_headers.get(
+                "Content-Type")
+            etag = '"%s"' % md5(output).hexdigest()
+            data.encodings[key] = (content_type, etag, output)
+        else:
+            self.client.setHeader("Content-Type", content_type)
+
+        self.client.setHeader("ETag", etag)
+        if check_none_match(etag, self.client.request.headers):
+            self.client.response_code = 304
+            return b""
+        return output
+
+    def stream_output(self, accept_mime_type, collection):
+        '''Yield the encoded chunks of a streamed collection. For
+        ndjson every item is sent on a line of its own. Otherwise the
+        json document has the same structure as the unstreamed one.
+
+        The response is sent while it is generated, so an error can
+        not be reported in the response. It is logged and the output
+        stops; the client sees an incomplete document.
+        '''
+        encoder = RoundupJSONEncoder()
+        ndjson = accept_mime_type == "ndjson"
+        first = True
+        try:
+            if not ndjson:
+                yield b'{"data": {"collection": ['
+            for entries in collection.batches:
+                lines = [encoder.encode(entry) for entry in entries]
+                if ndjson:
+                    yield bs2b("".join([line + "\n" for line in lines]))
+                elif lines:
+                    yield bs2b(("" if first else ", ") + ", ".join(lines))
+                    first = False
+            if not ndjson:
+                # the values following the collection: @total_size etc.
+                tail = encoder.encode(dict(collection))
+                yield bs2b("]" + (", " if len(tail) > 2 else "") +
+                           tail[1:] + "}\n")
+        except Exception:
+            logger.exception("Error while sending collection, "
+                             "response is incomplete")
+
+
+class CachedResponse(dict):
+    """The data of a response that depends only on the schema and the
+    config (see RestfulInstance.schema_table). encodings maps the
+    output format to the encoded response, its Content-Type and ETag.
+    """
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.encodings = {}
+
+
+class StreamedCollection(dict):
+    """The collection of a GET on a class that is sent while it is
+    loaded. batches yields the entries of the collection in lists.
+    The dict has the values sent after the collection (@total_size
+    is added when all entries are sent).
+    """
+    batches = ()
+
 
 class RoundupJSONEncoder(json.JSONEncoder):
     """RoundupJSONEncoder overrides the default JSONEncoder to handle all
@@ -21,8 +21,10 @@
 __docformat__ = 'restructuredtext'
 
 import base64
+import itertools
 import logging
 import mimetypes
+import os
 import time
 from email import encoders
 from email.header import Header
@@ -45,6 +47,8 @@ try:
 except ImportError:
     gpg = None
 
+_generation_counter = itertools.count()
+
 
 class Database(object):
 
@@ -167,6 +171,58 @@ class Database(object):
 
         return self.__logger
 
+    def note_change(self, classname):
+        """ Record that items of the class were changed in the current
+            transaction. The write generation of the class is changed
+            when the transaction is committed.
+        """
+        if getattr(self, 'changed_classes', None) is None:
+            self.changed_classes = set()
+        self.changed_classes.add(classname)
+
+    def save_write_generations(self):
+        """ Change the write generation of the classes changed in the
+            transaction. Called by the backends after the commit.
+        """
+        changed = getattr(self, 'changed_classes', None)
+        self.changed_classes = set()
+        if not changed:
+            return
+        gen_dir = os.path.join(self.config.DATABASE, 'write-generations')
+        try:
+            if not os.path.exists(gen_dir):
+                os.makedirs(gen_dir)
+            # a unique value, a counter could be incremented to the
+            # same value by two processes committing at the same time
+            value = '%.6f-%d-%d' % (time.time(), os.getpid(),
+                                    next(_generation_counter))
+            for classname in changed:
+                tmp = os.path.join(gen_dir, '.%s-%s' % (classname, value))
+                with open(tmp, 'w') as f:
+                    f.write(value)
+                os.replace(tmp, os.path.join(gen_dir, classname))
+        except OSError as e:
+            self.log_info('cannot save write generations: %s', e)
+
+    def write_generation(self, classname):
+        """ Return a value that changes whenever a transaction changing
+            items of the class is committed, by any process using the
+            tracker. Used to invalidate caches of values computed from
+            the items of the class.
+
+            Returns None if the generation cannot be determined, the
+            caller must not use a cached value in this case.
+        """
+        try:
+            with open(os.path.join(self.config.DATABASE,
+                                   'write-generations', classname)) as f:
+                return f.read()
+        except FileNotFoundError:
+            # class not changed since the generations were introduced
+            return ''
+        except OSError:
+            return None
+
     def clearCache(self):
         """ Backends may keep a cache.
             It must be cleared at end of commit and rollback methods.
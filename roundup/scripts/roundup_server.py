@@ -238,6 +238,22 @@ class SecureHTTPServer(http_.server.HTTPServer):
         return (conn, info)
 
 
+class ChunkedWriter:
+    """Send the data written to wfile with the chunked transfer
+    encoding. Used for responses without a Content-Length header.
+    """
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, data):
+        # an empty chunk ends the response
+        if data:
+            self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
+
+    def close(self):
+        self.wfile.write(b'0\r\n\r\n')
+
+
 class RoundupRequestHandler(http_.server.BaseHTTPRequestHandler):
     TRACKER_HOMES = {}
     TRACKERS = None
@@ -566,7 +582,14 @@ class RoundupRequestHandler(http_.server.BaseHTTPRequestHandler):
 
         # do the roundup thing
         tracker = self.get_tracker(tracker_name)
-        tracker.Client(tracker, self, env).main()
+        try:
+            tracker.Client(tracker, self, env).main()
+        finally:
+            wfile = self.wfile
+            if isinstance(wfile, ChunkedWriter):
+                # the connection may be used for the next request
+                self.wfile = wfile.wfile
+                wfile.close()
 
     def address_string(self):
         """Get IP address of client from:
@@ -616,9 +639,21 @@ class RoundupRequestHandler(http_.server.BaseHTTPRequestHandler):
 
     def start_response(self, headers, response):
         self.send_response(response)
+        # a body without Content-Length (e.g. a page sent while it is
+        # rendered) is chunked so the connection can be kept alive
+        chunked = (self.protocol_version >= 'HTTP/1.1' and
+                   self.request_version >= 'HTTP/1.1' and
+                   self.command != 'HEAD' and
+                   response >= 200 and response not in (204, 304) and
+                   'content-length' not in [key.lower()
+                                            for key, _value in headers])
         for key, value in headers:
             self.send_header(key, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
         self.end_headers()
+        if chunked:
+            self.wfile = ChunkedWriter(self.wfile)
 
 
 def error():
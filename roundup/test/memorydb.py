@@ -339,6 +339,17 @@ class Database(back_anydbm.Database):
     def numfiles(self):
         return len(self.files) + len(self.tx_files)
 
+    def save_write_generations(self):
+        # keep the write generations in memory too
+        generations = self.__class__.memdb.setdefault('generations', {})
+        for classname in getattr(self, 'changed_classes', None) or ():
+            generations[classname] = '%d-%d' % (
+                os.getpid(), next(roundupdb._generation_counter))
+        self.changed_classes = set()
+
+    def write_generation(self, classname):
+        return self.__class__.memdb.get('generations', {}).get(classname, '')
+
     def close(self):
         self.clearCache()
         self.tx_files = {}
@@ -24,6 +24,7 @@ except ImportError:
     from base64 import encodestring as base64_encode
 
 import logging
+from unittest import mock
 from roundup.anypy.cgi_ import cgi
 from . import gpgmelib
 from email import message_from_string, message_from_bytes
@@ -344,6 +345,45 @@ class DBTest(commonDBTest):
         self.assertEqual(self.db.database_schema['version'],
                          self.db.current_db_version)
 
+    def testUpgrade_8_to_9(self):
+        """ add word positions to the native full-text index """
+        if(self.db.dbtype in ['anydbm', 'memorydb']):
+           self.skipTest('No schema upgrade needed on non rdbms backends')
+
+        # load the database
+        self.db.issue.create(title="flebble frooz")
+        self.db.commit()
+
+        if self.db.database_schema['version'] != 9:
+            self.skipTest("This test only runs for database version 9")
+
+        self.db.sql('alter table __words drop column _positions')
+        self.db.commit()
+        self.db.database_schema['version'] = 8
+
+        if hasattr(self, "downgrade_only"):
+            return
+
+        # test upgrade adding the column
+        self.db.post_init()
+
+        self.assertEqual(self.db.db_version_updated, True)
+
+        self.db.sql('select _positions from __words')
+
+        # the native index is rebuilt with positions
+        from roundup.backends.indexer_rdbms import Indexer
+        if isinstance(self.db.indexer, Indexer):
+            self.assertEqual(
+                [tuple(r) for r in self.db.indexer.find(['"flebble frooz"'])],
+                [('issue', '1', 'title')])
+
+        # running the upgrade again is harmless
+        self.db._add_word_positions()
+
+        self.assertEqual(self.db.database_schema['version'],
+                         self.db.current_db_version)
+
     def drop_key_retired_idx(self):
         c = self.db.cursor
         for cn, klass in self.db.classes.items():
@@ -351,6 +391,30 @@ class DBTest(commonDBTest):
                 sql = '''drop index _%s_key_retired_idx on _%s''' % (cn, cn)
                 self.db.sql(sql)
 
+    def testWriteGeneration(self):
+        status_gen = self.db.write_generation('status')
+        user_gen = self.db.write_generation('user')
+        id = self.db.status.create(name='pending')
+        # not committed yet
+        self.assertEqual(self.db.write_generation('status'), status_gen)
+        self.db.commit()
+        status_gen2 = self.db.write_generation('status')
+        self.assertNotEqual(status_gen2, status_gen)
+        self.assertEqual(self.db.write_generation('user'), user_gen)
+        # the generation is kept in the database directory
+        self.db.close()
+        self.db = self.module.Database(config, 'admin')
+        setupSchema(self.db, 0, self.module)
+        self.assertEqual(self.db.write_generation('status'), status_gen2)
+        # a rolled back change does not change the generation
+        self.db.status.retire(id)
+        self.db.rollback()
+        self.db.commit()
+        self.assertEqual(self.db.write_generation('status'), status_gen2)
+        self.db.status.retire(id)
+        self.db.commit()
+        self.assertNotEqual(self.db.write_generation('status'), status_gen2)
+
     #
     # automatic properties (well, the two easy ones anyway)
     #
@@ -1806,6 +1870,21 @@ class DBTest(commonDBTest):
         got.sort()
         self.assertEqual(got, [one, two, three, four])
 
+    def testEtagRevMultilink(self):
+        """The rest etag of an item covers its computed Multilinks,
+           they change without a change of the item itself.
+        """
+        from roundup.rest import calculate_etag
+        user = self.db.user.create(username='etag')
+        self.db.commit()
+        etag = calculate_etag(self.db.user.getnode(user), 'key')
+        self.db.issue.create(title='linking', nosy=[user])
+        self.db.commit()
+        self.assertEqual(self.db.user.get(user, 'activity'),
+                         self.db.user.get(user, 'creation'))
+        self.assertNotEqual(calculate_etag(self.db.user.getnode(user),
+                                           'key'), etag)
+
     def testFindRevLinkMultilink(self):
         ae, dummy = self.filteringSetupTransitiveSearch('user')
         ni = 'nosy_issues'
@@ -3211,6 +3290,93 @@ class DBTest(commonDBTest):
         # User may see own and public queries
         self.assertEqual(r, ['5', '6', '4', '3', '2', '1'])
 
+    def testFilterIterWithPermission(self):
+        view_query = self.setupQuery()
+        perm = self.db.security.addPermission
+        p = perm(name='View', klass='query', check=view_query)
+        self.db.security.addPermissionToRole("User", p)
+        filt = self.db.query.filter_iter_with_permissions
+
+        r = filt(None, {}, sort=[('+', 'name')])
+        self.assertFalse(isinstance(r, list))
+        # User may see own and public queries
+        self.assertEqual(list(r), ['5', '6', '4', '3', '2', '1'])
+
+    def testJournalCounts(self):
+        since = date.Date('-1d')
+        one = self.db.issue.create(title='one')
+        two = self.db.issue.create(title='two')
+        self.db.commit()
+        self.db.issue.set(one, title='one again')
+        self.db.issue.set(one, status='1')
+        self.db.issue.set(two, status='1')
+        self.db.commit()
+        issue = self.db.issue
+        for counts in (issue.journal_counts,
+                       lambda *a: hyperdb.Class.journal_counts(issue, *a)):
+            self.assertEqual(counts(since, 'create'), {one: 1, two: 1})
+            self.assertEqual(counts(since, 'set'), {one: 2, two: 1})
+            self.assertEqual(counts(since, 'set', 'title'), {one: 1})
+            self.assertEqual(counts(date.Date('.+1d'), 'set'), {})
+
+    def testAggregate(self):
+        self.filteringSetup()
+        issue = self.db.issue
+
+        def ae(*args, **kw):
+            expected = kw.pop('expected')
+            result = issue.aggregate(*args, **kw)
+            self.assertEqual(result, expected)
+            # the SQL backends give the same result as the default
+            self.assertEqual(hyperdb.Class.aggregate(issue, *args, **kw),
+                             expected)
+
+        ae(None, {}, ['status'], expected=[('1', 2), ('2', 1), ('3', 1)])
+        ae(None, {'status': '1'}, ['priority'],
+           ['count', 'max(deadline)'],
+           expected=[('2', 1, date.Date('2003-02-18')),
+                     ('3', 1, date.Date('2003-01-01'))])
+        ae(None, {}, ['status', 'priority'],
+           expected=[('1', '2', 1), ('1', '3', 1), ('2', '3', 1),
+                     ('3', '2', 1)])
+        ae(None, {}, ['nosy'],
+           expected=[(None, 2), ('1', 2), ('2', 2), ('3', 1)])
+        ae(None, {}, ['deadline:month'],
+           expected=[(date.Date('2003-01-01'), 1),
+                     (date.Date('2003-02-01'), 2),
+                     (date.Date('2004-03-01'), 1)])
+        ae(None, {}, ['deadline:week'],
+           expected=[(date.Date('2002-12-30'), 1),
+                     (date.Date('2003-02-10'), 1),
+                     (date.Date('2003-02-17'), 1),
+                     (date.Date('2004-03-08'), 1)])
+        ae(None, {'title': 'issue'}, [], ['count', 'min(deadline)'],
+           expected=[(3, date.Date('2003-01-01'))])
+        ae(None, {'title': 'nothing'}, [], ['count', 'min(deadline)'],
+           expected=[(0, None)])
+        ae(None, {'title': 'nothing'}, ['status'], expected=[])
+        issue.retire('4')
+        ae(None, {}, ['status'], expected=[('1', 2), ('2', 1)])
+
+        for group_by, metrics in ((['title:week'], ['count']),
+                                  (['deadline:hour'], ['count']),
+                                  (['unknown'], ['count']),
+                                  (['status'], ['sum(deadline)']),
+                                  (['status'], ['max(title)'])):
+            self.assertRaises(hyperdb.HyperdbValueError, issue.aggregate,
+                              None, {}, group_by, metrics)
+
+    def testAggregateWithPermission(self):
+        view_query = self.setupQuery()
+        perm = self.db.security.addPermission
+        p = perm(name='View', klass='query', check=view_query)
+        self.db.security.addPermissionToRole("User", p)
+        agg = self.db.query.aggregate_with_permissions
+        # User may see own and public queries
+        self.assertEqual(agg(None, {}, ['private_for']),
+                         [(None, 2), ('3', 4)])
+        self.assertEqual(agg(None, {'name': 'a'}), [(2,)])
+
 # XXX add sorting tests for other types
 
     # nuke and re-create db for restore
@@ -4422,6 +4588,148 @@ class HTMLItemTest(ClassicInitBase):
         ae(bool(issue ['assignedto']['username']),False)
         ae(bool(issue ['priority']['name']),False)
 
+    def testBatchPrefetch(self):
+        from roundup.cgi.templating import Batch
+        self.db.commit()
+        self.db.clearCache()
+        columns = ['title', 'status', 'assignedto', 'nosy']
+        batch = Batch(self.client, ['1', '2'], 50, 0, classname='issue',
+                      prefetch=columns)
+        issue = batch[0]
+        self.assertIn('title', issue._viewable)
+        self.assertIn(None, issue._viewable)
+
+        # the page data is loaded, rendering needs no more queries
+        if hasattr(self.db, 'sql'):
+            with mock.patch.object(self.db, 'sql', wraps=self.db.sql) as m:
+                rows = [[str(batch[i][c]) for c in columns] for i in (0, 1)]
+            self.assertEqual(m.call_count, 0)
+        else:
+            rows = [[str(batch[i][c]) for c in columns] for i in (0, 1)]
+        self.assertEqual(rows, [['ts1', 'deferred', 'worker5', 'worker5'],
+                                ['ts2', 'deferred', '', 'worker5']])
+
+    def testBatchResultCache(self):
+        from roundup.cgi.templating import HTMLRequest
+        self.db.commit()
+        self.client.session_api = MockNull(_sid='1234')
+        self.client.form = makeForm({'@columns': 'title', '@sort': 'title',
+                                     '@pagesize': '1', '@startwith': '1'})
+
+        def page_ids():
+            return [issue.id for issue in HTMLRequest(self.client).batch()]
+
+        # disabled by default
+        self.assertEqual(page_ids(), ['2'])
+        with mock.patch.object(self.db.issue, 'filter_with_permissions',
+                               wraps=self.db.issue.filter_with_permissions
+                               ) as m:
+            self.assertEqual(page_ids(), ['2'])
+            self.assertEqual(m.call_count, 1)
+
+        self.db.config['WEB_INDEX_RESULT_CACHE_TTL'] = 60
+        try:
+            self.assertEqual(page_ids(), ['2'])
+            with mock.patch.object(self.db.issue, 'filter_with_permissions',
+                                   wraps=self.db.issue.filter_with_permissions
+                                   ) as m:
+                self.assertEqual(page_ids(), ['2'])
+                self.assertEqual(m.call_count, 0)
+
+                # other sessions search again
+                self.client.session_api = MockNull(_sid='5678')
+                self.assertEqual(page_ids(), ['2'])
+                self.assertEqual(m.call_count, 1)
+
+                # a committed change invalidates the cached ids
+                ts0 = self.db.issue.create(title='ts0')
+                self.db.commit()
+                self.assertEqual(page_ids(), ['1'])
+                self.assertEqual(m.call_count, 2)
+                self.assertEqual(page_ids(), ['1'])
+                self.assertEqual(m.call_count, 2)
+
+            # paging a cached full-text search does not search again
+            self.client.form = makeForm({'@columns': 'title',
+                                         '@sort': 'title',
+                                         '@search_text': 'ts0',
+                                         '@pagesize': '1',
+                                         '@startwith': '0'})
+            with mock.patch.object(self.db.indexer, 'search',
+                                   wraps=self.db.indexer.search) as m:
+                self.assertEqual(page_ids(), [ts0])
+                self.assertEqual(m.call_count, 1)
+                self.assertEqual(page_ids(), [ts0])
+                self.assertEqual(m.call_count, 1)
+        finally:
+            self.db.config['WEB_INDEX_RESULT_CACHE_TTL'] = 0
+
+    def testMenuCache(self):
+        self.db.commit()
+        issue = HTMLItem(self.client, 'issue', '1')
+        menu = issue.status.menu()
+        self.assertIn('<option selected="selected" value="2">deferred',
+                      menu)
+
+        # the cached options are used, only the selection is rendered
+        with mock.patch.object(self.db.status, 'filter',
+                               wraps=self.db.status.filter) as m:
+            self.assertEqual(issue.status.menu(value='1'),
+                             menu.replace('selected="selected" ', '')
+                             .replace('value="1"',
+                                      'selected="selected" value="1"'))
+            self.assertEqual(m.call_count, 0)
+
+        # a committed change invalidates the cache
+        self.db.status.create(name='new-status', order='9')
+        self.db.commit()
+        self.assertIn('new-status', issue.status.menu())
+        issue = HTMLItem(self.client, 'issue', '2')
+        self.assertIn('worker5 (Worker)',
+                      issue.nosy.menu(additional=['realname']))
+        self.db.user.set('3', realname='Busy Worker')
+        self.db.commit()
+        self.assertIn('worker5 (Busy Worker)',
+                      issue.nosy.menu(additional=['realname']))
+
+        # options depending on a check function are not cached
+        has_permission = self.db.security.hasPermission
+        def check_only(*args, **kw):
+            if kw.get('skip_permissions_with_check'):
+                return False
+            return has_permission(*args, **kw)
+        issue = HTMLItem(self.client, 'issue', '1')
+        with mock.patch.object(self.db.security, 'hasPermission',
+                               check_only), \
+             mock.patch.object(self.db.status, 'filter',
+                               wraps=self.db.status.filter) as m:
+            issue.status.menu()
+            issue.status.menu()
+            self.assertEqual(m.call_count, 2)
+
+    def testHistoryPaging(self):
+        self.db.commit()
+        for status in ('3', '1', '4', '2', '1'):
+            self.db.issue.set('1', status=status)
+            self.db.commit()
+        issue = HTMLItem(self.client, 'issue', '1')
+
+        def rows(html):
+            return [r.strip() for r in html.split('</tr>')
+                    if r.strip().startswith('<tr><td>')]
+
+        full = rows(issue.history())
+        self.assertEqual(len(full), 6)
+        self.assertEqual(rows(issue.history(limit=2)), full[:2])
+        # the changes of the skipped entries are applied to the shown ones
+        with mock.patch.object(self.db.status, 'prefetch',
+                               wraps=self.db.status.prefetch) as m:
+            self.assertEqual(rows(issue.history(limit=2, offset=2)),
+                             full[2:4])
+            self.assertEqual(m.call_count, 1)
+        self.assertEqual(rows(issue.history(offset=4)), full[4:])
+        self.assertEqual(rows(issue.history(limit=2, offset=10)), [])
+
 def makeForm(args):
     """ Takes a dict of form elements or a FieldStorage.
 
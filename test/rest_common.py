@@ -1,5 +1,6 @@
 import pytest
 import unittest
+import os
 import shutil
 import sys
 import errno
@@ -1400,6 +1401,52 @@ class TestCase():
         #   page_size < 0
         #   page_index < 0
 
+    def testHistory(self):
+        issue_id = self.db.issue.create(title='title0')
+        self.db.commit()
+        for i in range(1, 5):
+            self.db.issue.set(issue_id, title='title%s' % i)
+            self.db.commit()
+        self.db.user.set(self.joeid, password=password.Password('new'))
+        self.db.commit()
+
+        results = self.server.get_history('issue', issue_id, self.empty_form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        history = results['data']['history']
+        self.assertEqual(len(history), 5)
+        self.assertEqual(results['data']['@total_size'], 5)
+        self.assertEqual(
+            self.dummy_client.additional_headers["X-Count-Total"], "5")
+        self.assertFalse('@links' in results['data'])
+        self.assertEqual(history[-1]['action'], 'create')
+        self.assertEqual(sorted(h['args']['title'] for h in history[:-1]),
+                         ['title0', 'title1', 'title2', 'title3'])
+
+        form = cgi.FieldStorage()
+        form.list = [
+            cgi.MiniFieldStorage('@page_size', '2'),
+            cgi.MiniFieldStorage('@page_index', '2'),
+        ]
+        results = self.server.get_history('issue', issue_id, form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        self.assertEqual(results['data']['history'], history[2:4])
+        self.assertEqual(results['data']['@total_size'], 5)
+        self.assertEqual(results['data']['@links']['next'][0]['uri'],
+                         "http://tracker.example/cgi-bin/roundup.cgi/bugs/"
+                         "rest/data/issue/%s/@history?@page_index=3&"
+                         "@page_size=2" % issue_id)
+        self.assertTrue('prev' in results['data']['@links'])
+
+        # passwords are not shown
+        results = self.server.get_history('user', self.joeid,
+                                          self.empty_form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        self.assertEqual(results['data']['history'][0]['args']['password'],
+                         '[password hidden]')
+
+        results = self.server.get_history('issue', '99', self.empty_form)
+        self.assertEqual(self.dummy_client.response_code, 404)
+
     def testRestRateLimit(self):
 
         calls_per_interval = 20
@@ -1529,6 +1576,45 @@ class TestCase():
         self.db.config['WEB_API_CALLS_PER_INTERVAL'] = 0
         self.db.config['WEB_API_INTERVAL_IN_SEC'] = 3600
             
+    def testRestRateLimitStore(self):
+        '''The memory and mmap stores keep the rate limit without
+           writing to the one time key database.
+        '''
+        from roundup import rate_limit
+
+        # the stores are shared by the trackers of this process
+        rate_limit._stores.clear()
+        self.addCleanup(rate_limit._stores.clear)
+        self.db.config['WEB_API_CALLS_PER_INTERVAL'] = 3
+        self.addCleanup(self.db.config.__setitem__,
+                        'WEB_API_CALLS_PER_INTERVAL', 0)
+        self.addCleanup(self.db.config.__setitem__,
+                        'WEB_API_RATE_LIMIT_STORE', 'otk')
+        key = "ApiLimit-%s" % self.joeid
+        for store in ('memory', 'mmap'):
+            self.db.config['WEB_API_RATE_LIMIT_STORE'] = store
+            self.server.client.env.update({'REQUEST_METHOD': 'GET'})
+            for i in range(3):
+                self.server.client.additional_headers.clear()
+                self.server.dispatch('GET', "/rest/data/user/%s/realname"
+                                     % self.joeid, self.empty_form)
+                self.assertEqual(self.server.client.response_code, 200)
+                self.assertEqual(self.server.client.additional_headers[
+                    "X-RateLimit-Remaining"], str(2 - i))
+            self.server.dispatch('GET', "/rest/data/user/%s/realname"
+                                 % self.joeid, self.empty_form)
+            self.assertEqual(self.server.client.response_code, 429)
+            self.assertFalse(self.db.Otk.exists(key))
+
+        self.assertTrue(os.path.exists(os.path.join(
+            self.db.config.DATABASE, 'api_rate_limit')))
+        # the state is kept in the file
+        store = rate_limit.MmapStore(os.path.join(
+            self.db.config.DATABASE, 'api_rate_limit'))
+        reject, status = store.update(key, self.server.getRateLimit())
+        self.assertTrue(reject)
+        self.assertEqual(status['X-RateLimit-Remaining'], '0')
+
     def testEtagGeneration(self):
         ''' Make sure etag generation is stable
         
@@ -1563,14 +1649,14 @@ class TestCase():
             items = node.items(protected=True) # include every item
             print(repr(sorted(items)))
             print(etag)
-            self.assertEqual(etag, '"07c3a7f214d394cf46220e294a5a53c8"')
+            self.assertEqual(etag, '"4285d46cb1df4214a4b68149bb3d294a"')
 
             # modify key and verify we have a different etag
             etag = calculate_etag(node, self.db.config['WEB_SECRET_KEY'] + "a")
             items = node.items(protected=True) # include every item
             print(repr(sorted(items)))
             print(etag)
-            self.assertNotEqual(etag, '"07c3a7f214d394cf46220e294a5a53c8"')
+            self.assertNotEqual(etag, '"4285d46cb1df4214a4b68149bb3d294a"')
 
             # change data and verify we have a different etag
             node.username="Paul"
@@ -1578,7 +1664,7 @@ class TestCase():
             items = node.items(protected=True) # include every item
             print(repr(sorted(items)))
             print(etag)
-            self.assertEqual(etag, '"d655801d3a6d51e32891531b06ccecfa"')
+            self.assertEqual(etag, '"3d96f1c85e5e1dae151ca64c66318961"')
         finally:
             date.Date = originalDate
         
@@ -1649,6 +1735,591 @@ class TestCase():
             else:
                 self.assertEqual(self.dummy_client.response_code, 412)
 
+    def testEtagNotModified(self):
+        '''A GET with If-None-Match listing the current etag of the
+           item is answered with 304 and no data. Changing only a
+           Multilink of the item changes its etag.
+        '''
+        issue_id = self.db.issue.create(title='etag issue', nosy=[self.joeid])
+        self.db.commit()
+
+        self.server.get_element('issue', issue_id, self.empty_form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        etag = self.dummy_client.additional_headers['ETag']
+
+        for none_match in (etag, 'W/' + etag, etag[:-1] + '-gzip"',
+                           '"bad", ' + etag, '*'):
+            self.headers = {'if-none-match': none_match}
+            results = self.server.get_element('issue', issue_id,
+                                              self.empty_form)
+            self.assertEqual(self.dummy_client.response_code, 304)
+            self.assertEqual(results, {'data': {}})
+            self.assertEqual(self.dummy_client.additional_headers['ETag'],
+                             etag)
+
+            results = self.server.get_attribute('issue', issue_id, 'title',
+                                                self.empty_form)
+            self.assertEqual(self.dummy_client.response_code, 304)
+
+        self.headers = {'if-none-match': '"bad"'}
+        results = self.server.get_element('issue', issue_id, self.empty_form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        self.assertEqual(results['data']['@etag'], etag)
+
+        # unknown attributes are still an error
+        self.headers = {'if-none-match': etag}
+        self.server.get_attribute('issue', issue_id, 'nosuch',
+                                  self.empty_form)
+        self.assertEqual(self.dummy_client.response_code, 400)
+
+        self.db.issue.set(issue_id, nosy=[self.joeid, '1'])
+        self.db.commit()
+        results = self.server.get_element('issue', issue_id, self.empty_form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        self.assertNotEqual(results['data']['@etag'], etag)
+        self.assertEqual(results['data']['attributes']['nosy'],
+                         [{'id': '1', 'link': self.url_pfx + 'user/1'},
+                          {'id': self.joeid,
+                           'link': self.url_pfx + 'user/' + self.joeid}])
+
+    def testEtagQuery(self):
+        '''The etag of a response depends on the query and with
+           @verbose > 1 on the labels of linked items. It can be used
+           with If-Match.
+        '''
+        issue_id = self.db.issue.create(title='etag issue', status='1')
+        self.db.commit()
+        self.server.get_element('issue', issue_id, self.empty_form)
+        etag = self.dummy_client.additional_headers['ETag']
+
+        form = cgi.FieldStorage()
+        form.list = [cgi.MiniFieldStorage('@verbose', '2')]
+        results = self.server.get_element('issue', issue_id, form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        self.assertEqual(results['data']['@etag'], etag)
+        verbose_etag = self.dummy_client.additional_headers['ETag']
+        self.assertNotEqual(verbose_etag, etag)
+
+        self.headers = {'if-none-match': etag}
+        self.server.get_element('issue', issue_id, form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        self.headers = {'if-none-match': verbose_etag}
+        self.server.get_element('issue', issue_id, form)
+        self.assertEqual(self.dummy_client.response_code, 304)
+
+        # the label of the status changes, the issue does not
+        self.db.status.set('1', name='renamed')
+        self.db.commit()
+        results = self.server.get_element('issue', issue_id, form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        self.assertEqual(results['data']['attributes']['status']['name'],
+                         'renamed')
+        self.assertNotEqual(self.dummy_client.additional_headers['ETag'],
+                            verbose_etag)
+
+        # the etag with the query suffix matches the item
+        self.headers = None
+        form = cgi.FieldStorage()
+        form.list = [cgi.MiniFieldStorage('@etag', verbose_etag),
+                     cgi.MiniFieldStorage('data', 'changed')]
+        self.server.put_attribute('issue', issue_id, 'title', form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        self.assertEqual(self.db.issue.get(issue_id, 'title'), 'changed')
+
+    def testCollectionEtag(self):
+        '''A collection is sent with an etag that depends on the query
+           and the write generations. A GET with If-None-Match listing
+           it is answered with 304 until an item is changed.
+        '''
+        issue_id = self.db.issue.create(title='etag issue', status='1')
+        self.db.commit()
+        self.server.client.env.update({'REQUEST_METHOD': 'GET'})
+
+        form = cgi.FieldStorage()
+        form.list = [
+            cgi.MiniFieldStorage('status', '1'),
+            cgi.MiniFieldStorage('@fields', 'title'),
+        ]
+        results = self.server.get_collection('issue', form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        etag = self.dummy_client.additional_headers['ETag']
+
+        self.headers = {'if-none-match': etag[:-1] + '-gzip"'}
+        self.dummy_client.additional_headers.clear()
+        results = self.server.get_collection('issue', form)
+        self.assertEqual(self.dummy_client.response_code, 304)
+        self.assertEqual(results, {'data': {}})
+        self.assertEqual(self.dummy_client.additional_headers['ETag'], etag)
+
+        # a different query has a different etag
+        other = cgi.FieldStorage()
+        other.list = form.list[:1]
+        results = self.server.get_collection('issue', other)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        self.assertNotEqual(self.dummy_client.additional_headers['ETag'],
+                            etag)
+
+        # changing an item changes the etag
+        self.db.issue.set(issue_id, title='changed')
+        self.db.commit()
+        results = self.server.get_collection('issue', form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        self.assertEqual(results['data']['collection'][0]['title'],
+                         'changed')
+        self.assertNotEqual(self.dummy_client.additional_headers['ETag'],
+                            etag)
+
+        # filters on dates can be relative to now: no etag
+        self.dummy_client.additional_headers.clear()
+        form.list = [cgi.MiniFieldStorage('activity', '-1d;')]
+        results = self.server.get_collection('issue', form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        self.assertNotIn('ETag', self.dummy_client.additional_headers)
+
+    def testCollectionPrefetch(self):
+        '''The fields of a collection are loaded per batch of items,
+           the number of queries does not grow with the number of items.
+        '''
+        from unittest import mock
+
+        def get_titles():
+            self.db.commit()
+            self.db.clearCache()
+            form = cgi.FieldStorage()
+            form.list = [
+                cgi.MiniFieldStorage('@fields',
+                                     'title,assignedto.username,nosy'),
+                cgi.MiniFieldStorage('@verbose', '2'),
+            ]
+            if not hasattr(self.db, 'sql'):
+                results = self.server.get_collection('issue', form)
+                return results['data']['collection'], None
+            with mock.patch.object(self.db, 'sql', wraps=self.db.sql) as m:
+                results = self.server.get_collection('issue', form)
+            self.assertEqual(self.dummy_client.response_code, 200)
+            return results['data']['collection'], m.call_count
+
+        for i in range(3):
+            self.db.issue.create(title='issue %d' % i, assignedto=self.joeid,
+                                 nosy=['1', self.joeid])
+        collection, queries = get_titles()
+        self.assertEqual(len(collection), 3)
+        self.assertEqual(collection[0]['assignedto.username'], 'joe')
+        self.assertEqual(collection[0]['nosy'],
+                         [{'id': '1', 'link': self.url_pfx + 'user/1',
+                           'username': 'admin'},
+                          {'id': self.joeid,
+                           'link': self.url_pfx + 'user/' + self.joeid,
+                           'username': 'joe'}])
+
+        for i in range(3, 10):
+            self.db.issue.create(title='issue %d' % i, nosy=[self.joeid])
+        collection, more_queries = get_titles()
+        self.assertEqual([c['title'] for c in collection],
+                         ['issue %d' % i for i in range(10)])
+        self.assertEqual(collection[9]['nosy'][0]['username'], 'joe')
+        self.assertEqual(more_queries, queries)
+
+    def testCollectionStream(self):
+        '''Collections requested as ndjson or with @stream=true are
+           returned as an iterator of encoded chunks.
+        '''
+        for i in range(3):
+            self.db.issue.create(title='issue %d' % i, nosy=[self.joeid])
+        self.db.commit()
+        self.server.client.env.update({'REQUEST_METHOD': 'GET'})
+
+        form = cgi.FieldStorage()
+        form.list = [cgi.MiniFieldStorage('@fields', 'title,nosy')]
+        self.headers = {'accept': 'application/x-ndjson'}
+        results = self.server.dispatch('GET', '/rest/data/issue', form)
+        self.assertEqual(self.server.client.response_code, 200)
+        self.assertEqual(
+            self.server.client.additional_headers['Content-Type'],
+            'application/x-ndjson')
+        self.assertNotIsInstance(results, bytes)
+        lines = b2s(b''.join(results)).splitlines()
+        self.assertEqual([json.loads(line)['title'] for line in lines],
+                         ['issue 0', 'issue 1', 'issue 2'])
+        self.assertEqual(json.loads(lines[0])['nosy'],
+                         [{'id': self.joeid,
+                           'link': self.url_pfx + 'user/' + self.joeid}])
+
+        # the json document has the same collection as without @stream
+        del self.headers
+        expected = json.loads(b2s(self.server.dispatch(
+            'GET', '/rest/data/issue', form)))
+        form.list.append(cgi.MiniFieldStorage('@stream', 'true'))
+        results = self.server.dispatch('GET', '/rest/data/issue', form)
+        self.assertNotIsInstance(results, bytes)
+        self.assertEqual(json.loads(b2s(b''.join(results))), expected)
+
+        # a page of the collection, the total counts all items
+        form.list.append(cgi.MiniFieldStorage('@page_size', '2'))
+        form.list.append(cgi.MiniFieldStorage('@page_index', '2'))
+        results = self.server.dispatch('GET', '/rest/data/issue', form)
+        result = json.loads(b2s(b''.join(results)))['data']
+        self.assertEqual([c['title'] for c in result['collection']],
+                         ['issue 2'])
+        self.assertEqual(result['@total_size'], 3)
+
+        # other endpoints send a single json line
+        self.headers = {'accept': 'application/x-ndjson'}
+        results = self.server.dispatch('GET', '/rest/data/issue/1',
+                                       self.empty_form)
+        self.assertEqual(self.server.client.response_code, 200)
+        self.assertEqual(b2s(results).count('\n'), 1)
+        self.assertEqual(json.loads(b2s(results))['data']['id'], '1')
+
+    def testCollectionEmbed(self):
+        '''The items linked by the properties in @embed are returned
+           once in the included section, with the properties the user
+           may view.
+        '''
+        for i in range(3):
+            self.db.issue.create(title='issue %d' % i, status='1',
+                                 assignedto=self.joeid,
+                                 nosy=['1', self.joeid])
+        self.db.issue.create(title='issue 3', status='2')
+        self.db.commit()
+
+        form = cgi.FieldStorage()
+        form.list = [
+            cgi.MiniFieldStorage('@fields', 'title'),
+            cgi.MiniFieldStorage('@embed', 'assignedto,status'),
+            cgi.MiniFieldStorage('@embed', 'nosy'),
+        ]
+        results = self.server.get_collection('issue', form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        data = results['data']
+        self.assertEqual(len(data['collection']), 4)
+        included = data['included']
+        self.assertEqual(sorted(included), ['status', 'user'])
+        self.assertEqual([s['name'] for s in included['status']],
+                         ['unread', 'deferred'])
+        self.assertEqual(included['status'][0]['link'],
+                         self.url_pfx + 'status/1')
+        users = included['user']
+        self.assertEqual([u['id'] for u in users], ['1', self.joeid])
+        self.assertEqual(users[1]['username'], 'joe')
+        # joe may only view the address of his own user
+        self.assertNotIn('address', users[0])
+        self.assertEqual(users[1]['address'], 'random@home.org')
+
+        # the json stream has the same included section
+        form.list.append(cgi.MiniFieldStorage('@stream', 'true'))
+        self.server.output_format = 'json'
+        results = self.server.get_collection('issue', form)
+        streamed = results['data']
+        collection = [e for batch in streamed.batches for e in batch]
+        self.assertEqual(collection, data['collection'])
+        self.assertEqual(streamed['included'], included)
+
+        # only Link and Multilink properties can be embedded
+        form.list = [cgi.MiniFieldStorage('@embed', 'title')]
+        results = self.server.get_collection('issue', form)
+        self.assertEqual(self.dummy_client.response_code, 400)
+        self.assertEqual(results['error']['msg'].args[0],
+                         "Property title of class issue can not be "
+                         "embedded, it is not a Link or Multilink.")
+
+    def testAggregate(self):
+        '''The groups of issues with their counts, the filters and
+           permissions of a GET on the collection apply.
+        '''
+        self.db.issue.create(title='issue 0', status='1', priority='1')
+        self.db.issue.create(title='issue 1', status='1', priority='2')
+        self.db.issue.create(title='issue 2', status='2', priority='2')
+        self.db.issue.create(title='other', status='2')
+        self.db.commit()
+
+        form = cgi.FieldStorage()
+        form.list = [
+            cgi.MiniFieldStorage('@group_by', 'status,priority'),
+            cgi.MiniFieldStorage('@metrics', 'count,max(activity)'),
+            cgi.MiniFieldStorage('@verbose', '0'),
+        ]
+        self.server.client.env.update({'REQUEST_METHOD': 'GET'})
+        results = self.server.dispatch('GET', '/rest/data/issue/@aggregate',
+                                       form)
+        self.assertEqual(self.server.client.response_code, 200)
+        groups = json.loads(b2s(results))['data']['groups']
+        self.assertEqual([(g['status'], g['priority'], g['count'])
+                          for g in groups],
+                         [('1', '1', 1), ('1', '2', 1), ('2', None, 1),
+                          ('2', '2', 1)])
+        self.assertIn('max(activity)', groups[0])
+
+        # filtered, links with labels
+        form.list = [
+            cgi.MiniFieldStorage('@group_by', 'status'),
+            cgi.MiniFieldStorage('@verbose', '2'),
+            cgi.MiniFieldStorage('title', 'issue'),
+        ]
+        results = self.server.get_aggregate('issue', form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        self.assertEqual(results['data']['groups'], [
+            {'status': {'id': '1', 'link': self.url_pfx + 'status/1',
+                        'name': 'unread'}, 'count': 2},
+            {'status': {'id': '2', 'link': self.url_pfx + 'status/2',
+                        'name': 'deferred'}, 'count': 1}])
+
+        # the number of all issues
+        results = self.server.get_aggregate('issue', self.empty_form)
+        self.assertEqual(results['data']['groups'], [{'count': 4}])
+
+        form.list = [cgi.MiniFieldStorage('@group_by', 'title:week')]
+        results = self.server.get_aggregate('issue', form)
+        self.assertEqual(self.dummy_client.response_code, 400)
+
+        # joe may not search the address of other users
+        form.list = [cgi.MiniFieldStorage('@group_by', 'address')]
+        results = self.server.get_aggregate('user', form)
+        self.assertEqual(self.dummy_client.response_code, 403)
+
+    def testSummary(self):
+        '''The summary counts the journal entries of the last week,
+           it is reused until an issue changes.
+        '''
+        from unittest import mock
+
+        self.db.config['MAIL_DEBUG'] = os.path.join(self.dirname,
+                                                    'mail.log')
+        first = self.db.issue.create(title='first', status='1')
+        second = self.db.issue.create(title='second', status='2')
+        for i in range(2):
+            msg = self.db.msg.create(content='msg %d' % i, author=self.joeid)
+            self.db.issue.set(second, messages=self.db.issue.get(
+                second, 'messages') + [msg])
+        self.db.commit()
+
+        results = self.server.summary(self.empty_form)
+        self.assertEqual(self.dummy_client.response_code, 200)
+        data = results['data']
+        self.assertEqual([i['title'] for i in data['created']],
+                         ['first', 'second'])
+        self.assertEqual(sorted(data['summary']), ['deferred', 'unread'])
+        self.assertEqual(data['summary']['deferred'][0]['id'], second)
+        self.assertEqual([(n, i['title']) for n, i in data['most_discussed']],
+                         [(2, 'second'), (0, 'first')])
+
+        # the cached summary is used
+        with mock.patch.object(self.db.issue, 'journal_counts') as m:
+            self.assertEqual(self.server.summary(self.empty_form)['data'],
+                             data)
+        self.assertEqual(m.call_count, 0)
+
+        # until an issue changes
+        self.db.issue.set(first, title='changed')
+        self.db.commit()
+        data = self.server.summary(self.empty_form)['data']
+        self.assertEqual([i['title'] for i in data['created']],
+                         ['changed', 'second'])
+
+        # the messages are only counted on issues the user may see
+        # them, checked per issue for permissions with a check function
+        has_permission = self.db.security.hasPermission
+
+        def hasPermission(permission, userid, classname=None,
+                          property=None, itemid=None,
+                          skip_permissions_with_check=False):
+            if property == 'messages':
+                return (not skip_permissions_with_check and
+                        itemid == second)
+            return has_permission(permission, userid, classname, property,
+                                  itemid, skip_permissions_with_check)
+
+        msg = self.db.msg.create(content='hidden', author=self.joeid)
+        self.db.issue.set(first, title='first', messages=[msg])
+        self.db.commit()
+        with mock.patch.object(self.db.security, 'hasPermission',
+                               hasPermission):
+            data = self.server.summary(self.empty_form)['data']
+        self.assertEqual([(n, i['title']) for n, i in data['most_discussed']],
+                         [(2, 'second'), (0, 'first')])
+
+    def testDescribeCached(self):
+        '''The description of the rest endpoint is built once and
+           sent with an ETag, the attribute methods are kept too.
+        '''
+        from unittest import mock
+
+        self.headers = {}
+        first = self.server.dispatch('GET', "/rest", self.empty_form)
+        self.assertEqual(self.server.client.response_code, 200)
+        etag = self.server.client.additional_headers['ETag']
+        self.assertEqual(json.loads(b2s(first))['data']['default_version'],
+                         1)
+
+        server = RestfulInstance(self.dummy_client, self.db)
+        with mock.patch.object(server, 'build_describe') as m:
+            self.assertEqual(server.dispatch('GET', "/rest/",
+                                             self.empty_form), first)
+        self.assertEqual(m.call_count, 0)
+        self.assertEqual(self.server.client.additional_headers['ETag'],
+                         etag)
+        self.assertEqual(
+            self.server.client.additional_headers['Content-Type'],
+            "application/json")
+
+        # a client having the response gets a 304
+        self.headers = {"if-none-match": etag}
+        self.assertEqual(server.dispatch('GET', "/rest", self.empty_form),
+                         b"")
+        self.assertEqual(self.server.client.response_code, 304)
+
+        # the stats are not added to the shared response
+        self.headers = {}
+        form = cgi.FieldStorage()
+        form.list = [cgi.MiniFieldStorage('@stats', 'true')]
+        server = RestfulInstance(self.dummy_client, self.db)
+        self.assertIn('@stats', json.loads(b2s(server.dispatch(
+            'GET', "/rest", form)))['data'])
+        server = RestfulInstance(self.dummy_client, self.db)
+        self.assertEqual(server.dispatch('GET', "/rest", self.empty_form),
+                         first)
+
+        # OPTIONS on attributes
+        server.option_attribute('issue', '1', 'title', self.empty_form)
+        self.assertEqual(self.server.client.response_code, 204)
+        self.assertEqual(self.server.client.additional_headers['Allow'],
+                         "OPTIONS, GET, PUT, DELETE, PATCH")
+        self.assertIn("Accept-Patch", self.server.client.additional_headers)
+        del self.server.client.additional_headers["Accept-Patch"]
+        server.option_attribute('issue', '1', 'creator', self.empty_form)
+        self.assertEqual(self.server.client.additional_headers['Allow'],
+                         "OPTIONS, GET")
+        self.assertNotIn("Accept-Patch",
+                         self.server.client.additional_headers)
+        results = server.option_attribute('issue', '1', 'nosuch',
+                                          self.empty_form)
+        self.assertEqual(self.server.client.response_code, 404)
+        results = server.option_attribute('nosuch', '1', 'title',
+                                          self.empty_form)
+        self.assertEqual(self.server.client.response_code, 404)
+        self.assertEqual(results['error']['msg'].args[0],
+                         'Class nosuch not found')
+
+        # without optimize schema changes apply without a restart
+        self.instance.optimize = False
+        server = RestfulInstance(self.dummy_client, self.db)
+        with mock.patch.object(server, 'build_describe',
+                               wraps=server.build_describe) as m:
+            self.assertEqual(server.dispatch('GET', "/rest",
+                                             self.empty_form), first)
+        self.assertEqual(m.call_count, 1)
+
+    def testBatch(self):
+        '''A batch runs its operations in one transaction, a failing
+           operation rolls back the whole batch unless @atomic is false.
+        '''
+        from roundup.rest import SimulateFieldStorageFromJson
+
+        def batch(operations, **kw):
+            body = dict(kw, operations=operations)
+            payload = SimulateFieldStorageFromJson(json.dumps(body))
+            results = self.server.dispatch('POST', '/rest/batch', payload)
+            return json.loads(b2s(results))
+
+        def etag(item_id):
+            return calculate_etag(self.db.issue.getnode(item_id),
+                                  self.db.config['WEB_SECRET_KEY'])
+
+        issue1 = self.db.issue.create(title='one')
+        issue2 = self.db.issue.create(title='two')
+        self.db.commit()
+        self.server.client.env.update({'REQUEST_METHOD': 'POST'})
+
+        results = batch([
+            {'method': 'POST', 'path': '/data/issue',
+             'data': {'title': 'three'}},
+            {'method': 'PATCH', 'path': '/data/issue/' + issue1,
+             'data': {'@etag': etag(issue1), 'title': 'one changed'}},
+            {'method': 'DELETE', 'path': '/rest/data/issue/' + issue2,
+             'data': {'@etag': etag(issue2)}},
+            {'method': 'GET', 'path': '/data/issue/' + issue1,
+             'data': {'@fields': 'title'}},
+        ])
+        self.assertEqual(self.server.client.response_code, 200)
+        self.assertTrue(results['data']['@committed'])
+        statuses = [r['status'] for r in results['data']['results']]
+        self.assertEqual(statuses, [201, 200, 200, 200])
+        issue3 = results['data']['results'][0]['data']['id']
+        self.assertEqual(
+            results['data']['results'][3]['data']['attributes']['title'],
+            'one changed')
+        # the headers of the operations are not sent
+        self.assertNotIn('Location', self.server.client.additional_headers)
+        self.db.rollback()
+        self.assertEqual(self.db.issue.get(issue3, 'title'), 'three')
+        self.assertEqual(self.db.issue.get(issue1, 'title'), 'one changed')
+        self.assertTrue(self.db.issue.is_retired(issue2))
+
+        # a bad etag in the second operation rolls back the first
+        results = batch([
+            {'method': 'PATCH', 'path': '/data/issue/' + issue1,
+             'data': {'@etag': etag(issue1), 'title': 'lost'}},
+            {'method': 'PATCH', 'path': '/data/issue/' + issue3,
+             'data': {'@etag': '"bad"', 'title': 'lost'}},
+            {'method': 'DELETE', 'path': '/data/issue/' + issue3,
+             'data': {'@etag': etag(issue3)}},
+        ])
+        self.assertFalse(results['data']['@committed'])
+        self.assertEqual([r['status'] for r in results['data']['results']],
+                         [200, 412])
+        self.assertIn('error', results['data']['results'][1])
+        self.db.rollback()
+        self.assertEqual(self.db.issue.get(issue1, 'title'), 'one changed')
+        self.assertFalse(self.db.issue.is_retired(issue3))
+
+        # not atomic: operations are committed one by one
+        results = batch([
+            {'method': 'PATCH', 'path': '/data/issue/' + issue1,
+             'data': {'@etag': '"bad"', 'title': 'lost'}},
+            {'method': 'PATCH', 'path': '/data/issue/' + issue3,
+             'data': {'@etag': etag(issue3), 'title': 'kept'}},
+            {'method': 'GET', 'path': '/data/nosuchclass/1'},
+        ], **{'@atomic': False})
+        self.assertTrue(results['data']['@committed'])
+        self.assertEqual([r['status'] for r in results['data']['results']],
+                         [412, 200, 404])
+        self.db.rollback()
+        self.assertEqual(self.db.issue.get(issue1, 'title'), 'one changed')
+        self.assertEqual(self.db.issue.get(issue3, 'title'), 'kept')
+
+        # invalid batches
+        for operations in ([], [{'method': 'GET'}],
+                           [{'method': 'POST', 'path': '/batch',
+                             'data': {'operations': []}}]):
+            results = batch(operations)
+            self.assertEqual(self.server.client.response_code, 400)
+            self.assertIn('error', results)
+
+    def testBatchRateLimit(self):
+        '''A batch counts as one api call per operation'''
+        from roundup.rest import SimulateFieldStorageFromJson
+
+        self.db.config['WEB_API_CALLS_PER_INTERVAL'] = 5
+        self.db.config['WEB_API_INTERVAL_IN_SEC'] = 3600
+        self.server.client.env.update({'REQUEST_METHOD': 'POST'})
+        get = {'method': 'GET', 'path': '/data/user/' + self.joeid}
+        payload = SimulateFieldStorageFromJson(
+            json.dumps({'operations': [get] * 4}))
+        self.server.dispatch('POST', '/rest/batch', payload)
+        self.assertEqual(self.server.client.response_code, 200)
+        self.assertEqual(
+            self.server.client.additional_headers['X-RateLimit-Remaining'],
+            '1')
+
+        payload = SimulateFieldStorageFromJson(
+            json.dumps({'operations': [get] * 2}))
+        results = json.loads(b2s(self.server.dispatch(
+            'POST', '/rest/batch', payload)))
+        self.assertEqual(self.server.client.response_code, 429)
+        self.assertIn('Api rate limits exceeded', results['error']['msg'])
+
+        self.db.config['WEB_API_CALLS_PER_INTERVAL'] = 0
+
     def testBinaryFieldStorage(self):
         ''' attempt to exercise all paths in the BinaryFieldStorage
             class
@@ -2232,7 +2903,7 @@ class TestCase():
                  "uri": "/rest/data/msg/1/binary_content",
                  "error": {'error':
                            {'status': 400, 'msg':
-                            'Unable to parse Accept Header. Invalid media type: q=2. Acceptable types: */*, application/*, application/json'}},
+                            'Unable to parse Accept Header. Invalid media type: q=2. Acceptable types: */*, application/*, application/json, application/x-ndjson'}},
                  "has_nosniff": False,
                  }),
             (# use text/* but override with extension of .json get back json
@@ -2252,7 +2923,7 @@ class TestCase():
                  "uri": "/rest/data/msg/2/binary_content.jon",
                  "error": {'error':
                            {'status': 406, 'msg':
-                            "Content type 'jon' requested in URL is not available.\nAcceptable types: json\n"}},
+                            "Content type 'jon' requested in URL is not available.\nAcceptable types: json, ndjson\n"}},
                  "has_nosniff": False,
                 }),
         ]
@@ -2995,7 +3666,7 @@ class TestCase():
 
         json_dict = json.loads(b2s(results))
         response= ("Content type 'jon' requested in URL is not available.\n"
-                 "Acceptable types: json%s\n") % includexml
+                 "Acceptable types: json, ndjson%s\n") % includexml
         self.assertEqual(json_dict['error']['msg'], response)
 
         # TEST #9
@@ -3080,6 +3751,10 @@ class TestCase():
                       "rel": "self",
                       "uri": "http://tracker.example/cgi-bin/roundup.cgi/bugs/rest"
                   },
+                  {
+                      "rel": "batch",
+                      "uri": "http://tracker.example/cgi-bin/roundup.cgi/bugs/rest/batch"
+                  },
                   {
                       "rel": "data",
                       "uri": "http://tracker.example/cgi-bin/roundup.cgi/bugs/rest/data"
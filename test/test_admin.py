@@ -21,6 +21,20 @@ from roundup.admin import AdminTool
 from .test_mysql import skip_mysql
 from .test_postgresql import skip_postgresql
 
+try:
+    import jinja2  # noqa: F401
+    skip_jinja2 = lambda func, *args, **kwargs: func
+except ImportError:
+    skip_jinja2 = pytest.mark.skip(
+        reason='Skipping Jinja2 tests: jinja2 library not available')
+
+try:
+    import chameleon  # noqa: F401
+    skip_chameleon = lambda func, *args, **kwargs: func
+except ImportError:
+    skip_chameleon = pytest.mark.skip(
+        reason='Skipping Chameleon tests: chameleon library not available')
+
 #from roundup import instance
 
 # https://stackoverflow.com/questions/4219717/how-to-assert-output-with-nosetest-unittest-in-python
@@ -1349,6 +1363,241 @@ class AdminTest(object):
         # -----
         AdminTool.my_input = orig_input
 
+    def testIndexqueue(self):
+        self.install_init(settings="mail_domain=example.com," +
+                          "mail_host=localhost," +
+                          "tracker_web=http://test/," +
+                          "rdbms_name=rounduptest," +
+                          "rdbms_user=rounduptest," +
+                          "rdbms_password=rounduptest," +
+                          "rdbms_template=template0," +
+                          "indexer=native," +
+                          "indexer_deferred=yes")
+
+        # drain the queue filled by initialise
+        self.admin=AdminTool()
+        sys.argv=['main', '-i', self.dirname, 'indexqueue', 'run']
+        ret = self.admin.main()
+        self.assertEqual(ret, 0)
+
+        # create an issue
+        self.admin=AdminTool()
+        sys.argv=['main', '-i', self.dirname, 'create', 'issue',
+                  'title="foo bar"']
+        ret = self.admin.main()
+
+        self.admin=AdminTool()
+        with captured_output() as (out, err):
+            sys.argv=['main', '-i', self.dirname, 'indexqueue']
+            ret = self.admin.main()
+        self.assertEqual(ret, 0)
+        # anydbm queues the title on create and on commit
+        self.assertRegex(out.getvalue(), r'^[12] queued, oldest \d+ seconds')
+
+        # the title is not indexed yet
+        from roundup import instance
+        tracker = instance.open(self.dirname)
+        db = tracker.open('admin')
+        self.assertEqual(list(db.indexer.find(['foo'])), [])
+        db.close()
+
+        self.admin=AdminTool()
+        sys.argv=['main', '-i', self.dirname, 'indexqueue', 'run',
+                  'batch=10']
+        ret = self.admin.main()
+        self.assertEqual(ret, 0)
+
+        db = tracker.open('admin')
+        self.assertEqual([tuple(r) for r in db.indexer.find(['foo'])],
+                         [('issue', '1', 'title')])
+        db.close()
+
+        self.admin=AdminTool()
+        with captured_output() as (out, err):
+            sys.argv=['main', '-i', self.dirname, 'indexqueue']
+            ret = self.admin.main()
+        self.assertEqual(out.getvalue().strip(), '0 queued, oldest 0 seconds')
+
+        self.admin=AdminTool()
+        with captured_output() as (out, err):
+            sys.argv=['main', '-i', self.dirname, 'indexqueue', 'run',
+                      'batch=a']
+            ret = self.admin.main()
+        self.assertEqual(ret, 1)
+        self.assertIn('batch and interval must be numbers', out.getvalue())
+
+    def testIndexqueueReject(self):
+        """An item failing to index does not block the queue"""
+        from unittest import mock
+        self.install_init(settings="mail_domain=example.com," +
+                          "mail_host=localhost," +
+                          "tracker_web=http://test/," +
+                          "rdbms_name=rounduptest," +
+                          "rdbms_user=rounduptest," +
+                          "rdbms_password=rounduptest," +
+                          "rdbms_template=template0," +
+                          "indexer=native," +
+                          "indexer_deferred=yes")
+
+        from roundup import instance
+        tracker = instance.open(self.dirname)
+        db = tracker.open('admin')
+        while db.indexer.process():
+            pass
+        bad = db.issue.create(title='foo bad')
+        good = db.issue.create(title='foo good')
+        db.commit()
+
+        index = db.issue.index
+        def failing_index(itemid):
+            if itemid == bad:
+                raise ValueError('broken item')
+            return index(itemid)
+
+        with mock.patch.object(db.issue, 'index', failing_index):
+            self.assertTrue(db.indexer.process())
+        self.assertEqual(db.indexer.status(), (0, 0))
+        self.assertEqual([tuple(r) for r in db.indexer.find(['foo'])],
+                         [('issue', good, 'title')])
+        with open(db.indexer.reject_file) as f:
+            self.assertEqual(f.read(), 'issue\t%s\n' % bad)
+        db.close()
+
+    def testIndexqueueHtml(self):
+        self.install_init(settings="mail_domain=example.com," +
+                          "mail_host=localhost," +
+                          "tracker_web=http://test/," +
+                          "rdbms_name=rounduptest," +
+                          "rdbms_user=rounduptest," +
+                          "rdbms_password=rounduptest," +
+                          "rdbms_template=template0," +
+                          "indexer=native," +
+                          "indexer_extract_max_size=40")
+
+        from roundup import instance
+        tracker = instance.open(self.dirname)
+        db = tracker.open('admin')
+        html = ('<html><body><p>Hello <b>world</b></p> ' + 'x' * 40 +
+                ' truncated</body></html>')
+        db.file.create(name='a.html', type='text/html', content=html)
+        db.issue.create(title='plain title')
+        db.commit()
+
+        # plain text is indexed directly, html is queued
+        self.assertEqual([tuple(r) for r in db.indexer.find(['plain'])],
+                         [('issue', '1', 'title')])
+        self.assertEqual(list(db.indexer.find(['hello'])), [])
+        db.close()
+
+        self.admin=AdminTool()
+        sys.argv=['main', '-i', self.dirname, 'indexqueue', 'run']
+        ret = self.admin.main()
+        self.assertEqual(ret, 0)
+
+        db = tracker.open('admin')
+        self.assertEqual([tuple(r) for r in db.indexer.find(['world'])],
+                         [('file', '1', 'content')])
+        # markup is not indexed and the content is cut at the size cap
+        self.assertEqual(list(db.indexer.find(['body'])), [])
+        self.assertEqual(list(db.indexer.find(['truncated'])), [])
+        db.close()
+
+    def testOptimizeindex(self):
+        self.install_init()
+        self.admin=AdminTool()
+        with captured_output() as (out, err):
+            sys.argv=['main', '-i', self.dirname, 'optimizeindex']
+            ret = self.admin.main()
+        self.assertEqual(ret, 0)
+        self.assertIn('indexer does not need optimizing', out.getvalue())
+
+    def testPrecompile(self):
+        self.install_init()
+        self.admin=AdminTool()
+        with captured_output() as (out, err):
+            sys.argv=['main', '-i', self.dirname, 'precompile']
+            ret = self.admin.main()
+        self.assertEqual(ret, 1)
+        self.assertIn('The template cache is not enabled', out.getvalue())
+
+        shutil.rmtree(self.dirname)
+        self.install_init(settings="mail_domain=example.com," +
+                          "mail_host=localhost," +
+                          "tracker_web=http://test/," +
+                          "rdbms_name=rounduptest," +
+                          "rdbms_user=rounduptest," +
+                          "rdbms_password=rounduptest," +
+                          "rdbms_template=template0," +
+                          "template_cache=template-cache")
+        # templates compiled in memory by other tests are not stored
+        from roundup.cgi.engine_zopetal import Loader
+        Loader.templates.clear()
+        self.admin=AdminTool()
+        sys.argv=['main', '-i', self.dirname, 'precompile']
+        ret = self.admin.main()
+        self.assertEqual(ret, 0)
+        templates = [f for f in os.listdir(os.path.join(self.dirname, 'html'))
+                     if f.endswith('.html')]
+        cache = os.listdir(os.path.join(self.dirname, 'template-cache'))
+        self.assertEqual(len(cache), len(templates))
+
+    @skip_jinja2
+    def testPrecompileJinja2(self):
+        from unittest import mock
+        self.install_init(type="jinja2",
+                          settings="mail_domain=example.com," +
+                          "mail_host=localhost," +
+                          "tracker_web=http://test/," +
+                          "rdbms_name=rounduptest," +
+                          "rdbms_user=rounduptest," +
+                          "rdbms_password=rounduptest," +
+                          "rdbms_template=template0," +
+                          "template_cache=template-cache")
+        self.admin=AdminTool()
+        sys.argv=['main', '-i', self.dirname, 'precompile']
+        ret = self.admin.main()
+        self.assertEqual(ret, 0)
+        cache_dir = os.path.join(self.dirname, 'template-cache')
+        cache = os.listdir(cache_dir)
+        self.assertTrue(cache)
+        # no temporary files are left
+        self.assertEqual([f for f in cache if not f.endswith('.cache')], [])
+
+        # a new process loads the bytecode instead of compiling
+        from roundup import instance
+        from roundup.cgi.engine_jinja2 import Jinja2Loader
+        tracker = instance.open(self.dirname)
+        loader = Jinja2Loader(tracker.config['TEMPLATES'], cache_dir)
+        with mock.patch.object(loader._env, 'compile') as compile:
+            self.assertTrue(loader.load('issue.index'))
+        self.assertFalse(compile.called)
+        self.assertEqual(sorted(os.listdir(cache_dir)), sorted(cache))
+
+    @skip_chameleon
+    def testChameleonCache(self):
+        from roundup.cgi.engine_chameleon import Loader
+        template_dir = os.path.join(self.dirname, 'html')
+        cache_dir = os.path.join(self.dirname, 'template-cache')
+        os.makedirs(template_dir)
+        with open(os.path.join(template_dir, 'page.html'), 'w') as f:
+            f.write('<p tal:content="string:hello">x</p>\n')
+
+        loader = Loader(template_dir, cache_dir)
+        loader.precompile()
+        cache = [f for f in os.listdir(cache_dir) if f.endswith('.py')]
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(cache[0].startswith('page'))
+        mtime = os.stat(os.path.join(cache_dir, cache[0])).st_mtime_ns
+
+        # a new loader reuses the generated module
+        loader = Loader(template_dir, cache_dir)
+        self.assertEqual(loader.load('page')._pt().strip(),
+                         '<p>hello</p>')
+        self.assertEqual([f for f in os.listdir(cache_dir)
+                          if f.endswith('.py')], cache)
+        self.assertEqual(os.stat(os.path.join(cache_dir,
+                                              cache[0])).st_mtime_ns, mtime)
+
     def testReindex(self):
         ''' Note the tests will fail if you run this under pdb.
             the context managers capture the pdb prompts and this screws
@@ -8,7 +8,7 @@
 # but WITHOUT ANY WARRANTY; without even the implied warranty of
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
 
-import unittest, os, shutil, errno, sys, difflib, re, io
+import unittest, os, shutil, errno, sys, difflib, re, io, gzip
 
 import pytest
 import copy
@@ -3006,6 +3006,33 @@ class FormTestCase(FormTestParent, StringFragmentCmpHelper, testCsvExport, unitt
                          b"\"1\",\"foo1\xe4\",\"2\",\"[]\",\"4\",\"['3', '4', '5']\"\r\n",
                          output.getvalue())
 
+    def testCSVExportBatches(self):
+        cl = self._make_client(
+            {'@columns': 'id,title,status,keyword,assignedto,nosy'},
+            nodeid=None, userid='1')
+        cl.classname = 'issue'
+        for i in range(5):
+            self.db.issue.create(title='issue%d' % i, status=str(i % 3 + 1),
+                                 assignedto='3', nosy=['3', '4'][:i % 3])
+
+        def export(action, accept_encoding=None):
+            output = io.BytesIO()
+            cl.request = MockNull(headers={'accept-encoding': accept_encoding})
+            cl.request.wfile = output
+            cl.additional_headers = {}
+            action(cl).handle()
+            return output.getvalue()
+
+        for action in actions.ExportCSVAction, actions.ExportCSVWithIdAction:
+            expected = export(action)
+            self.assertEqual(len(expected.splitlines()), 6)
+            with patch.object(action, 'batch_size', 2):
+                self.assertEqual(export(action), expected)
+                self.assertEqual(gzip.decompress(export(action, 'gzip')),
+                                 expected)
+                self.assertEqual(cl.additional_headers['Content-Encoding'],
+                                 'gzip')
+
     def testCSVExportBadColumnName(self):
         cl = self._make_client({'@columns': 'falseid,name'}, nodeid=None,
             userid='1')
@@ -3250,6 +3277,132 @@ class TemplateHtmlRendering(unittest.TestCase, testFtsQuery):
         self.assertNotEqual(-1, result.index('ok message'))
         # print result
 
+    def testRenderContextChunked(self):
+        class Request:
+            def __init__(self, accept_encoding):
+                self.headers = {'accept-encoding': accept_encoding}
+                self.wfile = io.BytesIO()
+            def start_response(self, headers, response):
+                self.response_headers = dict(headers)
+
+        def no_csrf(page):
+            # the csrf token differs for every page
+            return re.sub(r'value="[\w-]{20,}"', 'value=""', page)
+
+        def send_page(accept_encoding=''):
+            request = self.client.request = Request(accept_encoding)
+            self.client.headers_done = 0
+            self.client.additional_headers = {}
+            self.client.write_html(self.client.renderContext())
+            return request
+
+        self.client.form = db_test_base.makeForm({"@template": "index"})
+        self.client.path = 'user'
+        self.client.determine_context()
+        expected = no_csrf(self.client.renderContext())
+
+        # use the real write_html
+        del self.client.write_html
+        config = self.instance.config
+        config['WEB_HTML_CHUNK_SIZE'] = 1000
+        try:
+            request = send_page()
+            self.assertNotIn('Content-Length', request.response_headers)
+            self.assertEqual(
+                no_csrf(request.wfile.getvalue().decode('utf-8')), expected)
+
+            request = send_page('gzip')
+            self.assertNotIn('Content-Length', request.response_headers)
+            self.assertEqual(request.response_headers['Content-Encoding'],
+                             'gzip')
+            self.assertEqual(no_csrf(
+                gzip.decompress(request.wfile.getvalue()).decode('utf-8')),
+                expected)
+
+            # a page smaller than a chunk is sent with Content-Length
+            config['WEB_HTML_CHUNK_SIZE'] = 100000
+            request = send_page()
+            self.assertEqual(request.response_headers['Content-Length'],
+                             str(len(request.wfile.getvalue())))
+            self.assertEqual(
+                no_csrf(request.wfile.getvalue().decode('utf-8')), expected)
+
+            # an error is appended to a partially sent page
+            request = self.client.request = Request('')
+            self.client.headers_done = 0
+            output = self.client.chunked_output = client.ChunkedOutput(
+                self.client, 'text/html', 10)
+            output.write('<html>page start')
+            self.client.write_html('an error')
+            self.assertEqual(request.wfile.getvalue(),
+                             b'<html>page startan error')
+            self.assertIsNone(self.client.chunked_output)
+        finally:
+            config['WEB_HTML_CHUNK_SIZE'] = 0
+
+    def testHtmlETag(self):
+        class Request:
+            def __init__(self, inm):
+                self.headers = {'If-None-Match': inm}
+
+        self.client.form = db_test_base.makeForm({"@template": "item"})
+        self.client.path = 'issue1'
+        self.client.env['REQUEST_METHOD'] = 'GET'
+        self.client.determine_context()
+        self.db.commit()
+        self.assertIsNone(self.client.html_validator())
+
+        config = self.instance.config
+        config['WEB_HTML_ETAGS'] = True
+        try:
+            validator = self.client.html_validator()
+            self.assertIsNotNone(validator)
+            self.client.csrf_nonces = []
+            self.client.renderContext()
+            nonces = self.client.csrf_nonces
+            self.assertTrue(nonces)
+            etag = self.client.html_etag(validator, nonces)
+
+            # the page is not rendered again
+            for inm in (etag, 'W/%s' % etag, '"x", %s-gzip"' % etag[:-1]):
+                self.client.request = Request(inm)
+                self.assertRaises(exceptions.NotModified,
+                                  self.client.check_html_etag,
+                                  self.client.html_validator())
+            self.client.request = Request(etag)
+            self.client.check_html_etag(validator + ['changed'])
+
+            # not if a csrf token was used
+            otks = self.db.getOTKManager()
+            otks.destroy(nonces[0])
+            otks.commit()
+            self.client.check_html_etag(validator)
+
+            # or a change is committed
+            etag = self.client.html_etag(validator, nonces[1:])
+            self.client.request = Request(etag)
+            self.assertRaises(exceptions.NotModified,
+                              self.client.check_html_etag, validator)
+            self.db.status.set('1', name='fresh')
+            self.db.commit()
+            self.client.check_html_etag(self.client.html_validator())
+
+            # edits of the item within the same second are seen
+            import time
+            validators = [self.client.html_validator()]
+            for title in ('first', 'second'):
+                time.sleep(0.01)
+                self.db.issue.set('1', title=title)
+                self.db.commit()
+                validators.append(self.client.html_validator())
+            self.assertEqual(len(set(map(repr, validators))), 3)
+
+            # only views of pages are answered with a 304
+            self.client.env['REQUEST_METHOD'] = 'POST'
+            self.assertIsNone(self.client.html_validator())
+        finally:
+            config['WEB_HTML_ETAGS'] = False
+
     def testRenderAltTemplates(self):
         # check that right page is returned when rendering
         #  @template=oktempl|errortmpl
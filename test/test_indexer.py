@@ -65,6 +65,9 @@ class db:
     config = config()
     config[('main', 'indexer_stopwords')] = []
     config[('main', 'indexer_language')] = "english"
+    config[('main', 'indexer_cache_size')] = 0
+    config[('main', 'indexer_batch_size')] = 0
+    config[('main', 'indexer_batch_interval')] = 0
 
 class IndexerTest(anydbmOpener, unittest.TestCase):
 
@@ -225,6 +228,105 @@ class IndexerTest(anydbmOpener, unittest.TestCase):
             self.dex.add_text(('test', str(i), 'many'), 'many')
         self.assertEqual(len(self.dex.find(['many'])), 123)
 
+    def test_native_phrase(self):
+        """Test quoted phrase searches of the native indexers."""
+        if self.indexer_name != "native":
+            pytest.skip("phrase syntax tested only for native indexers")
+
+        self.dex.add_text(('test', '1', 'foo'), 'a the hello world')
+        self.dex.add_text(('test', '2', 'foo'), 'helh blah blah the world')
+        self.dex.add_text(('test', '3', 'foo'), 'blah hello the world')
+        self.dex.add_text(('test', '4', 'foo'), 'world hello blah blech')
+
+        # two separate words for sanity
+        self.assertSeqEqual(self.dex.find(['"hello" "world"']),
+                                                    [('test', '1', 'foo'),
+                                                     ('test', '3', 'foo'),
+                                                     ('test', '4', 'foo')
+                                                    ])
+        # the phrase, order matters
+        self.assertSeqEqual(self.dex.find(['"hello world"']),
+                                                    [('test', '1', 'foo'),
+                                                     ])
+        self.assertSeqEqual(self.dex.find(['"world hello"']),
+                                                    [('test', '4', 'foo'),
+                                                     ])
+        # stopwords in the phrase keep their place
+        self.assertSeqEqual(self.dex.find(['"hello the world"']),
+                                                    [('test', '3', 'foo'),
+                                                     ])
+        self.assertSeqEqual(self.dex.find(['"blah blah" world']),
+                                                    [('test', '2', 'foo'),
+                                                     ])
+        self.assertSeqEqual(self.dex.find(['"blah world"']), [])
+
+        # positions are updated when the text changes
+        self.dex.add_text(('test', '1', 'foo'), 'world a the hello')
+        self.assertSeqEqual(self.dex.find(['"hello world"']), [])
+
+    def test_native_prefix(self):
+        """Test prefix* searches of the native indexers."""
+        if self.indexer_name != "native":
+            pytest.skip("prefix syntax tested only for native indexers")
+
+        self.dex.add_text(('test', '1', 'foo'), 'a the hello world')
+        self.dex.add_text(('test', '2', 'foo'), 'helh blah blah the world')
+        self.dex.add_text(('test', '3', 'foo'), 'blah hello the world')
+        self.dex.add_text(('test', '4', 'foo'), 'hello blah blech the world')
+
+        self.assertSeqEqual(self.dex.find(['hel*']),
+                                                    [('test', '1', 'foo'),
+                                                     ('test', '2', 'foo'),
+                                                     ('test', '3', 'foo'),
+                                                     ('test', '4', 'foo')
+                                                    ])
+        self.assertSeqEqual(self.dex.find(['hell* bl*']),
+                                                    [('test', '3', 'foo'),
+                                                     ('test', '4', 'foo')
+                                                    ])
+        self.assertSeqEqual(self.dex.find(['blec* "hello blah"']),
+                                                    [('test', '4', 'foo'),
+                                                    ])
+        self.assertSeqEqual(self.dex.find(['hellos*']), [])
+
+    def test_search_cache(self):
+        """Test that repeated lookups are cached until the index
+           changes."""
+        self.dex.cache_size = 2
+        self.dex.add_text(('test', '1', 'foo'), 'a the hello world')
+        self.dex.add_text(('test', '2', 'foo'), 'blah blah the world')
+        self.dex.save_index()
+        generation = self.dex.get_generation()
+
+        self.assertSeqEqual(self.dex.getHits(['world'], None),
+                            [('test', '1', 'foo'), ('test', '2', 'foo')])
+        with mock.patch.object(self.dex, 'find') as find:
+            self.assertSeqEqual(self.dex.getHits(['world'], None),
+                                [('test', '1', 'foo'), ('test', '2', 'foo')])
+            self.assertFalse(find.called)
+
+        # saving without changes keeps the cache
+        self.dex.save_index()
+        self.assertEqual(self.dex.get_generation(), generation)
+
+        # changing the index invalidates the cache
+        self.dex.add_text(('test', '3', 'foo'), 'hello world')
+        self.dex.save_index()
+        self.assertNotEqual(self.dex.get_generation(), generation)
+        self.assertSeqEqual(self.dex.getHits(['world'], None),
+                            [('test', '1', 'foo'), ('test', '2', 'foo'),
+                             ('test', '3', 'foo')])
+
+        # the cache is limited to cache_size entries
+        self.dex.getHits(['hello'], None)
+        self.dex.getHits(['blah'], None)
+        entries = [name for name in os.listdir(self.dex.cache_dir)
+                   if name[0].isdigit()]
+        self.assertEqual(len(entries), 2)
+        # no temporary files are left behind
+        self.assertEqual([name for name in os.listdir(self.dex.cache_dir)
+                          if name.startswith('.')], [])
+
     def test_unicode(self):
         """Test with unicode words. see:
            https://issues.roundup-tracker.org/issue1344046"""
@@ -285,6 +387,73 @@ class XapianIndexerTest(IndexerTest):
     def tearDown(self):
         IndexerTest.tearDown(self)
 
+class BatchIndexerTest(unittest.TestCase):
+
+    def setUp(self):
+        from roundup.backends.indexer_common import BatchIndexer
+
+        class Indexer(BatchIndexer):
+            def __init__(self, db):
+                BatchIndexer.__init__(self, db)
+                self.written = []
+
+            def write_documents(self, documents):
+                self.written.append(sorted(documents.items()))
+
+        self.Indexer = Indexer
+
+    def test_batch_size(self):
+        dex = self.Indexer(db)
+        dex.batch_size = 3
+        self.assertTrue(dex.batching())
+        dex.batch_document('a', 'one')
+        dex.batch_document('a', 'two')
+        dex.save_batch()
+        self.assertEqual(dex.written, [])
+        dex.batch_document('b', 'three')
+        # rolled back documents are dropped
+        dex.rollback_batch()
+        dex.batch_document('d', 'five')
+        dex.save_batch()
+        self.assertEqual(dex.written, [])
+        dex.batch_document('e', 'six')
+        # the saved documents are written, not the uncommitted one
+        self.assertEqual(dex.written, [[('a', 'two'), ('d', 'five')]])
+        dex.rollback_batch()
+        dex.flush_batch()
+        self.assertEqual(dex.written, [[('a', 'two'), ('d', 'five')]])
+        self.assertIsNone(dex.batch_start)
+
+    def test_write_documents_required(self):
+        from roundup.backends.indexer_common import BatchIndexer
+        dex = BatchIndexer(db)
+        dex.batch_size = 10
+        dex.batch_document('a', 'one')
+        dex.save_batch()
+        self.assertRaises(NotImplementedError, dex.flush_batch)
+
+    def test_batch_interval(self):
+        dex = self.Indexer(db)
+        dex.batch_interval = 60
+        dex.batch_document('a', 'one')
+        dex.save_batch()
+        self.assertEqual(dex.written, [])
+        dex.batch_start -= 61
+        dex.save_batch()
+        self.assertEqual(dex.written, [[('a', 'one')]])
+
+        # pending documents are written by flush_batch
+        dex.batch_document('b', 'two')
+        dex.save_batch()
+        dex.flush_batch()
+        self.assertEqual(dex.written[1:], [[('b', 'two')]])
+
+    def test_no_batching(self):
+        dex = self.Indexer(db)
+        self.assertFalse(dex.batching())
+        self.assertFalse(dex.optimize())
+
+
 class Get_IndexerTest(anydbmOpener, unittest.TestCase):
     
     def setUp(self):
@@ -265,7 +265,8 @@ class postgresqlAdditionalDBTest():
         long_string = "a" * (self.db.indexer.maxlength + 5)
         with self.assertRaises(psycopg2.DataError) as ctx:
             # DataError : value too long for type character varying(10)
-            self.db.sql("insert into __words VALUES('%s',1)" % long_string)
+            self.db.sql("insert into __words (_word, _textid) "
+                        "VALUES('%s',1)" % long_string)
 
         self.assertIn("varying(10)", ctx.exception.args[0])
         self.db.rollback()  # clear cursor error so db.sql can be used again
@@ -285,12 +286,14 @@ class postgresqlAdditionalDBTest():
         self.assertEqual(self.db.db_version_updated, True)
 
         # This insert with text of expected column size should succeed
-        self.db.sql("insert into __words VALUES('%s',1)" % long_string)
+        self.db.sql("insert into __words (_word, _textid) "
+                    "VALUES('%s',1)" % long_string)
 
         # verify it fails at one more than the expected column size
         too_long_string = "a" * (self.db.indexer.maxlength + 6)
         with self.assertRaises(psycopg2.DataError) as ctx:
-            self.db.sql("insert into __words VALUES('%s',1)" % too_long_string)
+            self.db.sql("insert into __words (_word, _textid) "
+                        "VALUES('%s',1)" % too_long_string)
 
         # clean db handle
         self.db.rollback()
@@ -308,7 +311,19 @@ class postgresqlAdditionalDBTest():
         self.db.issue.create(title="flebble frooz")
         self.db.commit()
 
-        if self.db.database_schema['version'] != 8:
+        if self.db.database_schema['version'] > 8:
+            # make testUpgrades run the downgrade code only.
+            if hasattr(self, "downgrade_only"):
+                # we are being called by an earlier test
+                self.testUpgrade_8_to_9()
+                self.assertEqual(self.db.database_schema['version'], 8)
+            else:
+                # we are being called directly
+                self.downgrade_only = True
+                self.testUpgrade_8_to_9()
+                self.assertEqual(self.db.database_schema['version'], 8)
+                del(self.downgrade_only)
+        elif self.db.database_schema['version'] != 8:
             self.skipTest("This test only runs for database version 8")
 
         # change otk and session db's _time value to their original types
@@ -361,7 +376,8 @@ class postgresqlAdditionalDBTest():
             self.assertAlmostEqual(self.db.cursor.fetchone()[0],
                                       test_double, -1)
 
-        self.assertEqual(self.db.database_schema['version'], 8)
+        self.assertEqual(self.db.database_schema['version'],
+                         self.db.current_db_version)
 
 @skip_postgresql
 class postgresqlDBTest(postgresqlOpener, DBTest,
@@ -23,7 +23,7 @@ from roundup.backends.sessions_sqlite import Sessions, OneTimeKeys
 
 from .db_test_base import DBTest, ROTest, SchemaTest, ClassicInitTest, config
 from .db_test_base import ConcurrentDBTest, FilterCacheTest
-from .db_test_base import SpecialActionTest
+from .db_test_base import SpecialActionTest, HTMLItemTest
 from .rest_common  import TestCase as RestTestCase
 
 class sqliteOpener:
@@ -122,7 +122,19 @@ class sqliteDBTest(sqliteOpener, DBTest, unittest.TestCase):
         self.db.issue.create(title="flebble frooz")
         self.db.commit()
 
-        if self.db.database_schema['version'] != 8:
+        if self.db.database_schema['version'] > 8:
+            # make testUpgrades run the downgrade code only.
+            if hasattr(self, "downgrade_only"):
+                # we are being called by an earlier test
+                self.testUpgrade_8_to_9()
+                self.assertEqual(self.db.database_schema['version'], 8)
+            else:
+                # we are being called directly
+                self.downgrade_only = True
+                self.testUpgrade_8_to_9()
+                self.assertEqual(self.db.database_schema['version'], 8)
+                del(self.downgrade_only)
+        elif self.db.database_schema['version'] != 8:
             self.skipTest("This test only runs for database version 8")
 
         # set up separate session/otk db's.
@@ -179,7 +191,8 @@ class sqliteDBTest(sqliteOpener, DBTest, unittest.TestCase):
             self.assertAlmostEqual(Bdb.cursor.fetchone()[0],
                                       test_double, -1)
 
-        self.assertEqual(self.db.database_schema['version'], 8)
+        self.assertEqual(self.db.database_schema['version'],
+                         self.db.current_db_version)
 
 
 class sqliteROTest(sqliteOpener, ROTest, unittest.TestCase):
@@ -205,6 +218,9 @@ class sqliteSpecialActionTestCase(sqliteOpener, SpecialActionTest,
                                   unittest.TestCase):
     backend = 'sqlite'
 
+class sqliteHTMLItemTest(sqliteOpener, HTMLItemTest, unittest.TestCase):
+    backend = 'sqlite'
+
 
 from .session_common import SessionTest
 class sqliteSessionTest(sqliteOpener, SessionTest, unittest.TestCase):
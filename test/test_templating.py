@@ -1,3 +1,4 @@
+import os
 import unittest
 import time
 
@@ -10,6 +11,7 @@ from .html_norm import NormalizingHtmlParser
 
 
 import pytest
+from unittest import mock
 from .pytest_patcher import mark_class
 
 try:
@@ -105,6 +107,7 @@ class TemplatingTestCase(unittest.TestCase):
         self.client.db.getuid = lambda : 10
         self.client.db.config = MockConfig (
             {'WEB_CSRF_TOKEN_LIFETIME': 10,
+             'DATABASE': 'db',
              'MARKDOWN_BREAK_ON_NEWLINE': False,
              'WEB_USE_TOKENLESS_CSRF_PROTECTION': False})
 
@@ -534,6 +537,68 @@ class HTMLClassTestCase(TemplatingTestCase) :
                                    designator)
             self.assertEqual(p.hyperlinked(), designator)
 
+    def test_string_render_cache(self):
+        roundup.cgi.templating._render_cache.clear()
+        text = 'see issue1 and issue11 at http://example.com'
+        p = StringHTMLProperty(self.client, 'msg', '1', None, 'content', text)
+        expected = ('see <a href="issue1">issue1</a> and issue11 at '
+                    '<a href="http://example.com" rel="nofollow noopener">'
+                    'http://example.com</a>')
+        self.assertEqual(p.hyperlinked(), expected)
+        self.assertEqual(len(roundup.cgi.templating._render_cache), 1)
+
+        # unchanged content is not rendered again
+        p = StringHTMLProperty(self.client, 'msg', '1', None, 'content', text)
+        with mock.patch.object(StringHTMLProperty, 'hyper_re') as hyper_re:
+            self.assertEqual(p.hyperlinked(), expected)
+            self.assertFalse(hyper_re.sub.called)
+            # other options are rendered
+            p.wrapped(columns=20)
+            self.assertTrue(hyper_re.sub.called)
+
+        # changed content is rendered
+        p = StringHTMLProperty(self.client, 'msg', '1', None, 'content',
+                               text + '.')
+        self.assertEqual(p.hyperlinked(), expected + '.')
+
+        # a created item is linked
+        getclass = self.client.db.getclass
+        def getclass_all(name):
+            cl = getclass(name)
+            cl.hasnode = lambda id: True
+            return cl
+        self.client.db.getclass = getclass_all
+        p = StringHTMLProperty(self.client, 'msg', '1', None, 'content', text)
+        self.assertEqual(p.hyperlinked(), expected.replace(
+            'issue11', '<a href="issue11">issue11</a>'))
+
+        # the cache size is bounded
+        with mock.patch('roundup.cgi.templating.RENDER_CACHE_SIZE', 2):
+            for i in range(3):
+                StringHTMLProperty(self.client, 'msg', str(i), None,
+                                   'content', text).hyperlinked()
+        self.assertEqual(len(roundup.cgi.templating._render_cache), 2)
+
+        # the cache is shared by the threads of roundup-server
+        import threading
+        errors = []
+        def render(n):
+            try:
+                for i in range(200):
+                    StringHTMLProperty(self.client, 'msg', str(i % 7), None,
+                                       'content', text).hyperlinked()
+            except Exception as e:
+                errors.append(e)
+        with mock.patch('roundup.cgi.templating.RENDER_CACHE_SIZE', 3):
+            threads = [threading.Thread(target=render, args=(n,))
+                       for n in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(roundup.cgi.templating._render_cache), 3)
+
 
     @skip_rst
     def test_string_rst(self):
@@ -1592,6 +1657,67 @@ class ZUtilsTestcase(TemplatingTestCase):
             # use no attribute name
             self.assertIs(i.same_part(None, item2, item3), False)
 
+
+class ZopeTalLoaderTestCase(unittest.TestCase):
+    template = ('<p tal:content="python:1 + 2">x</p>'
+                '<span tal:replace="string:a${options/x}">y</span>')
+
+    def setUp(self):
+        import tempfile
+        self.dirname = tempfile.mkdtemp()
+        self.template_dir = os.path.join(self.dirname, 'html')
+        self.cache_dir = os.path.join(self.dirname, 'cache')
+        os.mkdir(self.template_dir)
+        with open(os.path.join(self.template_dir, 'page.html'), 'w') as f:
+            f.write(self.template)
+
+    def tearDown(self):
+        import shutil
+        from roundup.cgi.engine_zopetal import Loader
+        Loader.templates.clear()
+        shutil.rmtree(self.dirname)
+
+    def test_compiled_cache(self):
+        from roundup.cgi.engine_zopetal import Loader, RoundupPageTemplate
+
+        Loader.templates.clear()
+        loader = Loader(self.template_dir, self.cache_dir)
+        loader.precompile()
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        expected = '<p>3</p>az\n'
+        self.assertEqual(loader.load('page').pt_render(
+            extra_context={'options': {'x': 'z'}}), expected)
+
+        # a new process loads the compiled program without compiling
+        Loader.templates.clear()
+        with mock.patch.object(RoundupPageTemplate, '_cook',
+                               side_effect=AssertionError):
+            pt = Loader(self.template_dir, self.cache_dir).load('page')
+        self.assertEqual(pt.pt_render(extra_context={'options': {'x': 'z'}}),
+                         expected)
+
+        # a changed template is compiled again
+        Loader.templates.clear()
+        with open(os.path.join(self.template_dir, 'page.html'), 'w') as f:
+            f.write('<b tal:content="python:2 * 3">x</b>')
+        pt = Loader(self.template_dir, self.cache_dir).load('page')
+        self.assertEqual(pt.pt_render(), '<b>6</b>\n')
+
+    def test_compiled_cache_write_error(self):
+        """A program that can not be stored is still used."""
+        import pickle
+        from roundup.cgi.engine_zopetal import Loader
+
+        Loader.templates.clear()
+        with mock.patch.object(pickle, 'Pickler') as pickler:
+            pickler.return_value.dump.side_effect = TypeError(
+                'cannot pickle')
+            pt = Loader(self.template_dir, self.cache_dir).load('page')
+        self.assertEqual(pt.pt_render(extra_context={'options': {'x': 'z'}}),
+                         '<p>3</p>az\n')
+        # no partial or temporary entry is left
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
 r'''
 class HTMLPermissions:
     def is_edit_ok(self):